@@ -0,0 +1,529 @@
+"""Local Shelly / WLED / Nanoleaf emulator with latency and fault injection.
+
+Serves the endpoints kitchenmove52.py talks to, each device on its own port:
+
+    Shelly Gen2  POST /rpc/Switch.Set, GET /rpc/Switch.Set?id=0&on=true,
+                 GET /rpc/Switch.GetStatus?id=0, POST /rpc (JSON-RPC),
+                 GET /rpc WebSocket with NotifyStatus on every switch change
+    WLED         GET /json/state, POST /json/state (partial update, "on":"t")
+    Nanoleaf     GET /api/v1/<key>/state[/on], PUT /api/v1/<key>/state
+
+Faults are drawn per request from a seeded RNG, so runs are reproducible:
+
+    --latency  [dev=]fixed:MS | uniform:LO,HI | normal:MEAN,SD | exp:MEAN
+    --loss     [dev=]P   request swallowed, no answer (client runs into its timeout)
+    --reset    [dev=]P   connection reset (RST) instead of an answer
+    --drip     [dev=]P   answer trickled out in 8-byte chunks, --drip-ms apart
+    --close    [dev=]P   answer with "Connection: close" and drop the keep-alive
+
+Without "dev=" a value applies to all devices. Point the app at the
+emulator by setting SHELLY_IP/WLED_IP/NANOLEAF_IP and the *_PORT values in
+Config to this host and the ports below.
+
+Usage:
+    python device_emulator.py
+    python device_emulator.py --latency normal:80,25 --latency wled=exp:150 \\
+        --loss 0.02 --reset shelly=0.01 --drip 0.05 --seed 7
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+DEVICES = ("shelly", "wled", "nanoleaf")
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+REASONS = {200: "OK", 204: "No Content", 400: "Bad Request", 401: "Unauthorized",
+           404: "Not Found"}
+
+
+# ==============================================================================
+# FAULT PROFILE
+# ==============================================================================
+class FaultProfile:
+    """Latency distribution and fault probabilities of one device"""
+
+    def __init__(self, rng, latency="fixed:0", loss=0.0, reset=0.0, drip=0.0, close=0.0,
+                 drip_ms=50):
+        self.rng = rng
+        self.latency = self.parse_latency(latency)
+        self.loss = loss
+        self.reset = reset
+        self.drip = drip
+        self.close = close
+        self.drip_ms = drip_ms
+
+    @staticmethod
+    def parse_latency(spec):
+        kind, _, args = spec.partition(":")
+        values = [float(v) for v in args.split(",")] if args else []
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "exp": 1}
+        if kind not in expected or len(values) != expected[kind]:
+            raise ValueError("bad latency spec {!r}".format(spec))
+        return kind, values
+
+    def delay(self):
+        """Seconds to wait before answering"""
+        kind, v = self.latency
+        if kind == "fixed":
+            ms = v[0]
+        elif kind == "uniform":
+            ms = self.rng.uniform(v[0], v[1])
+        elif kind == "normal":
+            ms = self.rng.gauss(v[0], v[1])
+        else:
+            ms = self.rng.expovariate(1 / v[0]) if v[0] > 0 else 0
+        return max(ms, 0) / 1000
+
+    def draw(self):
+        """Fault for one request: None, "loss", "reset", "drip" or "close" """
+        x = self.rng.random()
+        for name in ("loss", "reset", "drip", "close"):
+            p = getattr(self, name)
+            if x < p:
+                return name
+            x -= p
+        return None
+
+
+# ==============================================================================
+# DEVICE STATE
+# ==============================================================================
+class DeviceState:
+    """State of the three devices with the semantics of their APIs"""
+
+    def __init__(self, nanoleaf_key):
+        self.lock = threading.Lock()
+        self.nanoleaf_key = nanoleaf_key
+        self.shelly = {"id": 0, "source": "init", "output": False, "apower": 0.0,
+                       "voltage": 230.1, "current": 0.0, "temperature": {"tC": 41.2}}
+        self.wled = {"on": False, "bri": 128, "transition": 7, "ps": -1, "pl": -1,
+                     "nl": {"on": False, "dur": 60, "mode": 1, "tbri": 0},
+                     "seg": [{"id": 0, "start": 0, "stop": 60, "on": True, "bri": 255,
+                              "col": [[255, 160, 0], [0, 0, 0], [0, 0, 0]], "fx": 0}]}
+        self.nanoleaf = {"on": {"value": False}, "brightness": {"value": 80, "max": 100, "min": 0},
+                         "hue": {"value": 0, "max": 360, "min": 0},
+                         "sat": {"value": 0, "max": 100, "min": 0},
+                         "ct": {"value": 2700, "max": 6500, "min": 1200}, "colorMode": "ct"}
+        self.listeners = []  # called with the new Shelly output
+
+    # --- Shelly --------------------------------------------------------------
+    def shelly_set(self, on, source):
+        with self.lock:
+            was_on = self.shelly["output"]
+            if on == "toggle":
+                on = not was_on
+            self.shelly["output"] = bool(on)
+            self.shelly["source"] = source
+            self.shelly["apower"] = 42.0 if on else 0.0
+            self.shelly["current"] = 0.18 if on else 0.0
+        if was_on != bool(on):
+            for listener in list(self.listeners):
+                listener(bool(on))
+        return {"was_on": was_on}
+
+    def shelly_status(self):
+        with self.lock:
+            return dict(self.shelly)
+
+    def shelly_rpc(self, method, params):
+        """JSON-RPC method -> (result, error)"""
+        if params.get("id", 0) != 0:
+            return None, {"code": -105, "message": "Argument 'id', value {} not found!".format(params.get("id"))}
+        if method == "Switch.Set":
+            if "on" not in params:
+                return None, {"code": -103, "message": "Missing required argument 'on'!"}
+            return self.shelly_set(_as_bool(params["on"]), "http"), None
+        if method == "Switch.Toggle":
+            return self.shelly_set("toggle", "http"), None
+        if method == "Switch.GetStatus":
+            return self.shelly_status(), None
+        return None, {"code": 404, "message": "No handler for {}".format(method)}
+
+    # --- WLED ----------------------------------------------------------------
+    def wled_update(self, data):
+        with self.lock:
+            for key, value in data.items():
+                if key == "on":
+                    self.wled["on"] = (not self.wled["on"]) if value == "t" else bool(value)
+                elif key == "seg" and isinstance(value, list):
+                    for i, seg in enumerate(value):
+                        if i < len(self.wled["seg"]) and isinstance(seg, dict):
+                            self.wled["seg"][i].update(seg)
+                elif key in ("nl",) and isinstance(value, dict):
+                    self.wled["nl"].update(value)
+                elif key != "v":
+                    self.wled[key] = value
+            return json.loads(json.dumps(self.wled))
+
+    # --- Nanoleaf ------------------------------------------------------------
+    def nanoleaf_update(self, data):
+        with self.lock:
+            for key, value in data.items():
+                if key in self.nanoleaf and isinstance(value, dict) and "value" in value:
+                    self.nanoleaf[key]["value"] = value["value"]
+
+
+def _as_bool(value):
+    if isinstance(value, str):
+        return value.lower() in ("true", "1", "on")
+    return bool(value)
+
+
+# ==============================================================================
+# HTTP HANDLER
+# ==============================================================================
+class DeviceHandler(socketserver.StreamRequestHandler):
+    """Keep-alive HTTP/1.1 for one device, faults drawn per request"""
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        server = self.server
+        while True:
+            request = self._read_request()
+            if request is None:
+                return
+            method, path, headers, body = request
+            server.emulator.count(server.device, "requests")
+            if path.split("?")[0] == "/rpc" and headers.get("upgrade", "").lower() == "websocket":
+                self._websocket(headers)
+                return
+
+            fault = server.profile.draw()
+            time.sleep(server.profile.delay())
+            if fault:
+                server.emulator.count(server.device, fault)
+            if fault == "loss":
+                # Swallow the request; hold the connection until the client gives up
+                self._drain()
+                return
+            if fault == "reset":
+                self._reset()
+                return
+
+            status, payload = server.emulator.route(server.device, method, path, body)
+            keep_alive = headers.get("connection", "").lower() != "close" and fault != "close"
+            self._respond(status, payload, keep_alive, fault == "drip")
+            if not keep_alive:
+                return
+
+    def _read_request(self):
+        try:
+            line = self.rfile.readline(65537)
+        except OSError:
+            return None
+        if not line:
+            return None
+        try:
+            method, path, _ = line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            return None
+        headers = {}
+        while True:
+            header = self.rfile.readline(65537)
+            if header in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = header.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        body = self.rfile.read(int(headers.get("content-length", 0) or 0))
+        return method, path, headers, body
+
+    def _respond(self, status, payload, keep_alive, drip):
+        body = b"" if payload is None else json.dumps(payload, separators=(",", ":")).encode()
+        head = ("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n"
+                "Connection: {}\r\n\r\n").format(
+            status, REASONS.get(status, "OK"), len(body), "keep-alive" if keep_alive else "close")
+        data = head.encode() + body
+        try:
+            if not drip:
+                self.wfile.write(data)
+                return
+            pause = self.server.profile.drip_ms / 1000
+            for i in range(0, len(data), 8):
+                self.wfile.write(data[i:i + 8])
+                self.wfile.flush()
+                time.sleep(pause)
+        except OSError:
+            pass
+
+    def _reset(self):
+        # SO_LINGER 0: close() sends RST instead of FIN
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+
+    def _drain(self):
+        try:
+            self.connection.settimeout(60)
+            while self.connection.recv(4096):
+                pass
+        except OSError:
+            pass
+
+    # --- Shelly WebSocket /rpc -----------------------------------------------
+    def _websocket(self, headers):
+        if self.server.device != "shelly" or "sec-websocket-key" not in headers:
+            self._respond(400, {"error": "no websocket here"}, False, False)
+            return
+        accept = base64.b64encode(hashlib.sha1(
+            (headers["sec-websocket-key"] + WS_GUID).encode()).digest()).decode()
+        self.wfile.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                          "Connection: Upgrade\r\nSec-WebSocket-Accept: {}\r\n\r\n").format(accept).encode())
+        lock = threading.Lock()
+        peer = {"src": None}
+        state = self.server.emulator.state
+
+        def send(opcode, payload):
+            with lock:
+                try:
+                    self.wfile.write(_ws_frame(opcode, payload))
+                except OSError:
+                    pass
+
+        def notify(on):
+            if peer["src"]:
+                send(1, json.dumps({
+                    "src": "shellyplus1pm-emulator", "dst": peer["src"], "method": "NotifyStatus",
+                    "params": {"ts": round(time.time(), 2), "switch:0": {"id": 0, "output": on}},
+                }).encode())
+
+        state.listeners.append(notify)
+        try:
+            while True:
+                frame = _ws_read(self.rfile)
+                if frame is None:
+                    return
+                opcode, payload = frame
+                if opcode == 8:
+                    send(8, payload[:2])
+                    return
+                if opcode == 9:
+                    send(10, payload)
+                elif opcode == 1:
+                    try:
+                        message = json.loads(payload)
+                    except ValueError:
+                        continue
+                    # Any request with a src subscribes that src to notifications
+                    peer["src"] = message.get("src") or peer["src"]
+                    result, error = state.shelly_rpc(message.get("method", ""), message.get("params") or {})
+                    reply = {"id": message.get("id"), "src": "shellyplus1pm-emulator", "dst": peer["src"]}
+                    reply["error" if error else "result"] = error or result
+                    send(1, json.dumps(reply).encode())
+        finally:
+            state.listeners.remove(notify)
+
+
+def _ws_frame(opcode, payload):
+    n = len(payload)
+    if n < 126:
+        head = bytes((0x80 | opcode, n))
+    elif n < 65536:
+        head = bytes((0x80 | opcode, 126)) + struct.pack(">H", n)
+    else:
+        head = bytes((0x80 | opcode, 127)) + struct.pack(">Q", n)
+    return head + payload
+
+
+def _ws_read(rfile):
+    """One client frame (masked) -> (opcode, payload), None on EOF"""
+    head = rfile.read(2)
+    if len(head) < 2:
+        return None
+    n = head[1] & 0x7F
+    if n == 126:
+        n = struct.unpack(">H", rfile.read(2))[0]
+    elif n == 127:
+        n = struct.unpack(">Q", rfile.read(8))[0]
+    mask = rfile.read(4) if head[1] & 0x80 else b"\0\0\0\0"
+    data = rfile.read(n)
+    return head[0] & 0x0F, bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+
+class DeviceServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, emulator, device, profile):
+        self.emulator = emulator
+        self.device = device
+        self.profile = profile
+        super().__init__(address, DeviceHandler)
+
+
+# ==============================================================================
+# EMULATOR
+# ==============================================================================
+class Emulator:
+    """The three device servers; start() runs them in background threads"""
+
+    def __init__(self, bind="127.0.0.1", ports=None, profiles=None, seed=0,
+                 nanoleaf_key="emulatorkey"):
+        self.bind = bind
+        self.ports = ports or {"shelly": 8081, "wled": 8082, "nanoleaf": 16021}
+        self.state = DeviceState(nanoleaf_key)
+        rng = random.Random(seed)
+        self.profiles = profiles or {}
+        for device in DEVICES:
+            if device not in self.profiles:
+                self.profiles[device] = FaultProfile(random.Random(rng.random()))
+        self.stats = {device: {} for device in DEVICES}
+        self.stats_lock = threading.Lock()
+        self.servers = []
+
+    def count(self, device, what):
+        with self.stats_lock:
+            self.stats[device][what] = self.stats[device].get(what, 0) + 1
+
+    def route(self, device, method, path, body):
+        """(status, JSON payload or None) for one request"""
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {"error": "invalid json"}
+        path, _, query = path.partition("?")
+        params = dict(p.partition("=")[::2] for p in query.split("&") if p)
+        if device == "shelly":
+            return self._shelly(method, path, params, data)
+        if device == "wled":
+            return self._wled(method, path, data)
+        return self._nanoleaf(method, path, data)
+
+    def _shelly(self, method, path, params, data):
+        state = self.state
+        if path == "/rpc" and method == "POST":
+            result, error = state.shelly_rpc(data.get("method", ""), data.get("params") or {})
+            reply = {"id": data.get("id"), "src": "shellyplus1pm-emulator"}
+            reply["error" if error else "result"] = error or result
+            return 200, reply
+        if path.startswith("/rpc/"):
+            merged = dict(params)
+            merged.update(data if isinstance(data, dict) else {})
+            if "id" in merged:
+                merged["id"] = int(merged["id"])
+            result, error = state.shelly_rpc(path[5:], merged)
+            if error:
+                return (404 if error["code"] == 404 else 400), error
+            return 200, result
+        return 404, {"error": "not found"}
+
+    def _wled(self, method, path, data):
+        if path not in ("/json/state", "/json/state/"):
+            if path in ("/json", "/json/"):
+                return 200, {"state": self.state.wled_update({}), "info": {"ver": "0.14.0", "leds": {"count": 60}}}
+            return 404, {"error": 3}
+        if method == "GET":
+            return 200, self.state.wled_update({})
+        if method == "POST":
+            state = self.state.wled_update(data)
+            return 200, state if data.get("v") else {"success": True}
+        return 400, {"error": 1}
+
+    def _nanoleaf(self, method, path, data):
+        prefix = "/api/v1/{}".format(self.state.nanoleaf_key)
+        if not path.startswith(prefix):
+            return 401, None
+        rest = path[len(prefix):].rstrip("/")
+        with self.state.lock:
+            snapshot = json.loads(json.dumps(self.state.nanoleaf))
+        if method == "GET":
+            if rest == "":
+                return 200, {"name": "Nanoleaf Emulator", "model": "NL29", "state": snapshot}
+            if rest == "/state":
+                return 200, snapshot
+            key = rest[len("/state/"):]
+            if rest.startswith("/state/") and key in snapshot:
+                return 200, snapshot[key]
+            return 404, None
+        if method == "PUT" and rest == "/state":
+            self.state.nanoleaf_update(data)
+            return 204, None
+        return 400, None
+
+    def start(self):
+        for device in DEVICES:
+            server = DeviceServer((self.bind, self.ports[device]), self, device, self.profiles[device])
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+
+
+def _per_device(values, convert, default):
+    """["0.1", "wled=0.5"] -> {device: value}"""
+    result = {device: default for device in DEVICES}
+    for value in values or ():
+        device, sep, spec = value.partition("=")
+        targets = [device] if sep else DEVICES
+        if not sep:
+            spec = value
+        for target in targets:
+            if target not in result:
+                raise ValueError("unknown device {!r}".format(target))
+            result[target] = convert(spec)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate Shelly, WLED and Nanoleaf with fault injection")
+    parser.add_argument("--bind", default="127.0.0.1")
+    parser.add_argument("--shelly-port", type=int, default=8081)
+    parser.add_argument("--wled-port", type=int, default=8082)
+    parser.add_argument("--nanoleaf-port", type=int, default=16021)
+    parser.add_argument("--nanoleaf-key", default="emulatorkey")
+    parser.add_argument("--latency", action="append", metavar="[DEV=]SPEC")
+    parser.add_argument("--loss", action="append", metavar="[DEV=]P")
+    parser.add_argument("--reset", action="append", metavar="[DEV=]P")
+    parser.add_argument("--drip", action="append", metavar="[DEV=]P")
+    parser.add_argument("--close", action="append", metavar="[DEV=]P")
+    parser.add_argument("--drip-ms", type=int, default=50, help="Pause between dripped chunks")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        latency = _per_device(args.latency, lambda s: (FaultProfile.parse_latency(s), s)[1], "fixed:0")
+        loss = _per_device(args.loss, float, 0.0)
+        reset = _per_device(args.reset, float, 0.0)
+        drip = _per_device(args.drip, float, 0.0)
+        close = _per_device(args.close, float, 0.0)
+    except ValueError as e:
+        parser.error(str(e))
+
+    rng = random.Random(args.seed)
+    profiles = {
+        device: FaultProfile(random.Random(rng.random()), latency[device], loss[device],
+                             reset[device], drip[device], close[device], args.drip_ms)
+        for device in DEVICES
+    }
+    ports = {"shelly": args.shelly_port, "wled": args.wled_port, "nanoleaf": args.nanoleaf_port}
+    emulator = Emulator(args.bind, ports, profiles, args.seed, args.nanoleaf_key).start()
+    for device in DEVICES:
+        p = profiles[device]
+        print("{:<8} {}:{}  latency {}  loss {} reset {} drip {} close {}".format(
+            device, args.bind, ports[device], latency[device], p.loss, p.reset, p.drip, p.close))
+    print("Nanoleaf key: {} - Ctrl+C to stop".format(args.nanoleaf_key))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+        print(json.dumps(emulator.stats, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
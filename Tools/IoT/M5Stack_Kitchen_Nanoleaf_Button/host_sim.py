@@ -0,0 +1,592 @@
+"""Host-side simulation of kitchenmove52.py under CPython.
+
+Installs drop-in fakes for the MicroPython/M5Stack modules (M5, hardware,
+unit, machine, network, ntptime, usocket, ujson, ubinascii, uselect, gc) and
+a virtual clock behind time.time/time.sleep/time.ticks_ms, then runs
+KitchenLightOrchestrator.setup() and loop() unchanged. Sleeps only advance
+the virtual clock, so hours of kitchen operation run in seconds. ticks_ms
+counts from the simulated reset; until ntptime.settime() succeeds, the wall
+clock reads like the RTC after power-on (2000-01-01). gc.mem_alloc() counts
+what tracemalloc sees the app allocate through setup(), so the per-room bytes
+in the boot log are real, if in CPython object sizes.
+
+The devices (Shelly, WLED, Nanoleaf) are answered in-process by SimDevices.
+Only the blocking engine is simulated; uasyncio is left out, so the app
+falls back to its loop.
+
+Usage:
+    python host_sim.py                 # canned kitchen evening, 8 h
+    python host_sim.py --hours 24 --quiet
+    python host_sim.py --profile       # cProfile of the run
+    python host_sim.py --rooms 4       # four rooms; compare loop_us with --rooms 1
+    python host_sim.py --ntp-down --boot-press 0.5   # ready_ms / first_press_ms without NTP
+    python host_sim.py --wdt-reset     # RTC kept its time, NTP only corrects
+"""
+import argparse
+import binascii
+import calendar
+import cProfile
+import heapq
+import importlib
+import json
+import os
+import pstats
+import select
+import sys
+import tempfile
+import time as _time
+import tracemalloc
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 14 Nov 2025, 15:00 UTC (16:00 local): shortly before it gets dark
+DEFAULT_START = calendar.timegm((2025, 11, 14, 15, 0, 0))
+
+# What the RTC reads after power-on, before the first NTP sync
+UNSYNCED_EPOCH = calendar.timegm((2000, 1, 1, 0, 0, 0))
+
+TICKS_PERIOD = 1 << 30  # MicroPython ticks wrap like this on the ESP32
+
+# gc.mem_alloc/mem_free: a 148 KB heap, 48 KB of it taken by the firmware and
+# the imported app; the rest is what the app allocates, traced by tracemalloc
+HEAP_BYTES = 148 * 1024
+IMPORT_ALLOC = 48 * 1024
+
+
+# ==============================================================================
+# VIRTUAL CLOCK
+# ==============================================================================
+class VirtualClock:
+    """Simulated time; sleeping advances it instead of waiting"""
+
+    def __init__(self, start=DEFAULT_START):
+        self.now = float(start)
+        self.reset = self.now    # ticks count from here
+        self.offset = 0.0        # RTC error until NTP sets the clock
+        self.slept = 0.0
+        self.on_sleep = None     # Fires scripted inputs that fall into a sleep (IRQs)
+
+    def time(self):
+        # MicroPython on the ESP32 returns whole seconds
+        return int(self.now + self.offset)
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+            self.slept += seconds
+            if self.on_sleep:
+                self.on_sleep()
+
+    def sleep_ms(self, ms):
+        self.sleep(ms / 1000)
+
+    def ticks_ms(self):
+        return int((self.now - self.reset) * 1000) % TICKS_PERIOD
+
+    @staticmethod
+    def ticks_diff(a, b):
+        d = (a - b) % TICKS_PERIOD
+        return d - TICKS_PERIOD if d >= TICKS_PERIOD // 2 else d
+
+    @staticmethod
+    def ticks_add(a, b):
+        return (a + b) % TICKS_PERIOD
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def module(self):
+        """A `time` module replacement bound to this clock"""
+        mod = types.ModuleType("time")
+        mod.time = self.time
+        mod.sleep = self.sleep
+        mod.sleep_ms = self.sleep_ms
+        mod.ticks_ms = self.ticks_ms
+        mod.ticks_diff = self.ticks_diff
+        mod.ticks_add = self.ticks_add
+        # Real host time: only used to measure how long code runs (per-room loop cost)
+        mod.ticks_us = lambda: int(_time.perf_counter() * 1000000) % TICKS_PERIOD
+        mod.gmtime = lambda secs=None: _time.gmtime(self.time() if secs is None else secs)
+        return mod
+
+
+# ==============================================================================
+# SIMULATED DEVICES
+# ==============================================================================
+class SimDevices:
+    """HTTP endpoints of Shelly, WLED and Nanoleaf, answered in-process.
+    Devices of the first room are named "shelly", "wled", "nanoleaf"; those
+    of further rooms "<room>.shelly" and so on"""
+
+    KINDS = ("shelly", "wled", "nanoleaf")
+
+    def __init__(self):
+        self.on = {}             # device name -> output
+        self.hosts = {}          # ip -> (kind, device name)
+        self.calls = []          # (virtual time, device, request line)
+        self.switches = []       # (virtual time, device, on) for every write
+        self.counts = {}
+
+    shelly_on = property(lambda self: self.on.get("shelly", False))
+    wled_on = property(lambda self: self.on.get("wled", False))
+    nanoleaf_on = property(lambda self: self.on.get("nanoleaf", False))
+
+    def bind(self, config):
+        self.hosts = {}
+        for i, values in enumerate(config.RAEUME or ({},)):
+            prefix = values.get("RAUM_NAME", "raum{}".format(i)) + "." if i else ""
+            for kind in self.KINDS:
+                key = kind.upper() + "_IP"
+                self.hosts[values.get(key, getattr(config, key))] = (kind, prefix + kind)
+
+    def _switch(self, now, device, on):
+        was_on = self.on.get(device, False)
+        self.on[device] = on
+        self.switches.append((now, device, on))
+        return was_on
+
+    def handle(self, host, now, request_line, body):
+        """Returns (status, response body bytes) for one request"""
+        kind, device = self.hosts.get(host, ("?", "?"))
+        self.calls.append((now, device, request_line))
+        self.counts[device] = self.counts.get(device, 0) + 1
+        on = self.on.get(device, False)
+        if kind == "shelly":
+            if "Switch.Set" in request_line:
+                was_on = self._switch(now, device, bool(json.loads(body)["on"]))
+                return 200, json.dumps({"was_on": was_on}).encode()
+            if "Switch.GetStatus" in request_line:
+                return 200, json.dumps({"id": 0, "output": on}).encode()
+        elif kind == "wled":
+            if body:
+                self._switch(now, device, bool(json.loads(body).get("on", False)))
+                return 200, b'{"success":true}'
+            return 200, json.dumps({"on": on, "bri": 5}).encode()
+        elif kind == "nanoleaf":
+            if request_line.startswith("PUT"):
+                self._switch(now, device, bool(json.loads(body)["on"]["value"]))
+                return 204, b""
+            return 200, json.dumps({"on": {"value": on}}).encode()
+        return 404, b"{}"
+
+
+class FakeSocket:
+    """usocket.socket talking HTTP/1.1 keep-alive to SimDevices"""
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.peer = None
+        self.blocking = True
+        self.closed = False
+        self.outgoing = b""
+        self.incoming = b""
+
+    def settimeout(self, timeout):
+        pass
+
+    def setblocking(self, flag):
+        self.blocking = flag
+
+    def connect(self, addr):
+        self.peer = addr
+        self.sim.connects += 1
+
+    def send(self, data):
+        if self.closed:
+            raise OSError(9, "EBADF")
+        self.outgoing += bytes(data)
+        self._process()
+        return len(data)
+
+    write = send
+
+    def _process(self):
+        while b"\r\n\r\n" in self.outgoing:
+            head, rest = self.outgoing.split(b"\r\n\r\n", 1)
+            lines = head.split(b"\r\n")
+            length = 0
+            for line in lines[1:]:
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            if len(rest) < length:
+                return
+            body, self.outgoing = rest[:length], rest[length:]
+            status, reply = self.sim.devices.handle(
+                self.peer[0], self.sim.clock.now, lines[0].decode(), body)
+            self.incoming += (b"HTTP/1.1 %d OK\r\nContent-Type: application/json\r\n"
+                              b"Content-Length: %d\r\n\r\n" % (status, len(reply))) + reply
+
+    def recv(self, n):
+        if not self.incoming and not self.blocking:
+            raise OSError(11, "EAGAIN")
+        data, self.incoming = self.incoming[:n], self.incoming[n:]
+        return data
+
+    read = recv
+
+    def readinto(self, buf, n=0):
+        data = self.recv(n or len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    recv_into = readinto
+
+    def close(self):
+        self.closed = True
+
+
+# ==============================================================================
+# SIMULATED HARDWARE
+# ==============================================================================
+class SimButton:
+    """BtnA and the button pin; set() changes the level and fires the pin IRQ"""
+
+    def __init__(self):
+        self.pressed = False
+        self.pins = []
+
+    def isPressed(self):
+        return self.pressed
+
+    def set(self, pressed):
+        self.pressed = pressed
+        for pin in self.pins:
+            if pin.handler:
+                pin.handler(pin)
+
+
+class SimPIR:
+    """unit.PIRUnit: fire() calls the registered IRQ callback"""
+
+    IRQ_ACTIVE = 1
+    IRQ_NEGATIVE = 2
+
+    def __init__(self, port=None):
+        self.callbacks = {}
+        self.enabled = False
+
+    def set_callback(self, callback, trigger):
+        self.callbacks[trigger] = callback
+
+    def enable_irq(self):
+        self.enabled = True
+
+    def fire(self, trigger):
+        callback = self.callbacks.get(trigger)
+        if self.enabled and callback:
+            callback(self)
+
+
+# ==============================================================================
+# SIMULATION
+# ==============================================================================
+class Simulation:
+    """kitchenmove52 loaded against the fakes, with scripted inputs on the virtual clock"""
+
+    def __init__(self, start=DEFAULT_START, quiet=False, rooms=1, ntp_down=False, wdt_reset=False):
+        self.clock = VirtualClock(start)
+        self.started = self.clock.now
+        self.ntp_down = ntp_down
+        self.wdt_reset = wdt_reset
+        if not wdt_reset:
+            self.clock.offset = UNSYNCED_EPOCH - start  # Power-on: the RTC starts over
+        self.devices = SimDevices()
+        self.button = SimButton()
+        self.pirs = []           # One per room, in room order
+        self.pir = None          # The first room's
+        self.led_color = 0
+        self.wdt_feeds = 0
+        self.connects = 0
+        self.loops = 0
+        self.events = []         # heap of (virtual time, seq, callback)
+        self.seq = 0
+        self.tmp = tempfile.mkdtemp(prefix="kitchen_sim_")
+        self.app = self._import_app()
+        self.heap_used = IMPORT_ALLOC
+        tracemalloc.start()  # Until setup() is through: per-room bytes
+        self.orch = self.app.KitchenLightOrchestrator()
+        self.config = self.orch.config
+        self.config.FLIGHT_FILE_PREFIX = os.path.join(self.tmp, "flight")
+        if rooms > 1:
+            self.config.RAEUME = [{}] + [extra_room(i) for i in range(1, rooms)]
+            self.orch.raeume = []
+            self.orch.baue_raeume()
+        self.devices.bind(self.config)
+        self.clock.on_sleep = self.fire_due
+        self.loop_wall = 0.0
+        if quiet:
+            self.orch.logger.level = self.orch.logger.OFF
+
+    # --- fakes ---------------------------------------------------------------
+    def _fake_modules(self):
+        sim = self
+        mods = {}
+
+        m5 = types.ModuleType("M5")
+        m5.BtnA = self.button
+        m5.begin = lambda: None
+        m5.update = lambda: None
+        mods["M5"] = m5
+
+        hardware = types.ModuleType("hardware")
+
+        class RGB:
+            def __init__(self, **kwargs):
+                pass
+
+            def fill_color(self, color):
+                sim.led_color = color
+        hardware.RGB = RGB
+        mods["hardware"] = hardware
+
+        unit = types.ModuleType("unit")
+
+        def pir_unit(port):
+            sim.pirs.append(SimPIR(port))
+            sim.pir = sim.pirs[0]
+            return sim.pirs[-1]
+        unit.PIRUnit = pir_unit
+        unit.PIRUnit.IRQ_ACTIVE = SimPIR.IRQ_ACTIVE
+        mods["unit"] = unit
+
+        machine = types.ModuleType("machine")
+
+        class WDT:
+            def __init__(self, timeout=0):
+                pass
+
+            def feed(self):
+                sim.wdt_feeds += 1
+
+        class Pin:
+            IN, OUT, PULL_UP, IRQ_FALLING, IRQ_RISING = 1, 2, 4, 8, 16
+
+            def __init__(self, *args, **kwargs):
+                self.handler = None
+                sim.button.pins.append(self)
+
+            def value(self):
+                return 0 if sim.button.pressed else 1  # active low
+
+            def irq(self, handler=None, trigger=0, **kwargs):
+                self.handler = handler
+
+        class RTC:
+            memory_bytes = b""
+
+            def memory(self, data=None):
+                if data is None:
+                    return RTC.memory_bytes
+                RTC.memory_bytes = bytes(data)
+        machine.WDT = WDT
+        machine.Pin = Pin
+        machine.RTC = RTC
+        machine.PWRON_RESET, machine.HARD_RESET, machine.WDT_RESET = 1, 2, 3
+        machine.DEEPSLEEP_RESET, machine.SOFT_RESET = 4, 5
+        machine.reset_cause = lambda: machine.WDT_RESET if sim.wdt_reset else machine.PWRON_RESET
+        machine.freq = lambda: 240000000
+        machine.disable_irq = lambda: 0
+        machine.enable_irq = lambda state: None
+        mods["machine"] = machine
+
+        network = types.ModuleType("network")
+        network.STA_IF = 0
+
+        class WLAN:
+            def __init__(self, interface):
+                pass
+
+            def isconnected(self):
+                return True
+
+            def active(self, flag=None):
+                return True
+
+            def connect(self, *args):
+                pass
+        network.WLAN = WLAN
+        mods["network"] = network
+
+        ntptime = types.ModuleType("ntptime")
+        ntptime.host = ""
+
+        def settime():
+            if sim.ntp_down:
+                sim.clock.sleep(1)  # ntptime's socket timeout
+                raise OSError(110, "ETIMEDOUT")
+            sim.clock.offset = 0.0
+        ntptime.settime = settime
+        mods["ntptime"] = ntptime
+
+        usocket = types.ModuleType("usocket")
+        usocket.socket = lambda *args: FakeSocket(sim)
+        usocket.getaddrinfo = lambda host, port, *args: [(2, 1, 0, "", (host, port))]
+        usocket.AF_INET, usocket.SOCK_STREAM = 2, 1
+        mods["usocket"] = usocket
+
+        ujson = types.ModuleType("ujson")
+        ujson.dumps = lambda obj: json.dumps(obj, separators=(",", ":"))
+        ujson.loads = lambda data: json.loads(
+            bytes(data) if isinstance(data, (memoryview, bytearray)) else data)
+        mods["ujson"] = ujson
+        mods["ubinascii"] = binascii
+        mods["uselect"] = select
+
+        gc = types.ModuleType("gc")
+        gc.collect = lambda: None
+        gc.mem_free = lambda: HEAP_BYTES - sim.mem_alloc()
+        gc.mem_alloc = sim.mem_alloc
+        gc.threshold = lambda *args: None
+        mods["gc"] = gc
+
+        mods["time"] = self.clock.module()
+        mods["uasyncio"] = None  # blocking engine only
+        return mods
+
+    def _import_app(self):
+        """Import kitchenmove52 with the fakes in sys.modules, then restore them"""
+        fakes = self._fake_modules()
+        saved = {name: sys.modules.get(name) for name in fakes}
+        sys.modules.update(fakes)
+        sys.modules.pop("kitchenmove52", None)
+        if HERE not in sys.path:
+            sys.path.insert(0, HERE)
+        try:
+            return importlib.import_module("kitchenmove52")
+        finally:
+            sys.modules.pop("kitchenmove52", None)
+            for name, module in saved.items():
+                if module is None:
+                    sys.modules.pop(name, None)
+                else:
+                    sys.modules[name] = module
+
+    # --- scripted inputs -----------------------------------------------------
+    def at(self, offset, callback):
+        """Run callback once the virtual clock is offset seconds after now"""
+        self.seq += 1
+        heapq.heappush(self.events, (self.clock.now + offset, self.seq, callback))
+
+    def press(self, offset, duration=0.2):
+        """Button press of duration seconds (>= LONG_PRESS_THRESHOLD is a long press)"""
+        self.at(offset, lambda: self.button.set(True))
+        self.at(offset + duration, lambda: self.button.set(False))
+
+    def motion(self, offset, duration=2.0, room=0):
+        """PIR of room (index) reports motion for duration seconds"""
+        self.at(offset, lambda: self.pirs[room].fire(SimPIR.IRQ_ACTIVE))
+        self.at(offset + duration, lambda: self.pirs[room].fire(SimPIR.IRQ_NEGATIVE))
+
+    def mem_alloc(self):
+        """Heap in use. Traced until setup() is through, then held: tracing
+        would slow the loop about 5x"""
+        if tracemalloc.is_tracing():
+            self.heap_used = IMPORT_ALLOC + tracemalloc.get_traced_memory()[0]
+        return self.heap_used
+
+    def fire_due(self):
+        """Run the scripted inputs whose time has come, like IRQs between two instructions"""
+        while self.events and self.events[0][0] <= self.clock.now:
+            heapq.heappop(self.events)[2]()
+
+    # --- running -------------------------------------------------------------
+    def setup(self):
+        self.orch.setup()
+        self.mem_alloc()
+        tracemalloc.stop()
+
+    def run(self, seconds):
+        """Run loop() until seconds of virtual time have passed"""
+        end = self.clock.now + seconds
+        wall = _time.perf_counter()
+        while self.clock.now < end:
+            self.fire_due()
+            self.orch.loop()
+            self.loops += 1
+        self.loop_wall += _time.perf_counter() - wall
+
+    def summary(self):
+        return {
+            "virtual_hours": round((self.clock.now - self.started) / 3600, 2),
+            "loops": self.loops,
+            "requests": dict(self.devices.counts),
+            "connects": self.connects,
+            "reused": self.orch.connection_pool.reuse_count,
+            "shelly_on": self.devices.shelly_on,
+            "wled_on": self.devices.wled_on,
+            "loop_us": round(self.loop_wall / self.loops * 1e6, 1) if self.loops else None,
+            "room_loop_us": {raum.name: raum.schritt_us for raum in self.orch.raeume},
+            "ready_ms": self.orch.bereit_ms,
+            "first_press_ms": self.orch.raeume[0].erste_taste,
+            "ntp_synced": self.orch.ntp_sync.zeit_sync,
+        }
+
+
+def extra_room(i):
+    """Config.RAEUME entry of an additional simulated room: own devices and PIR, no button"""
+    return {"RAUM_NAME": "raum{}".format(i), "SHELLY_IP": "10.99.{}.51".format(i),
+            "WLED_IP": "10.99.{}.22".format(i), "NANOLEAF_IP": "10.99.{}.56".format(i),
+            "PIR_PINS": (i * 2 + 1, i * 2 + 2), "BUTTON_PIN": None}
+
+
+def kitchen_evening(sim):
+    """Canned scenario: people in and out of the kitchen over an evening"""
+    minute = 60
+    for start in (20, 95, 180):                  # three busy phases
+        for k in range(15):                      # motion every 20 s
+            sim.motion(start * minute + k * 20)
+    sim.press(100 * minute, 2.0)                 # long press: main light toggle
+    sim.press(130 * minute)                      # short press: WLED
+    sim.press(131 * minute)
+    sim.press(131 * minute + 0.3)                # double click: test mode
+    for room in range(1, len(sim.pirs)):         # other rooms: a visit each
+        for k in range(15):
+            sim.motion((30 + 20 * room) * minute + k * 20, room=room)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run kitchenmove52 on a virtual clock")
+    parser.add_argument("--hours", type=float, default=8.0)
+    parser.add_argument("--quiet", action="store_true", help="Suppress the app's log output")
+    parser.add_argument("--profile", action="store_true", help="Print a cProfile of the run")
+    parser.add_argument("--idle-ms", type=int, default=None,
+                        help="Override LOOP_IDLE_MS (longer idle sleeps run faster)")
+    parser.add_argument("--rooms", type=int, default=1,
+                        help="Number of rooms (extra rooms get their own devices and PIR)")
+    parser.add_argument("--ntp-down", action="store_true",
+                        help="NTP never answers (each attempt times out after 1 s)")
+    parser.add_argument("--wdt-reset", action="store_true",
+                        help="Boot after a watchdog reset: the RTC kept its time")
+    parser.add_argument("--boot-press", type=float, default=None, metavar="SECONDS",
+                        help="Short press this long after setup (time to first response)")
+    args = parser.parse_args()
+
+    sim = Simulation(quiet=args.quiet, rooms=args.rooms,
+                     ntp_down=args.ntp_down, wdt_reset=args.wdt_reset)
+    if args.idle_ms:
+        sim.config.LOOP_IDLE_MS = args.idle_ms
+    sim.setup()
+    if args.boot_press is not None:
+        sim.press(args.boot_press)
+    kitchen_evening(sim)
+
+    wall = _time.perf_counter()
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(sim.run, args.hours * 3600)
+    else:
+        sim.run(args.hours * 3600)
+    wall = _time.perf_counter() - wall
+
+    sim.orch.logger.flush_all()
+    print("Simulated {:.1f} h in {:.2f} s wall ({:.0f}x)".format(
+        args.hours, wall, args.hours * 3600 / wall if wall else 0))
+    print(json.dumps(sim.summary(), sort_keys=True))
+    if args.profile:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
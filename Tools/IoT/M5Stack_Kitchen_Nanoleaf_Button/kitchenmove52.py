@@ -2,6 +2,9 @@ import M5
 from M5 import BtnA
 import usocket as socket
 import ujson, time, ntptime, gc, network
+import ubinascii, random, heapq, math, struct, os
+import uselect
+from array import array
 import machine
 import sys
 try:
@@ -11,6 +14,10 @@ except ImportError:  # MicroPython variant without esp32 module
 from hardware import RGB
 from unit import PIRUnit
 from machine import WDT
+try:
+    import uasyncio as asyncio
+except ImportError:  # MicroPython build without uasyncio
+    asyncio = None
 
 # ==============================================================================
 # CONFIGURATION
@@ -21,6 +28,13 @@ class Config:
         self.DEBUG = debug
         self.TESTMODE = test_mode
         
+        # Logging: level DEBUG/INFO/WARN/ERROR, per-subsystem overrides e.g. {"pir": "WARN"}
+        self.LOG_LEVEL = "DEBUG" if test_mode else "INFO"
+        self.LOG_FILTER = {}
+        self.LOG_BUFFER_SIZE = 64   # Buffered lines; the oldest are dropped when full
+        self.LOG_FLUSH_BATCH = 16   # Lines printed per flush
+        self.LOG_FLUSH_MS = 200     # Flush period in async mode
+        
         if test_mode:
             self.INAKT_TIMEOUT = 60          # Test: 60 sec inactivity
             self.EVENT_THRESHOLD = 5         # Test: 5 PIR events needed
@@ -35,8 +49,15 @@ class Config:
             self.MANUAL_OVERRIDE_TIME = 900  # Prod: 900 sec (15 min)
             self.AUTO_ON_NICHT_NACH = 22 * 60  # Prod: 22:00 (10 PM)
             self.PIR_ACTIVE_INTERVAL = 20    # Prod: count sustained motion every 20 seconds
+        self.PIR_EVENT_CAPACITY = 32  # Ring size for window events (must be >= EVENT_THRESHOLD)
+        self.PIR_QUEUE_SIZE = 32      # IRQ edges waiting for dispatch (power of two)
 
         self.STATE_REFRESH_INTERVAL = 1200  # Periodic Shelly state poll (seconds)
+        
+        # Shelly Gen2 push: NotifyStatus over the /rpc WebSocket, polling only while it is down
+        self.SHELLY_PUSH_ENABLED = False
+        self.SHELLY_PUSH_PING = 60        # WebSocket ping interval (seconds)
+        self.SHELLY_PUSH_RECONNECT = 30   # First reconnect delay, doubles up to 600 seconds
         self.WLED_AUTO_OFF_SECONDS = 60
         self.WLED_LED_ON_SECONDS = 60
         self.WLED_LED_OFF_SECONDS = 30
@@ -47,14 +68,73 @@ class Config:
         self.NANOLEAF_IP = "10.80.23.56"
         self.NANOLEAF_PORT = 16021
         self.WLED_IP = "10.80.23.22"
+        self.WLED_PORT = 80
+        
+        # Address resolution
+        self.DNS_CACHE_DURATION = 3600  # Hostname lookups valid for 1 hour
+        self.DNS_NEGATIVE_TTL = 60      # Failed lookups are not retried for 60 seconds
+        
+        # HTTP keep-alive pool
+        self.HTTP_KEEPALIVE_IDLE = 1500 # Close pooled connections idle longer than this (seconds);
+                                        # above STATE_REFRESH_INTERVAL, so the periodic refresh keeps the
+                                        # Shelly connection warm. Dropped by the peer: transparent reconnect
+        self.HTTP_MAX_RESPONSE = 4096   # Preallocated response buffer per device (bytes)
         
         # NTP
         self.NTP_HOST = "ntp1.lrz.de"
         self.NTP_SYNC_INTERVAL = 43200  # 12 hours
+        self.NTP_RETRY = 30             # First retry after a failed attempt, doubles...
+        self.NTP_RETRY_MAX = 600        # ...up to this (seconds); the boot never waits for NTP
+        self.NTP_TIMEOUT = 1            # Seconds to wait for the server's answer
         
         # Button
         self.LONG_PRESS_THRESHOLD = 1.5  # seconds
         self.DOUBLE_CLICK_TIME = 0.5  # Max time between clicks for double click
+        self.LOOP_IDLE_MS = 100  # Longest sleep of the blocking loop while BtnA or push is polled
+        self.LOOP_IDLE_IRQ_MS = 1000  # Longest sleep when all inputs are IRQs (edges wake it)
+        self.LOOP_WAKE_MS = 10   # Blocking loop: how often an idle sleep checks for queued edges
+        
+        # Button input: pin IRQ with timestamped edges (falls back to BtnA polling)
+        self.BUTTON_IRQ = True
+        self.BUTTON_PIN = 41          # AtomS3 BtnA, active low
+        self.BUTTON_DEBOUNCE_MS = 20  # Edges closer than this to the last accepted one are bounce
+        self.EDGE_QUEUE_SIZE = 16     # Power of two
+
+        # Rooms: each entry overrides the values of this Config for one room (devices, pins,
+        # timeouts, scenes). Scheduler, connection pool, LED, NTP and darkness are shared.
+        # None = one room from the values above
+        self.RAUM_NAME = "kueche"
+        self.PIR_PINS = (1, 2)        # Grove port of the PIR unit
+        self.RAEUME = None
+        # e.g. [{"RAUM_NAME": "kueche"},
+        #       {"RAUM_NAME": "flur", "SHELLY_IP": "10.80.23.52", "WLED_IP": "10.80.23.23",
+        #        "PIR_PINS": (5, 6), "BUTTON_PIN": None, "INAKT_TIMEOUT": 120}]
+
+        # Async engine: inputs, LED, timers and network I/O as separate uasyncio tasks
+        self.ASYNC_ENGINE = False
+        self.INPUT_POLL_MS = 20         # Button polling period in async mode (BtnA fallback only)
+        
+        # Write-behind command queue
+        self.COMMAND_RETRIES = 5        # Retries per command before it is dropped
+        self.COMMAND_RETRY_DELAY = 1    # First retry delay, doubles up to 30 seconds
+        
+        # Circuit breakers (one per device)
+        self.BREAKER_THRESHOLD = 3        # Consecutive failures until a device is skipped
+        self.BREAKER_RECOVERY = 30        # First open period, doubles per failed probe
+        self.BREAKER_RECOVERY_MAX = 600   # Longest open period (seconds)
+        self.BREAKER_PROBE_TIMEOUT = 2.0  # Half-open probe must answer within (the loop keeps running)
+        
+        # Flight recorder: last events in RTC memory (survives WDT/soft resets), spilled to flash
+        self.FLIGHT_RECORDER_SIZE = 64    # Events kept in RTC memory (8 bytes each)
+        self.FLIGHT_SPILL_BATCH = 16      # Unsaved events per flash write
+        self.FLIGHT_SPILL_INTERVAL = 60   # Seconds between spill checks
+        self.FLIGHT_FILES = 4             # Flash files written in rotation
+        self.FLIGHT_FILE_MAX = 2048       # Bytes per file before moving to the next
+        self.FLIGHT_FILE_PREFIX = "/flight"
+        
+        # Input trace for trace_replay.py: PIR/button edges appended to this file (None = off)
+        self.TRACE_FILE = None            # e.g. "/trace.txt"
+        self.TRACE_BATCH = 32             # Lines per flash write
         
         # Hardware Watchdog
         self.WATCHDOG_TIMEOUT = 30000  # 30 seconds in milliseconds
@@ -77,7 +157,25 @@ class Config:
         }
         self.WLED_JSON_AUS = {"on": False}
         
-        # Sunset times by month
+        # Scenes for explicit room actions: target state per device, sent to all
+        # devices at once (devices that are disabled or already in the target
+        # state are skipped). The inactivity timeout only switches the Shelly off
+        self.SCENES = {
+            "raum_an": {"shelly": True, "nanoleaf": True},
+            "raum_aus": {"shelly": False, "nanoleaf": False, "wled": False},
+        }
+        self.SCENE_TIMEOUT = 5.0  # Socket timeout per device during a scene
+        
+        # Location for the sunset table (None = use the monthly sun_times below).
+        # The hand-tuned sun_times are no fixed offset from sunset (about -80 min
+        # in December, -165 min in June in Munich), so setting a location changes
+        # the switch times: calibrate SUN_OFFSET_MIN/SUN_ZENITH before enabling it
+        self.LATITUDE = None          # e.g. 48.14
+        self.LONGITUDE = None         # e.g. 11.58
+        self.SUN_ZENITH = 90.833      # Sunset; 96.0 = end of civil twilight
+        self.SUN_OFFSET_MIN = -90     # The kitchen gets dark well before sunset
+        
+        # Sunset times by month (used without LATITUDE/LONGITUDE)
         self.sun_times = { 
             1: {"sunset_schaltzeit": "15:00"},
             2: {"sunset_schaltzeit": "16:20"},
@@ -101,10 +199,23 @@ class Config:
             "AUS": 0x000000,
             "BLAU": 0x0000FF,
             "WEISS": 0xFFFFFF,
+            "ORANGE": 0xFF6000,  # Device offline (circuit breaker open)
         }
         
         # Cache settings
         self.CACHE_REFRESH_INTERVAL = self.STATE_REFRESH_INTERVAL
+        self.TOGGLE_CACHE_MAX_AGE = 60  # Toggle without prior read if the state was confirmed this recently
+
+class RaumConfig:
+    """Config of one room: its own entries from Config.RAEUME, everything
+    else is looked up in the shared Config"""
+    def __init__(self, basis, werte):
+        self.basis = basis
+        for name, wert in werte.items():
+            setattr(self, name, wert)
+
+    def __getattr__(self, name):
+        return getattr(self.basis, name)
 
 # ==============================================================================
 # TIME UTILITIES
@@ -112,6 +223,11 @@ class Config:
 class TimeUtils:
     """All time-related utilities"""
     
+    # Cached UTC offset, valid for epoch seconds in [_offset_von, _offset_bis)
+    _offset = 3600
+    _offset_von = 0
+    _offset_bis = 0
+    
     @staticmethod
     def format_debug_time(tm):
         """Format time for debug output"""
@@ -176,11 +292,11 @@ class TimeUtils:
         return days * 86400 + hour * 3600 + minute * 60 + second
     
     @staticmethod
-    def get_germany_offset():
-        """Get timezone offset for Germany"""
+    def _berechne_offset(now):
+        """Compute the timezone offset for Germany at epoch second now"""
         winter_offset = 3600
         summer_offset = 7200
-        utc_now = time.gmtime()
+        utc_now = time.gmtime(now)
         year = utc_now[0]
         # DST starts last Sunday of March at 01:00 UTC, ends last Sunday of October at 01:00 UTC
         start_day = TimeUtils.last_sunday(year, 3)
@@ -193,10 +309,42 @@ class TimeUtils:
         return winter_offset
     
     @staticmethod
-    def local_time():
-        """Get local German time"""
-        offset = TimeUtils.get_germany_offset()
-        return time.gmtime(time.time() + offset)
+    def get_germany_offset(now=None):
+        """Get timezone offset for Germany (cached until the next DST switch)"""
+        if now is None:
+            now = time.time()
+        if TimeUtils._offset_von <= now < TimeUtils._offset_bis:
+            return TimeUtils._offset
+        # Boundary passed or the clock stepped backwards: recompute
+        TimeUtils._offset = TimeUtils._berechne_offset(now)
+        TimeUtils._offset_von = now
+        TimeUtils._offset_bis = TimeUtils.next_dst_change(now)
+        return TimeUtils._offset
+    
+    @staticmethod
+    def invalidate_offset():
+        """Drop the cached offset, e.g. after the clock was set by NTP"""
+        TimeUtils._offset_bis = 0
+    
+    @staticmethod
+    def next_dst_change(now):
+        """Epoch of the next German DST switch after now (01:00 UTC, last Sunday of March/October)"""
+        utc = time.gmtime(now)
+        # Compare in Unix seconds, the device epoch may differ (2000 on ESP32)
+        now_unix = TimeUtils._seconds_since_epoch(utc[0], utc[1], utc[2], utc[3], utc[4], utc[5])
+        for y in (utc[0], utc[0] + 1):
+            for month in (3, 10):
+                wechsel = TimeUtils._seconds_since_epoch(y, month, TimeUtils.last_sunday(y, month), 1)
+                if wechsel > now_unix:
+                    return now + (wechsel - now_unix)
+        return now + 86400
+    
+    @staticmethod
+    def local_time(now=None):
+        """Get local German time (of epoch second now, default current time)"""
+        if now is None:
+            now = time.time()
+        return time.gmtime(now + TimeUtils.get_germany_offset(now))
 
 # ==============================================================================
 # COLOR UTILITIES
@@ -283,39 +431,736 @@ class SecretManager:
 # DNS CACHE
 # ==============================================================================
 class DNSCache:
-    """Caches DNS lookups to avoid blocking on repeated resolutions"""
+    """Shared address resolver for all device wrappers: IP literals are cached
+    once, hostnames for cache_duration, failures for negative_duration"""
     
     def __init__(self, config, debug_logger):
         self.config = config
         self.logger = debug_logger
-        self.cache = {}
-        self.cache_duration = 3600  # 1 hour
+        self.cache = {}  # host -> [addr, timestamp, ok, port]; timestamp None for IP literals
+        self.cache_duration = config.DNS_CACHE_DURATION
+        self.negative_duration = config.DNS_NEGATIVE_TTL
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def is_ip_literal(hostname):
+        """Check for a dotted IPv4 literal (no lookup needed)"""
+        teile = hostname.split(".")
+        if len(teile) != 4:
+            return False
+        for teil in teile:
+            if not teil.isdigit() or int(teil) > 255:
+                return False
+        return True
     
     def resolve(self, hostname, port):
         """Resolve hostname with caching"""
-        cache_key = "{}:{}".format(hostname, port)
-        now = time.time()
-        
-        # Check cache
-        if cache_key in self.cache:
-            addr, timestamp = self.cache[cache_key]
-            if now - timestamp < self.cache_duration:
-                return addr
+        eintrag = self.cache.get(hostname)
+        if eintrag and eintrag[3] == port:
+            if eintrag[1] is None:
+                self.hits += 1
+                return eintrag[0]
+            age = time.time() - eintrag[1]
+            if eintrag[2] and age < self.cache_duration:
+                self.hits += 1
+                return eintrag[0]
+            if not eintrag[2] and age < self.negative_duration:
+                self.hits += 1
+                raise OSError("DNS Fehler für {} (gecached)".format(hostname))
         
-        # Resolve and cache
+        self.misses += 1
+        if self.is_ip_literal(hostname):
+            addr = (hostname, port)
+            self.cache[hostname] = [addr, None, True, port]
+            return addr
+        return self._lookup(hostname, port)
+    
+    def _lookup(self, hostname, port):
+        """Blocking lookup, falls back to an expired entry on failure"""
+        now = time.time()
+        alt = self.cache.get(hostname)
         try:
             addr = socket.getaddrinfo(hostname, port)[0][-1]
-            self.cache[cache_key] = (addr, now)
-            self.logger.log("DNS aufgelöst: {} -> {}".format(hostname, addr))
+            self.cache[hostname] = [addr, now, True, port]
+            self.logger.debug("dns", "DNS aufgelöst: {} -> {}", hostname, addr)
             return addr
         except Exception as e:
-            self.logger.log("DNS Fehler für {}: {}".format(hostname, e))
+            self.logger.warn("dns", "DNS Fehler für {}: {}", hostname, e)
             # Return cached value if available, even if expired
-            if cache_key in self.cache:
-                addr, _ = self.cache[cache_key]
-                self.logger.log("Verwende abgelaufenen DNS-Cache für {}".format(hostname))
-                return addr
+            if alt and alt[2] and alt[3] == port:
+                alt[1] = now
+                self.logger.warn("dns", "Verwende abgelaufenen DNS-Cache für {}", hostname)
+                return alt[0]
+            self.cache[hostname] = [None, now, False, port]
+            raise
+    
+    def preresolve(self, ziele):
+        """Resolve all configured devices once at startup"""
+        for hostname, port in ziele:
+            try:
+                self.resolve(hostname, port)
+            except Exception:
+                pass  # Already logged and negatively cached
+    
+    def refresh_stale(self):
+        """Background refresh: re-resolve at most one entry close to expiry"""
+        now = time.time()
+        for hostname, eintrag in self.cache.items():
+            if eintrag[1] is None:
+                continue
+            limit = self.cache_duration * 0.9 if eintrag[2] else self.negative_duration
+            if now - eintrag[1] >= limit:
+                try:
+                    self._lookup(hostname, eintrag[3])
+                except Exception:
+                    pass
+                return
+    
+    def log_stats(self):
+        """Log hit/miss counters"""
+        self.logger.log("DNS-Cache: {} Treffer, {} Fehlgriffe, {} Einträge",
+            self.hits, self.misses, len(self.cache), sub="stats")
+
+# ==============================================================================
+# HTTP RESPONSE PARSER
+# ==============================================================================
+class HTTPResponseParser:
+    """Incremental HTTP/1.1 response parser on one preallocated buffer.
+    Data is received straight into space() via recv_into/readinto, chunked
+    bodies are compacted in place and body() is a memoryview slice that
+    stays valid until the next reset()"""
+    
+    KOPF = 0
+    LAENGE = 1
+    BIS_ENDE = 2
+    CHUNK_GROESSE = 3
+    CHUNK_DATEN = 4
+    CHUNK_ENDE = 5
+    TRAILER = 6
+    FERTIG = 7
+    
+    CONTENT_LENGTH = b"content-length"
+    CONNECTION = b"connection"
+    TRANSFER_ENCODING = b"transfer-encoding"
+    CLOSE = b"close"
+    CHUNKED = b"chunked"
+    
+    def __init__(self, size):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.reset()
+    
+    def reset(self):
+        """Prepare for the next response"""
+        self.fill = 0
+        self.pos = 0
+        self.zustand = self.KOPF
+        self.status = 0
+        self.laenge = -1
+        self.chunked = False
+        self.keep_alive = True
+        self.body_start = 0
+        self.body_end = 0
+        self.chunk_rest = 0
+    
+    def fertig(self):
+        """Complete response received"""
+        return self.zustand == self.FERTIG
+    
+    def space(self):
+        """Free part of the buffer to receive into"""
+        if self.fill >= len(self.buf):
+            raise OSError("Antwort zu groß")
+        return self.mv[self.fill:]
+    
+    def body(self):
+        """Body without copy"""
+        return self.mv[self.body_start:self.body_end]
+    
+    def feed(self, n):
+        """Account for n bytes received into space(); n == 0 means peer closed"""
+        if not n:
+            if self.zustand == self.BIS_ENDE:
+                self.body_end = self.fill
+                self.zustand = self.FERTIG
+                return
+            if self.fill == 0:
+                raise OSError("Verbindung vom Gerät geschlossen")
+            raise OSError("Antwort unvollständig")
+        self.fill += n
+        if self.zustand == self.KOPF and not self._parse_kopf():
+            return
+        if self.zustand == self.LAENGE:
+            if self.fill - self.body_start >= self.laenge:
+                self.body_end = self.body_start + self.laenge
+                self.zustand = self.FERTIG
+            elif self.body_start + self.laenge > len(self.buf):
+                raise OSError("Antwort zu groß")
+        elif self.zustand == self.BIS_ENDE:
+            self.body_end = self.fill
+        elif self.zustand != self.FERTIG:
+            self._parse_chunks()
+    
+    def _zeilenende(self, start):
+        """Index of the next CRLF at or after start, -1 if not yet received"""
+        buf = self.buf
+        i = start
+        ende = self.fill - 1
+        while i < ende:
+            if buf[i] == 13 and buf[i + 1] == 10:
+                return i
+            i += 1
+        return -1
+    
+    def _gleich(self, start, ende, wort):
+        """Case-insensitive compare of buf[start:ende] with a lowercase word"""
+        if ende - start != len(wort):
+            return False
+        buf = self.buf
+        i = 0
+        while i < len(wort):
+            c = buf[start + i]
+            if 65 <= c <= 90:
+                c += 32
+            if c != wort[i]:
+                return False
+            i += 1
+        return True
+    
+    def _parse_kopf(self):
+        """Parse header lines received so far, True once the header is complete"""
+        buf = self.buf
+        while True:
+            ende = self._zeilenende(self.pos)
+            if ende < 0:
+                return False
+            p = self.pos
+            self.pos = ende + 2
+            if self.status == 0:
+                # Status line: HTTP/1.x NNN ...
+                if ende - p < 12:
+                    raise OSError("ungültige Statuszeile")
+                self.status = (buf[p + 9] - 48) * 100 + (buf[p + 10] - 48) * 10 + buf[p + 11] - 48
+                self.keep_alive = buf[p + 7] != 48  # HTTP/1.0 closes by default
+                continue
+            if ende == p:
+                # Empty line: header complete
+                if 100 <= self.status < 200:
+                    self.status = 0  # Interim response (100 Continue), real one follows
+                    continue
+                self.body_start = self.body_end = self.pos
+                if self.chunked:
+                    self.zustand = self.CHUNK_GROESSE
+                elif self.laenge >= 0:
+                    self.zustand = self.LAENGE
+                elif self.status in (204, 304):
+                    self.laenge = 0
+                    self.zustand = self.LAENGE
+                else:
+                    # No length: body ends when the device closes the connection
+                    self.keep_alive = False
+                    self.zustand = self.BIS_ENDE
+                return True
+            # Header field: name ':' value
+            doppelpunkt = p
+            while doppelpunkt < ende and buf[doppelpunkt] != 58:
+                doppelpunkt += 1
+            wert = doppelpunkt + 1
+            while wert < ende and buf[wert] == 32:
+                wert += 1
+            if self._gleich(p, doppelpunkt, self.CONTENT_LENGTH):
+                laenge = 0
+                while wert < ende and 48 <= buf[wert] <= 57:
+                    laenge = laenge * 10 + buf[wert] - 48
+                    wert += 1
+                self.laenge = laenge
+            elif self._gleich(p, doppelpunkt, self.CONNECTION):
+                if self._gleich(wert, ende, self.CLOSE):
+                    self.keep_alive = False
+            elif self._gleich(p, doppelpunkt, self.TRANSFER_ENCODING):
+                self.chunked = self._gleich(wert, ende, self.CHUNKED)
+    
+    def _parse_chunks(self):
+        """Decode chunked transfer encoding in place"""
+        buf = self.buf
+        while True:
+            if self.zustand == self.CHUNK_GROESSE:
+                ende = self._zeilenende(self.pos)
+                if ende < 0:
+                    break
+                groesse = 0
+                i = self.pos
+                while i < ende:
+                    c = buf[i]
+                    if 48 <= c <= 57:
+                        groesse = groesse * 16 + c - 48
+                    elif 97 <= c <= 102:
+                        groesse = groesse * 16 + c - 87
+                    elif 65 <= c <= 70:
+                        groesse = groesse * 16 + c - 55
+                    else:
+                        break  # Chunk extension
+                    i += 1
+                self.pos = ende + 2
+                if groesse:
+                    self.chunk_rest = groesse
+                    self.zustand = self.CHUNK_DATEN
+                else:
+                    self.zustand = self.TRAILER
+            elif self.zustand == self.CHUNK_DATEN:
+                n = min(self.chunk_rest, self.fill - self.pos)
+                if not n:
+                    break
+                if self.pos != self.body_end:
+                    self.mv[self.body_end:self.body_end + n] = self.mv[self.pos:self.pos + n]
+                self.body_end += n
+                self.pos += n
+                self.chunk_rest -= n
+                if not self.chunk_rest:
+                    self.zustand = self.CHUNK_ENDE
+            elif self.zustand == self.CHUNK_ENDE:
+                if self.fill - self.pos < 2:
+                    break
+                self.pos += 2
+                self.zustand = self.CHUNK_GROESSE
+            elif self.zustand == self.TRAILER:
+                ende = self._zeilenende(self.pos)
+                if ende < 0:
+                    break
+                leer = ende == self.pos
+                self.pos = ende + 2
+                if leer:
+                    self.zustand = self.FERTIG
+                    break
+            else:
+                break
+        # Reclaim the gap left by chunk headers: move unparsed bytes down
+        rest = self.fill - self.pos
+        if self.pos > self.body_end:
+            if rest:
+                self.mv[self.body_end:self.body_end + rest] = self.mv[self.pos:self.fill]
+            self.fill = self.body_end + rest
+            self.pos = self.body_end
+
+# ==============================================================================
+# LATENCY STATISTICS
+# ==============================================================================
+class LatencyHistogram:
+    """Fixed-bucket millisecond histogram; adding a sample allocates nothing"""
+    
+    GRENZEN = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)  # Bucket upper bounds (ms)
+    
+    def __init__(self):
+        self.counts = array("L", [0] * (len(self.GRENZEN) + 1))  # Last bucket: > 10 s
+        self.anzahl = 0
+        self.maximum = 0
+    
+    def add(self, ms):
+        """Count one sample"""
+        i = 0
+        for grenze in self.GRENZEN:
+            if ms <= grenze:
+                break
+            i += 1
+        self.counts[i] += 1
+        self.anzahl += 1
+        if ms > self.maximum:
+            self.maximum = ms
+    
+    def percentile(self, p):
+        """Upper bound (ms) of the bucket holding the p-th percentile, None without samples"""
+        if not self.anzahl:
+            return None
+        ziel = (self.anzahl * p + 99) // 100
+        summe = 0
+        for i in range(len(self.counts)):
+            summe += self.counts[i]
+            if summe >= ziel:
+                break
+        if i < len(self.GRENZEN):
+            return min(self.GRENZEN[i], self.maximum)
+        return self.maximum
+
+class LatencyStats:
+    """Request phase histograms per device operation (e.g. "shelly.setze")"""
+    
+    PHASEN = ("dns", "verbindung", "senden", "erstes_byte", "gesamt")
+    # Indices of the per-request ticks_ms marks filled in by the pool
+    START, DNS, VERBINDUNG, GESENDET, ERSTES_BYTE = range(5)
+    
+    def __init__(self, debug_logger):
+        self.logger = debug_logger
+        self.histogramme = {}  # name -> [LatencyHistogram per phase]
+        self.fehler = {}       # name -> failed requests
+    
+    def _eintrag(self, name):
+        """Histograms of one operation, created on first use"""
+        eintrag = self.histogramme.get(name)
+        if eintrag is None:
+            eintrag = self.histogramme[name] = [LatencyHistogram() for _ in self.PHASEN]
+            self.fehler[name] = 0
+        return eintrag
+    
+    def record(self, name, marke, ende):
+        """Add one successful request from its marks (reused connections skip dns/connect)"""
+        h = self._eintrag(name)
+        diff = time.ticks_diff
+        basis = marke[self.START]
+        if marke[self.DNS]:
+            h[0].add(diff(marke[self.DNS], basis))
+            h[1].add(diff(marke[self.VERBINDUNG], marke[self.DNS]))
+            basis = marke[self.VERBINDUNG]
+        h[2].add(diff(marke[self.GESENDET], basis))
+        h[3].add(diff(marke[self.ERSTES_BYTE], marke[self.GESENDET]))
+        h[4].add(diff(ende, marke[self.START]))
+    
+    def record_error(self, name):
+        """Count a failed request"""
+        self._eintrag(name)
+        self.fehler[name] += 1
+    
+    def percentile(self, name, phase, p):
+        """p-th percentile of one phase in ms, None without samples"""
+        eintrag = self.histogramme.get(name)
+        if eintrag is None:
+            return None
+        return eintrag[self.PHASEN.index(phase)].percentile(p)
+    
+    def log_stats(self):
+        """Log p50/p95/p99 of every phase per operation"""
+        for name, eintrag in self.histogramme.items():
+            teile = []
+            for phase, h in zip(self.PHASEN, eintrag):
+                if h.anzahl:
+                    teile.append("{} {}/{}/{}".format(
+                        phase, h.percentile(50), h.percentile(95), h.percentile(99)))
+            self.logger.log("Latenz {} (n={}, Fehler {}): {} ms (p50/p95/p99)",
+                name, eintrag[4].anzahl, self.fehler[name], ", ".join(teile), sub="stats")
+
+# ==============================================================================
+# HTTP CONNECTION POOL
+# ==============================================================================
+class HTTPConnectionPool:
+    """Shared HTTP/1.1 keep-alive connections, one persistent socket per device"""
+    
+    def __init__(self, config, debug_logger, resolver=None):
+        self.config = config
+        self.logger = debug_logger
+        self.resolver = resolver or DNSCache(config, debug_logger)
+        self.connections = {}  # "host:port" -> [socket, last_used]
+        self.streams = {}      # "host:port" -> [reader, writer, last_used] (async engine)
+        self.locks = {}        # "host:port" -> asyncio.Lock serialising one stream
+        self.parsers = {}      # "host:port" -> HTTPResponseParser (preallocated buffer)
+        self.marken = {}       # "host:port" -> array of ticks_ms marks of the running request
+        self.latency = LatencyStats(debug_logger)
+        self.connect_count = 0
+        self.reuse_count = 0
+        self.reconnect_count = 0
+    
+    @staticmethod
+    def _ist_timeout(e):
+        """Check if an OSError is a socket timeout (no reconnect retry then)"""
+        code = e.args[0] if e.args else None
+        return code in (110, 116) or "timed out" in str(e)
+    
+    def _connect(self, host, port, timeout, marke):
+        """Open a new connection to the device"""
+        addr = self.resolver.resolve(host, port)
+        marke[LatencyStats.DNS] = time.ticks_ms()
+        s = socket.socket()
+        s.settimeout(timeout)
+        try:
+            s.connect(addr)
+        except Exception:
+            s.close()
+            raise
+        marke[LatencyStats.VERBINDUNG] = time.ticks_ms()
+        self.connect_count += 1
+        return s
+    
+    def close(self, key):
+        """Close and forget the pooled connection for host:port"""
+        eintrag = self.connections.pop(key, None)
+        if eintrag:
+            try:
+                eintrag[0].close()
+            except:
+                pass
+    
+    def close_all(self):
+        """Close all pooled connections (e.g. after WiFi reconnect)"""
+        for key in list(self.connections):
+            self.close(key)
+        for key in list(self.streams):
+            # Streams are dropped without awaiting the close handshake
+            try:
+                self.streams.pop(key)[1].close()
+            except:
+                pass
+    
+    def _parser(self, key):
+        """Preallocated response parser of one device, reset for the next response"""
+        parser = self.parsers.get(key)
+        if parser is None:
+            parser = self.parsers[key] = HTTPResponseParser(self.config.HTTP_MAX_RESPONSE)
+        parser.reset()
+        return parser
+    
+    def _marke(self, key):
+        """Preallocated timing marks of one device, started for the next request"""
+        marke = self.marken.get(key)
+        if marke is None:
+            marke = self.marken[key] = array("l", [0] * 5)
+        for i in range(1, 5):
+            marke[i] = 0
+        marke[LatencyStats.START] = time.ticks_ms()
+        return marke
+    
+    def _lese_antwort(self, s, parser, marke):
+        """Receive one HTTP response into the parser, returns (status, body, keep_alive)"""
+        readinto = getattr(s, "readinto", None) or s.recv_into
+        while not parser.fertig():
+            n = readinto(parser.space())
+            if n and not marke[LatencyStats.ERSTES_BYTE]:
+                marke[LatencyStats.ERSTES_BYTE] = time.ticks_ms()
+            parser.feed(n)
+        return parser.status, parser.body(), parser.keep_alive
+    
+    @staticmethod
+    def sendall(s, daten):
+        """Write all bytes; send() may accept only part of them. A send() that
+        writes nothing (None or 0) means a dead socket: raised as ECONNRESET,
+        so the caller closes it and the pool reconnects"""
+        mv = memoryview(daten)
+        n = 0
+        while n < len(mv):
+            geschrieben = s.send(mv[n:])
+            if not geschrieben:
+                raise OSError(104, "ECONNRESET: send() schrieb nichts")
+            n += geschrieben
+    
+    def _sende(self, s, anfrage, parser, marke):
+        """Send request and read response on one socket"""
+        self.sendall(s, anfrage)
+        marke[LatencyStats.GESENDET] = time.ticks_ms()
+        return self._lese_antwort(s, parser, marke)
+    
+    def _abschicken(self, host, port, anfrage, timeout, name):
+        """Send request bytes over the pooled (or a new) connection without
+        waiting for the answer, returns the handle for _abholen()"""
+        key = "{}:{}".format(host, port)
+        marke = self._marke(key)
+        eintrag = self.connections.get(key)
+        if eintrag and time.time() - eintrag[1] > self.config.HTTP_KEEPALIVE_IDLE:
+            # Device has most likely dropped the idle connection already
+            self.close(key)
+            eintrag = None
+        
+        if eintrag:
+            s = eintrag[0]
+            s.settimeout(timeout)
+            try:
+                self.sendall(s, anfrage)
+                marke[LatencyStats.GESENDET] = time.ticks_ms()
+                return [key, s, True, host, port, anfrage, timeout, name or key]
+            except Exception as e:
+                self.close(key)
+                if not isinstance(e, OSError) or self._ist_timeout(e):
+                    raise
+                self.reconnect_count += 1
+                self.logger.warn("pool", "Pool: {} getrennt ({}) - verbinde neu.", key, e)
+        
+        s = self._connect(host, port, timeout, marke)
+        try:
+            self.sendall(s, anfrage)
+            marke[LatencyStats.GESENDET] = time.ticks_ms()
+        except Exception:
+            s.close()
+            raise
+        return [key, s, False, host, port, anfrage, timeout, name or key]
+    
+    def _abholen(self, handle):
+        """Read the response of a request sent by _abschicken(), returns (status, body)"""
+        key, s, reused, host, port, anfrage, timeout, name = handle
+        marke = self.marken[key]
+        try:
+            status, body, keep_alive = self._lese_antwort(s, self._parser(key), marke)
+            if reused:
+                self.reuse_count += 1
+        except Exception as e:
+            self.connections.pop(key, None)
+            s.close()
+            if not reused or not isinstance(e, OSError) or self._ist_timeout(e):
+                self.latency.record_error(name)
+                raise
+            # Peer closed the keep-alive connection: reconnect transparently
+            self.reconnect_count += 1
+            self.logger.warn("pool", "Pool: {} getrennt ({}) - verbinde neu.", key, e)
+            try:
+                s = self._connect(host, port, timeout, marke)
+            except Exception:
+                self.latency.record_error(name)
+                raise
+            try:
+                status, body, keep_alive = self._sende(s, anfrage, self._parser(key), marke)
+            except Exception:
+                s.close()
+                self.latency.record_error(name)
+                raise
+        self.latency.record(name, marke, time.ticks_ms())
+        
+        if keep_alive:
+            self.connections[key] = [s, time.time()]
+        else:
+            self.connections.pop(key, None)
+            s.close()
+        return status, body
+    
+    def request(self, host, port, anfrage, timeout=10.0, name=None):
+        """Send request bytes over the pooled connection, returns (status, body).
+        body is a memoryview into the device's parser buffer, valid until the
+        next request to the same device. name labels the latency statistics"""
+        try:
+            handle = self._abschicken(host, port, anfrage, timeout, name)
+        except Exception:
+            self.latency.record_error(name or "{}:{}".format(host, port))
+            raise
+        return self._abholen(handle)
+    
+    def request_many(self, auftraege):
+        """Fan-out for the blocking engine: send all (host, port, anfrage, timeout, name)
+        requests first, then collect the responses. The devices work in parallel,
+        so the total time is that of the slowest one. Returns one
+        [(status, body) or exception, ms] per request, ms measured from the start"""
+        start = time.ticks_ms()
+        handles = []
+        for host, port, anfrage, timeout, name in auftraege:
+            try:
+                handles.append(self._abschicken(host, port, anfrage, timeout, name))
+            except Exception as e:
+                self.latency.record_error(name)
+                handles.append(e)
+        ergebnisse = []
+        for handle in handles:
+            if not isinstance(handle, Exception):
+                try:
+                    handle = self._abholen(handle)
+                except Exception as e:
+                    handle = e
+            ergebnisse.append([handle, time.ticks_diff(time.ticks_ms(), start)])
+        return ergebnisse
+    
+    async def _aclose(self, key):
+        """Close and forget the pooled stream for host:port"""
+        eintrag = self.streams.pop(key, None)
+        if eintrag:
+            try:
+                eintrag[1].close()
+                await eintrag[1].wait_closed()
+            except:
+                pass
+    
+    @staticmethod
+    async def _areadinto(reader, mv):
+        """Stream readinto, with a copying fallback for streams without it"""
+        if hasattr(reader, "readinto"):
+            return await reader.readinto(mv)
+        teil = await reader.read(len(mv))
+        mv[:len(teil)] = teil
+        return len(teil)
+    
+    async def _alese_antwort(self, reader, parser, marke):
+        """Receive one HTTP response from a stream, returns (status, body, keep_alive)"""
+        while not parser.fertig():
+            n = await self._areadinto(reader, parser.space())
+            if n and not marke[LatencyStats.ERSTES_BYTE]:
+                marke[LatencyStats.ERSTES_BYTE] = time.ticks_ms()
+            parser.feed(n)
+        return parser.status, parser.body(), parser.keep_alive
+    
+    async def _asende(self, eintrag, anfrage, parser, marke):
+        """Send request and read response on one stream"""
+        eintrag[1].write(anfrage)
+        await eintrag[1].drain()
+        marke[LatencyStats.GESENDET] = time.ticks_ms()
+        return await self._alese_antwort(eintrag[0], parser, marke)
+    
+    async def _aconnect_und_sende(self, host, port, anfrage, parser, marke):
+        """Open a new stream to the device and run one request on it"""
+        addr = self.resolver.resolve(host, port)
+        marke[LatencyStats.DNS] = time.ticks_ms()
+        reader, writer = await asyncio.open_connection(addr[0], addr[1])
+        marke[LatencyStats.VERBINDUNG] = time.ticks_ms()
+        self.connect_count += 1
+        eintrag = [reader, writer, 0]
+        try:
+            return eintrag, await self._asende(eintrag, anfrage, parser, marke)
+        except BaseException:
+            writer.close()
             raise
+    
+    async def arequest(self, host, port, anfrage, timeout=10.0, name=None):
+        """Non-blocking variant of request() for the async engine"""
+        key = "{}:{}".format(host, port)
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        async with lock:
+            try:
+                return await self._arequest(key, host, port, anfrage, timeout, name or key)
+            except BaseException:
+                self.latency.record_error(name or key)
+                raise
+    
+    async def _arequest(self, key, host, port, anfrage, timeout, name):
+        """arequest() with the device lock held"""
+        marke = self._marke(key)
+        eintrag = self.streams.get(key)
+        if eintrag and time.time() - eintrag[2] > self.config.HTTP_KEEPALIVE_IDLE:
+            await self._aclose(key)
+            eintrag = None
+        
+        antwort = None
+        if eintrag:
+            try:
+                antwort = await asyncio.wait_for(
+                    self._asende(eintrag, anfrage, self._parser(key), marke), timeout)
+                self.reuse_count += 1
+            except asyncio.TimeoutError:
+                await self._aclose(key)
+                raise OSError("timed out")
+            except Exception as e:
+                await self._aclose(key)
+                if not isinstance(e, OSError):
+                    raise
+                # Peer closed the keep-alive connection: reconnect transparently
+                self.reconnect_count += 1
+                self.logger.warn("pool", "Pool: {} getrennt ({}) - verbinde neu.", key, e)
+        
+        if antwort is None:
+            try:
+                eintrag, antwort = await asyncio.wait_for(
+                    self._aconnect_und_sende(host, port, anfrage, self._parser(key), marke), timeout)
+            except asyncio.TimeoutError:
+                raise OSError("timed out")
+        
+        self.latency.record(name, marke, time.ticks_ms())
+        status, body, keep_alive = antwort
+        if keep_alive:
+            eintrag[2] = time.time()
+            self.streams[key] = eintrag
+        else:
+            self.streams[key] = eintrag
+            await self._aclose(key)
+        return status, body
+    
+    def log_stats(self):
+        """Log connection reuse counters"""
+        self.logger.log("HTTP-Pool: {} Verbind., {} wiederverw., {} Neuverbind., {} offen",
+            self.connect_count, self.reuse_count, self.reconnect_count,
+            len(self.connections) + len(self.streams), sub="stats")
+        self.latency.log_stats()
 
 # ==============================================================================
 # API WRAPPERS (DO NOT MODIFY API CALLS!)
@@ -323,309 +1168,1176 @@ class DNSCache:
 class NanoleafAPI:
     """Wrapper for Nanoleaf API calls - DO NOT MODIFY THE API CALLS"""
     
-    def __init__(self, config, debug_logger, led_controller=None):
+    def __init__(self, config, debug_logger, led_controller=None, pool=None):
         self.config = config
         self.logger = debug_logger
         self.url = SecretManager.get_nanoleaf_url()
         self.led_controller = led_controller
+        self.pool = pool or HTTPConnectionPool(config, debug_logger)
+        self.breaker = CircuitBreaker(
+            config, debug_logger, config.BREAKER_THRESHOLD, config.BREAKER_RECOVERY, name="Nanoleaf")
+        # Request templates: the fixed bytes of every operation, built once
+        self.vorlage_status = self._anfrage_status()
+        self.vorlage_setze = {True: self._anfrage_setze(True), False: self._anfrage_setze(False)}
     
-    def _empfange_daten(self, sock, laenge):
-        """EXACT COPY - DO NOT MODIFY"""
-        daten = b""
-        while len(daten) < laenge:
-            teil = sock.recv(min(1024, laenge - len(daten)))
-            if not teil:
-                break
-            daten += teil
-        return daten.decode()
+    def _anfrage_status(self):
+        """Status request - DO NOT MODIFY"""
+        return "GET {} HTTP/1.1\r\nHost: {}\r\nConnection: keep-alive\r\n\r\n".format(
+            self.url, self.config.NANOLEAF_IP).encode()
+    
+    def _anfrage_setze(self, ein):
+        """Set request - DO NOT MODIFY"""
+        payload = '{"on":{"value":' + ('true' if ein else 'false') + '}}'
+        return "PUT {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: keep-alive\r\n\r\n{}".format(
+            self.url, self.config.NANOLEAF_IP, len(payload), payload).encode()
+    
+    def _parse_status(self, body):
+        """Extract power state from status response body"""
+        return ujson.loads(body).get("on", {}).get("value", False)
     
-    def _extrahiere_json(self, antwort):
-        """EXACT COPY - DO NOT MODIFY"""
-        start = antwort.find("{")
-        ende = antwort.rfind("}") + 1
-        return antwort[start:ende] if start != -1 and ende > start else ""
+    def probe(self):
+        """Half-open probe for the blocking engine, advanced by the loop"""
+        return BreakerProbe(self.pool.resolver, self.config.NANOLEAF_IP, self.config.NANOLEAF_PORT,
+                            self.vorlage_status, self.config.BREAKER_PROBE_TIMEOUT)
+    
+    async def probe_async(self):
+        """Half-open probe for the async engine"""
+        try:
+            await self.pool.arequest(self.config.NANOLEAF_IP, self.config.NANOLEAF_PORT,
+                                     self.vorlage_status, self.config.BREAKER_PROBE_TIMEOUT,
+                                     "nanoleaf.probe")
+            self.breaker.record_success()
+        except Exception:
+            self.breaker.record_failure()
     
     def lese_status(self):
-        """EXACT COPY - DO NOT MODIFY"""
+        """API call unchanged, sent over the keep-alive pool"""
+        # Device offline: fail fast instead of waiting for timeouts
+        if self.breaker.blockiert(self.led_controller):
+            return None
+        
         # Start blinking if LED not active
         if self.led_controller and not self.led_controller.display_active:
             self.led_controller.start_blinking("WEISS", 0.5)
         
         try:
-            s = socket.socket()
-            s.settimeout(10.0)  # 10 second timeout
-            s.connect((self.config.NANOLEAF_IP, self.config.NANOLEAF_PORT))
-            anfrage = "GET {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n".format(
-                self.url, self.config.NANOLEAF_IP)
-            s.send(anfrage.encode())
-            antwort = s.recv(1024).decode()
-            laenge = 0
-            for zeile in antwort.split("\r\n"):
-                if zeile.lower().startswith("content-length:"):
-                    laenge = int(zeile.split(":")[1].strip())
-            json_str = self._empfange_daten(s, laenge) if laenge else ""
-            s.close()
-            json_str = self._extrahiere_json(json_str)
-            if json_str:
-                result = ujson.loads(json_str).get("on", {}).get("value", False)
-                # Stop blinking on success
-                if self.led_controller:
-                    self.led_controller.stop_blinking()
-                return result
+            _, body = self.pool.request(
+                self.config.NANOLEAF_IP, self.config.NANOLEAF_PORT, self.vorlage_status, 10.0, "nanoleaf.status")
+            result = self._parse_status(body)
+            self.breaker.record_success()
+            return result
         except Exception as e:
-            self.logger.log("NL-Fehler: {} - retry in 30 Sek.".format(e))
-            try:
-                s.close()
-            except:
-                pass
+            self.breaker.record_failure()
+            self.logger.warn("nanoleaf", "NL-Fehler: {} - retry in 30 Sek.", e)
         finally:
             # Always stop blinking
             if self.led_controller:
                 self.led_controller.stop_blinking()
         return None
     
+    async def lese_status_async(self):
+        """Non-blocking variant of lese_status() for the async engine"""
+        # Device offline: fail fast instead of waiting for timeouts
+        if self.breaker.blockiert(self.led_controller):
+            return None
+        
+        if self.led_controller and not self.led_controller.display_active:
+            self.led_controller.start_blinking("WEISS", 0.5)
+        
+        try:
+            _, body = await self.pool.arequest(
+                self.config.NANOLEAF_IP, self.config.NANOLEAF_PORT, self.vorlage_status, 10.0, "nanoleaf.status")
+            result = self._parse_status(body)
+            self.breaker.record_success()
+            return result
+        except Exception as e:
+            self.breaker.record_failure()
+            self.logger.warn("nanoleaf", "NL-Fehler: {} - retry in 30 Sek.", e)
+        finally:
+            if self.led_controller:
+                self.led_controller.stop_blinking()
+        return None
+    
     def setze(self, ein):
-        """EXACT COPY - DO NOT MODIFY"""
+        """API call unchanged, sent over the keep-alive pool"""
+        # Device offline: fail fast instead of waiting for timeouts
+        if self.breaker.blockiert(self.led_controller):
+            return False
+        
         # Start blinking if LED not active
         if self.led_controller and not self.led_controller.display_active:
             self.led_controller.start_blinking("WEISS", 0.5)
         
         try:
-            s = socket.socket()
-            s.settimeout(10.0)  # 10 second timeout
-            s.connect((self.config.NANOLEAF_IP, self.config.NANOLEAF_PORT))
-            payload = '{"on":{"value":' + ('true' if ein else 'false') + '}}'
-            anfrage = "PUT {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n{}".format(
-                self.url, self.config.NANOLEAF_IP, len(payload), payload)
-            s.send(anfrage.encode())
-            s.recv(1024)
-            s.close()
-            self.logger.log("NL => {} - Zustand aktualisiert.".format("EIN" if ein else "AUS"))
+            self.pool.request(
+                self.config.NANOLEAF_IP, self.config.NANOLEAF_PORT, self.vorlage_setze[bool(ein)], 10.0, "nanoleaf.setze")
+            self.breaker.record_success()
+            self.logger.log("NL => {} - Zustand aktualisiert.", "EIN" if ein else "AUS", sub="nanoleaf")
+            return True
         except Exception as e:
-            self.logger.log("NL-SetFehler: {} - retry in 30 Sek.".format(e))
-            try:
-                s.close()
-            except:
-                pass
+            self.breaker.record_failure()
+            self.logger.warn("nanoleaf", "NL-SetFehler: {} - retry in 30 Sek.", e)
+            return False
         finally:
             # Always stop blinking
             if self.led_controller:
                 self.led_controller.stop_blinking()
+    
+    async def setze_async(self, ein):
+        """Non-blocking variant of setze() for the async engine"""
+        # Device offline: fail fast instead of waiting for timeouts
+        if self.breaker.blockiert(self.led_controller):
+            return False
+        
+        if self.led_controller and not self.led_controller.display_active:
+            self.led_controller.start_blinking("WEISS", 0.5)
+        
+        try:
+            await self.pool.arequest(
+                self.config.NANOLEAF_IP, self.config.NANOLEAF_PORT, self.vorlage_setze[bool(ein)], 10.0, "nanoleaf.setze")
+            self.breaker.record_success()
+            self.logger.log("NL => {} - Zustand aktualisiert.", "EIN" if ein else "AUS", sub="nanoleaf")
+            return True
+        except Exception as e:
+            self.breaker.record_failure()
+            self.logger.warn("nanoleaf", "NL-SetFehler: {} - retry in 30 Sek.", e)
+            return False
+        finally:
+            if self.led_controller:
+                self.led_controller.stop_blinking()
 
 class ShellyAPI:
     """Wrapper for Shelly API calls - DO NOT MODIFY THE API CALLS"""
     
-    def __init__(self, config, debug_logger, led_controller=None):
+    def __init__(self, config, debug_logger, led_controller=None, pool=None):
         self.config = config
         self.logger = debug_logger
         self.led_controller = led_controller
+        self.pool = pool or HTTPConnectionPool(config, debug_logger)
+        self.breaker = CircuitBreaker(
+            config, debug_logger, config.BREAKER_THRESHOLD, config.BREAKER_RECOVERY, name="Shelly")
+        self.was_on = None  # Output before the last successful setze(), as reported by Switch.Set
+        # Request templates: the fixed bytes of every operation, built once
+        self.vorlage_status = self._anfrage_status()
+        self.vorlage_setze = {"ein": self._anfrage_setze("ein"), "aus": self._anfrage_setze("aus")}
+    
+    def _anfrage_setze(self, zustand):
+        """Switch.Set request - DO NOT MODIFY"""
+        body = '{"id":0,"on":' + ('true' if zustand == "ein" else 'false') + '}'
+        return "POST /rpc/Switch.Set HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: keep-alive\r\n\r\n{}".format(
+            self.config.SHELLY_IP, len(body), body).encode()
+    
+    def _anfrage_status(self):
+        """Switch.GetStatus request - DO NOT MODIFY"""
+        return "GET /rpc/Switch.GetStatus?id=0 HTTP/1.1\r\nHost: {}\r\nConnection: keep-alive\r\n\r\n".format(
+            self.config.SHELLY_IP).encode()
+    
+    def _vorlage_setze(self, zustand):
+        """Prebuilt Switch.Set request ("ein"/"aus"), built on the fly for other values"""
+        anfrage = self.vorlage_setze.get(zustand)
+        return anfrage if anfrage is not None else self._anfrage_setze(zustand)
+    
+    def _parse_status(self, antwort):
+        """Extract switch output from Switch.GetStatus response body"""
+        return ujson.loads(antwort).get("output", False)
+    
+    def _parse_setze(self, antwort):
+        """Extract previous output (was_on) from Switch.Set response body, None if missing"""
+        try:
+            return ujson.loads(antwort).get("was_on")
+        except Exception:
+            return None
+    
+    def probe(self):
+        """Half-open probe for the blocking engine, advanced by the loop"""
+        return BreakerProbe(self.pool.resolver, self.config.SHELLY_IP, self.config.SHELLY_PORT,
+                            self.vorlage_status, self.config.BREAKER_PROBE_TIMEOUT)
+    
+    async def probe_async(self):
+        """Half-open probe for the async engine"""
+        try:
+            await self.pool.arequest(self.config.SHELLY_IP, self.config.SHELLY_PORT,
+                                     self.vorlage_status, self.config.BREAKER_PROBE_TIMEOUT,
+                                     "shelly.probe")
+            self.breaker.record_success()
+        except Exception:
+            self.breaker.record_failure()
     
     def setze(self, zustand):
-        """EXACT COPY - DO NOT MODIFY"""
+        """API call unchanged, sent over the keep-alive pool"""
+        # Device offline: fail fast instead of waiting for timeouts
+        if self.breaker.blockiert(self.led_controller):
+            return False
+        
         # Start blinking if LED not active
         if self.led_controller and not self.led_controller.display_active:
             self.led_controller.start_blinking("WEISS", 0.5)
         
-        body = '{"id":0,"on":' + ('true' if zustand == "ein" else 'false') + '}'
-        anfrage = "POST /rpc/Switch.Set HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n{}".format(
-            self.config.SHELLY_IP, len(body), body)
         try:
-            addr = socket.getaddrinfo(self.config.SHELLY_IP, self.config.SHELLY_PORT)[0][-1]
-            s = socket.socket()
-            s.settimeout(10.0)  # 10 second timeout
-            s.connect(addr)
-            s.send(anfrage.encode())
-            s.recv(2048)
-            s.close()
-            self.logger.log("Shelly => {} - Zustand aktualisiert.".format(zustand.upper()))
+            _, antwort = self.pool.request(
+                self.config.SHELLY_IP, self.config.SHELLY_PORT, self._vorlage_setze(zustand), 10.0, "shelly.setze")
+            self.was_on = self._parse_setze(antwort)
+            self.breaker.record_success()
+            self.logger.log("Shelly => {} - Zustand aktualisiert.", zustand.upper(), sub="shelly")
+            return True
         except Exception as e:
-            self.logger.log("Shelly-Fehler: {} - retry in 30 Sek.".format(e))
-            try:
-                s.close()
-            except:
-                pass
+            self.breaker.record_failure()
+            self.logger.warn("shelly", "Shelly-Fehler: {} - retry in 30 Sek.", e)
+            return False
         finally:
             # Always stop blinking
             if self.led_controller:
                 self.led_controller.stop_blinking()
     
-    def lese_status(self):
-        """EXACT COPY - DO NOT MODIFY"""
-        # Start blinking if LED not active
+    async def setze_async(self, zustand):
+        """Non-blocking variant of setze() for the async engine"""
+        # Device offline: fail fast instead of waiting for timeouts
+        if self.breaker.blockiert(self.led_controller):
+            return False
+        
         if self.led_controller and not self.led_controller.display_active:
             self.led_controller.start_blinking("WEISS", 0.5)
         
-        anfrage = "GET /rpc/Switch.GetStatus?id=0 HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n".format(
-            self.config.SHELLY_IP)
         try:
-            addr = socket.getaddrinfo(self.config.SHELLY_IP, self.config.SHELLY_PORT)[0][-1]
-            s = socket.socket()
-            s.settimeout(10.0)  # 10 second timeout
-            s.connect(addr)
-            s.send(anfrage.encode())
-            antwort = b""
-            max_size = 8192  # Limit response size
-            while len(antwort) < max_size:
-                try:
-                    teil = s.recv(min(2048, max_size - len(antwort)))
-                    if not teil:
-                        break
-                    antwort += teil
-                except OSError:
-                    break
-            s.close()
-            start = antwort.find(b"{")
-            if start != -1:
-                result = ujson.loads(antwort[start:].decode("utf-8")).get("output", False)
-                # Stop blinking on success
-                if self.led_controller:
-                    self.led_controller.stop_blinking()
-                return result
+            _, antwort = await self.pool.arequest(
+                self.config.SHELLY_IP, self.config.SHELLY_PORT, self._vorlage_setze(zustand), 10.0, "shelly.setze")
+            self.was_on = self._parse_setze(antwort)
+            self.breaker.record_success()
+            self.logger.log("Shelly => {} - Zustand aktualisiert.", zustand.upper(), sub="shelly")
+            return True
         except Exception as e:
-            self.logger.log("Shelly-Status Fehler: {} - retry in 30 Sek.".format(e))
-            try:
-                s.close()
-            except:
-                pass
+            self.breaker.record_failure()
+            self.logger.warn("shelly", "Shelly-Fehler: {} - retry in 30 Sek.", e)
+            return False
+        finally:
+            if self.led_controller:
+                self.led_controller.stop_blinking()
+    
+    def lese_status(self):
+        """API call unchanged, sent over the keep-alive pool"""
+        # Device offline: fail fast instead of waiting for timeouts
+        if self.breaker.blockiert(self.led_controller):
+            return None
+        
+        # Start blinking if LED not active
+        if self.led_controller and not self.led_controller.display_active:
+            self.led_controller.start_blinking("WEISS", 0.5)
+        
+        try:
+            _, antwort = self.pool.request(
+                self.config.SHELLY_IP, self.config.SHELLY_PORT, self.vorlage_status, 10.0, "shelly.status")
+            result = self._parse_status(antwort)
+            self.breaker.record_success()
+            return result
+        except Exception as e:
+            self.breaker.record_failure()
+            self.logger.warn("shelly", "Shelly-Status Fehler: {} - retry in 30 Sek.", e)
         finally:
             # Always stop blinking
             if self.led_controller:
                 self.led_controller.stop_blinking()
         return None
+    
+    async def lese_status_async(self):
+        """Non-blocking variant of lese_status() for the async engine"""
+        # Device offline: fail fast instead of waiting for timeouts
+        if self.breaker.blockiert(self.led_controller):
+            return None
+        
+        if self.led_controller and not self.led_controller.display_active:
+            self.led_controller.start_blinking("WEISS", 0.5)
+        
+        try:
+            _, antwort = await self.pool.arequest(
+                self.config.SHELLY_IP, self.config.SHELLY_PORT, self.vorlage_status, 10.0, "shelly.status")
+            result = self._parse_status(antwort)
+            self.breaker.record_success()
+            return result
+        except Exception as e:
+            self.breaker.record_failure()
+            self.logger.warn("shelly", "Shelly-Status Fehler: {} - retry in 30 Sek.", e)
+        finally:
+            if self.led_controller:
+                self.led_controller.stop_blinking()
+        return None
 
 class WLEDAPI:
     """Wrapper for WLED API calls - DO NOT MODIFY THE API CALLS"""
     
-    def __init__(self, config, debug_logger, led_controller=None):
+    def __init__(self, config, debug_logger, led_controller=None, pool=None):
         self.config = config
         self.logger = debug_logger
         self.led_controller = led_controller
+        self.pool = pool or HTTPConnectionPool(config, debug_logger)
+        self.breaker = CircuitBreaker(
+            config, debug_logger, config.BREAKER_THRESHOLD, config.BREAKER_RECOVERY, name="WLED")
+        # Request templates: status and the two configured payloads, serialised once
+        self.vorlage_status = self._baue_anfrage("GET", None)
+        self.vorlage_ein = self._baue_anfrage("POST", config.WLED_JSON_EIN)
+        self.vorlage_aus = self._baue_anfrage("POST", config.WLED_JSON_AUS)
+    
+    def _baue_anfrage(self, methode, daten):
+        """Build /json/state request - DO NOT MODIFY"""
+        if methode == "GET" and daten is None:
+            return "GET /json/state HTTP/1.1\r\nHost: {}\r\nConnection: keep-alive\r\n\r\n".format(
+                self.config.WLED_IP).encode()
+        elif methode == "POST" and daten is not None:
+            body = ujson.dumps(daten)
+            return "POST /json/state HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: keep-alive\r\n\r\n{}".format(
+                self.config.WLED_IP, len(body), body).encode()
+        raise ValueError("Param.-Fehler.")
+    
+    def vorlage(self, methode, daten):
+        """Prebuilt request for status and the configured payloads, other payloads are built"""
+        if daten is None and methode == "GET":
+            return self.vorlage_status
+        if daten is self.config.WLED_JSON_EIN and methode == "POST":
+            return self.vorlage_ein
+        if daten is self.config.WLED_JSON_AUS and methode == "POST":
+            return self.vorlage_aus
+        return self._baue_anfrage(methode, daten)
+    
+    def probe(self):
+        """Half-open probe for the blocking engine, advanced by the loop"""
+        return BreakerProbe(self.pool.resolver, self.config.WLED_IP, self.config.WLED_PORT,
+                            self.vorlage_status, self.config.BREAKER_PROBE_TIMEOUT)
+    
+    async def probe_async(self):
+        """Half-open probe for the async engine"""
+        try:
+            await self.pool.arequest(self.config.WLED_IP, self.config.WLED_PORT,
+                                     self.vorlage_status, self.config.BREAKER_PROBE_TIMEOUT,
+                                     "wled.probe")
+            self.breaker.record_success()
+        except Exception:
+            self.breaker.record_failure()
     
     def anfrage(self, methode="GET", daten=None, versuche=5):
-        """EXACT COPY - DO NOT MODIFY"""
+        """API call unchanged, sent over the keep-alive pool - returns response body"""
+        # Device offline: fail fast instead of waiting for timeouts
+        if self.breaker.blockiert(self.led_controller):
+            return b""
+        
         # Start blinking if LED not active
         if self.led_controller and not self.led_controller.display_active:
             self.led_controller.start_blinking("WEISS", 0.5)
         
-        for _ in range(versuche):
+        for versuch in range(1, versuche + 1):
             try:
-                addr = socket.getaddrinfo(self.config.WLED_IP, 80)[0][-1]
-                s = socket.socket()
-                s.settimeout(5.0)  # 5 second timeout for WLED
-                s.connect(addr)
-                if methode == "GET" and daten is None:
-                    req = "GET /json/state HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n".format(
-                        self.config.WLED_IP)
-                    s.send(req.encode())
-                elif methode == "POST" and daten is not None:
-                    body = ujson.dumps(daten)
-                    header = "POST /json/state HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
-                        self.config.WLED_IP, len(body))
-                    s.send(header.encode())
-                    s.send(body.encode())
-                else:
-                    raise ValueError("Param.-Fehler.")
-                antwort = s.recv(2048)
-                s.close()
+                _, antwort = self.pool.request(
+                    self.config.WLED_IP, self.config.WLED_PORT,
+                    self.vorlage(methode, daten), 5.0,  # 5 second timeout for WLED
+                    "wled." + methode.lower())
                 if antwort:
+                    self.breaker.record_success()
                     # Stop blinking on success
                     if self.led_controller:
                         self.led_controller.stop_blinking()
                     return antwort
             except Exception as e:
-                self.logger.log("WLED Fehler: {} - retry in 1 Sek.".format(e))
-                try:
-                    s.close()
-                except:
-                    pass
+                self.breaker.record_failure()
+                self.logger.warn("wled", "WLED Fehler: {} - retry in 1 Sek.", e)
+                # No more retries once the breaker has opened
+                if versuch == versuche or not self.breaker.allow():
+                    break
                 time.sleep(1)
         # Stop blinking after all retries
         if self.led_controller:
             self.led_controller.stop_blinking()
         return b""
     
+    async def anfrage_async(self, methode="GET", daten=None, versuche=5):
+        """Non-blocking variant of anfrage() for the async engine"""
+        if self.breaker.blockiert(self.led_controller):
+            return b""
+        
+        if self.led_controller and not self.led_controller.display_active:
+            self.led_controller.start_blinking("WEISS", 0.5)
+        
+        for versuch in range(1, versuche + 1):
+            try:
+                _, antwort = await self.pool.arequest(
+                    self.config.WLED_IP, self.config.WLED_PORT,
+                    self.vorlage(methode, daten), 5.0, "wled." + methode.lower())
+                if antwort:
+                    self.breaker.record_success()
+                    if self.led_controller:
+                        self.led_controller.stop_blinking()
+                    return antwort
+            except Exception as e:
+                self.breaker.record_failure()
+                self.logger.warn("wled", "WLED Fehler: {} - retry in 1 Sek.", e)
+                if versuch == versuche or not self.breaker.allow():
+                    break
+                await asyncio.sleep(1)
+        if self.led_controller:
+            self.led_controller.stop_blinking()
+        return b""
+    
     def aktualisiere_status(self):
         """Get current WLED status"""
         antwort = self.anfrage("GET")
         if not antwort:
             return None
-        teile = antwort.decode("utf-8").split("\r\n\r\n", 1)
         try:
-            return ujson.loads(teile[1]).get("on", False) if len(teile) > 1 else None
+            return ujson.loads(antwort).get("on", False)
         except Exception as e:
-            self.logger.log("WLED Aktu-Fehler: {} - retry in 30 Sek.".format(e))
+            self.logger.warn("wled", "WLED Aktu-Fehler: {} - retry in 30 Sek.", e)
             return None
     
-    def setze(self, daten):
+    def setze(self, daten, versuche=5):
         """Set WLED state"""
-        antwort = self.anfrage("POST", daten)
+        return self._nach_setze(daten, self.anfrage("POST", daten, versuche))
+    
+    async def setze_async(self, daten, versuche=5):
+        """Non-blocking variant of setze() for the async engine"""
+        return self._nach_setze(daten, await self.anfrage_async("POST", daten, versuche))
+    
+    def _nach_setze(self, daten, antwort):
+        """Evaluate set response, returns new state or None"""
         if antwort:
             new_status = bool(daten.get("on", False))
-            self.logger.log("WLED => {} - Zustand aktualisiert.".format(
-                "EIN" if new_status else "AUS"))
+            self.logger.log("WLED => {} - Zustand aktualisiert.",
+                "EIN" if new_status else "AUS", sub="wled")
             return new_status
         return None
 
+# ==============================================================================
+# SHELLY PUSH (Gen2 RPC WEBSOCKET)
+# ==============================================================================
+class ShellyPushSubscriber:
+    """Keeps one WebSocket to the Shelly Gen2 /rpc endpoint open and reports
+    switch:0 output changes from NotifyStatus events as they arrive"""
+    
+    SRC = "kitchenmove52"
+    
+    def __init__(self, config, debug_logger, resolver, on_state, on_drop):
+        self.config = config
+        self.logger = debug_logger
+        self.resolver = resolver
+        self.on_state = on_state  # Called with True/False for every reported output
+        self.on_drop = on_drop    # Called when an established socket is lost
+        self.sock = None
+        self.connected = False
+        self.puffer = b""
+        self.poller = None        # Sync engine: waits for the non-blocking connect
+        self.antwort = None       # Sync engine: handshake answer so far (None: not sent yet)
+        self.frist = 0            # Sync engine: connect and handshake must be done by then
+        self.backoff = config.SHELLY_PUSH_RECONNECT
+        self.next_attempt = 0
+        self.last_rx = 0
+        self.last_ping = 0
+        self.event_count = 0
+    
+    def _handshake(self):
+        """HTTP upgrade request for /rpc"""
+        key = ubinascii.b2a_base64(bytes(random.getrandbits(8) for _ in range(16)))[:-1]
+        return ("GET /rpc HTTP/1.1\r\nHost: {}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                "Sec-WebSocket-Key: {}\r\nSec-WebSocket-Version: 13\r\n\r\n").format(
+            self.config.SHELLY_IP, key.decode()).encode()
+    
+    @staticmethod
+    def _pruefe_upgrade(kopf):
+        """Raise unless the device switched protocols"""
+        if kopf[9:12] != b"101":
+            raise OSError("kein WebSocket-Upgrade: {}".format(kopf.split(b"\r\n")[0]))
+    
+    def _frame(self, opcode, payload=b""):
+        """Masked client frame"""
+        mask = random.getrandbits(32).to_bytes(4, "big")
+        laenge = len(payload)
+        if laenge < 126:
+            kopf = bytes((0x80 | opcode, 0x80 | laenge))
+        else:
+            kopf = bytes((0x80 | opcode, 0x80 | 126, laenge >> 8, laenge & 0xFF))
+        daten = bytearray(payload)
+        for i in range(laenge):
+            daten[i] ^= mask[i & 3]
+        return kopf + mask + bytes(daten)
+    
+    def _subscribe_frame(self):
+        """Any request carrying our src makes the Shelly send notifications to us"""
+        return self._frame(1, ('{"id":1,"src":"' + self.SRC +
+                               '","method":"Switch.GetStatus","params":{"id":0}}').encode())
+    
+    def _feed(self, data):
+        """Consume received bytes, returns reply frames (pong) to send"""
+        if data:
+            self.puffer += data
+            self.last_rx = time.time()
+        antworten = []
+        while len(self.puffer) >= 2:
+            opcode = self.puffer[0] & 0x0F
+            laenge = self.puffer[1] & 0x7F
+            pos = 2
+            if laenge == 126:
+                if len(self.puffer) < 4:
+                    break
+                laenge = (self.puffer[2] << 8) | self.puffer[3]
+                pos = 4
+            elif laenge == 127:
+                if len(self.puffer) < 10:
+                    break
+                laenge = int.from_bytes(self.puffer[2:10], "big")
+                pos = 10
+            if len(self.puffer) < pos + laenge:
+                break
+            payload = self.puffer[pos:pos + laenge]
+            self.puffer = self.puffer[pos + laenge:]
+            if opcode == 1:
+                self._verarbeite(payload)
+            elif opcode == 8:
+                raise OSError("WebSocket vom Gerät geschlossen")
+            elif opcode == 9:
+                antworten.append(self._frame(10, payload))
+        return antworten
+    
+    def _verarbeite(self, payload):
+        """Apply a NotifyStatus event or our subscribe response"""
+        try:
+            nachricht = ujson.loads(payload)
+        except ValueError:
+            return
+        if nachricht.get("method") == "NotifyStatus":
+            status = nachricht.get("params", {}).get("switch:0")
+        elif nachricht.get("id") == 1:
+            status = nachricht.get("result")
+        else:
+            return
+        if status and "output" in status:
+            self.event_count += 1
+            self.on_state(bool(status["output"]))
+    
+    def _verbunden(self, s):
+        """Connection established"""
+        self.sock = s
+        self.connected = True
+        self.puffer = b""
+        self.backoff = self.config.SHELLY_PUSH_RECONNECT
+        self.last_rx = self.last_ping = time.time()
+        self.logger.log("Shelly-Push verbunden - Polling pausiert.")
+    
+    def _getrennt(self, e):
+        """Connection lost or attempt failed: schedule next attempt with backoff"""
+        war_verbunden = self.connected
+        if self.sock:
+            try:
+                self.sock.close()
+            except:
+                pass
+        self.sock = None
+        self.connected = False
+        self.poller = None
+        self.antwort = None
+        self.next_attempt = time.time() + self.backoff
+        if war_verbunden:
+            self.logger.warn("shelly", "Shelly-Push getrennt: {} - Polling aktiv, retry in {} Sek.",
+                e, self.backoff)
+            self.on_drop()
+        else:
+            self.logger.warn("shelly",
+                "Shelly-Push Verbindung fehlgeschlagen: {} - retry in {} Sek.",
+                e, self.backoff)
+        self.backoff = min(self.backoff * 2, 600)
+    
+    def _pruefe_keepalive(self, now):
+        """Returns a ping frame when due, raises if the device went silent"""
+        if now - self.last_rx > 2.5 * self.config.SHELLY_PUSH_PING:
+            raise OSError("keine Antwort seit {} Sek.".format(int(now - self.last_rx)))
+        if now - self.last_ping >= self.config.SHELLY_PUSH_PING:
+            self.last_ping = now
+            return self._frame(9)
+        return None
+    
+    def connect(self):
+        """Sync engine: start a non-blocking connect; poll() advances it, so
+        the loop never waits on the device (5 s for connect and handshake)"""
+        try:
+            addr = self.resolver.resolve(self.config.SHELLY_IP, self.config.SHELLY_PORT)
+            s = socket.socket()
+            self.sock = s
+            s.setblocking(False)
+            try:
+                s.connect(addr)
+            except OSError as e:
+                if not e.args or e.args[0] not in (115, 119):  # EINPROGRESS
+                    raise
+            self.poller = uselect.poll()
+            self.poller.register(s, uselect.POLLOUT)
+            self.antwort = None
+            self.frist = time.time() + 5
+        except Exception as e:
+            self._getrennt(e)
+    
+    def _verbinde_weiter(self, now):
+        """Sync engine: next step of a pending connect, never blocks"""
+        if now >= self.frist:
+            raise OSError("Timeout beim Verbinden")
+        s = self.sock
+        if self.antwort is None:
+            if not self.poller.poll(0):
+                return  # TCP connect still in progress
+            self.poller = None
+            HTTPConnectionPool.sendall(s, self._handshake())
+            self.antwort = b""
+        while b"\r\n\r\n" not in self.antwort:
+            try:
+                teil = s.recv(256)
+            except OSError as e:
+                if e.args and e.args[0] == 11:  # EAGAIN: rest of the answer not here yet
+                    return
+                raise
+            if not teil:
+                raise OSError("Handshake abgebrochen")
+            self.antwort += teil
+        kopf, rest = self.antwort.split(b"\r\n\r\n", 1)
+        self.antwort = None
+        self._pruefe_upgrade(kopf)
+        HTTPConnectionPool.sendall(s, self._subscribe_frame())
+        self._verbunden(s)
+        for frame in self._feed(rest):
+            HTTPConnectionPool.sendall(s, frame)
+    
+    def poll(self):
+        """Sync engine: handle pending frames without blocking, reconnect when due"""
+        now = time.time()
+        if not self.connected:
+            if self.sock:
+                try:
+                    self._verbinde_weiter(now)
+                except Exception as e:
+                    self._getrennt(e)
+            elif now >= self.next_attempt:
+                self.connect()
+            return
+        try:
+            while True:
+                try:
+                    data = self.sock.recv(512)
+                except OSError as e:
+                    if e.args and e.args[0] == 11:  # EAGAIN: nothing pending
+                        break
+                    raise
+                if not data:
+                    raise OSError("WebSocket vom Gerät geschlossen")
+                for frame in self._feed(data):
+                    HTTPConnectionPool.sendall(self.sock, frame)
+            ping = self._pruefe_keepalive(now)
+            if ping:
+                HTTPConnectionPool.sendall(self.sock, ping)
+        except Exception as e:
+            self._getrennt(e)
+    
+    async def run_task(self):
+        """Async engine: keep the WebSocket open for the lifetime of the engine"""
+        while True:
+            try:
+                await self._sitzung()
+            except Exception as e:
+                self._getrennt(e)
+            await asyncio.sleep(max(0, self.next_attempt - time.time()))
+    
+    async def _sitzung(self):
+        """One WebSocket session, returns only by raising"""
+        addr = self.resolver.resolve(self.config.SHELLY_IP, self.config.SHELLY_PORT)
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(addr[0], addr[1]), 5)
+        try:
+            writer.write(self._handshake())
+            await writer.drain()
+            antwort = b""
+            while b"\r\n\r\n" not in antwort:
+                teil = await asyncio.wait_for(reader.read(256), 5)
+                if not teil:
+                    raise OSError("Handshake abgebrochen")
+                antwort += teil
+            kopf, rest = antwort.split(b"\r\n\r\n", 1)
+            self._pruefe_upgrade(kopf)
+            writer.write(self._subscribe_frame())
+            await writer.drain()
+            self._verbunden(None)
+            data = rest
+            while True:
+                for frame in self._feed(data):
+                    writer.write(frame)
+                ping = self._pruefe_keepalive(time.time())
+                if ping:
+                    writer.write(ping)
+                await writer.drain()
+                try:
+                    data = await asyncio.wait_for(reader.read(512), self.config.SHELLY_PUSH_PING)
+                except asyncio.TimeoutError:
+                    data = b""
+                    continue
+                if not data:
+                    raise OSError("WebSocket vom Gerät geschlossen")
+        finally:
+            writer.close()
+
 # ==============================================================================
 # NTP TIME SYNCHRONIZATION
 # ==============================================================================
 class NTPSync:
-    """NTP time synchronization"""
+    """NTP time synchronization in the background: one attempt at a time,
+    failed attempts are retried after NTP_RETRY seconds, doubling up to
+    NTP_RETRY_MAX. NTP_HOST is resolved through the DNSCache (failures are
+    negatively cached; a lookup that misses the cache still blocks as long
+    as lwIP takes). Blocking engine: ntptime gets the IP and blocks the loop
+    for up to NTP_TIMEOUT. Async engine: request and answer on a
+    non-blocking UDP socket, the other tasks keep running"""
     
-    def __init__(self, config, debug_logger):
+    NTP_PORT = 123
+    
+    def __init__(self, config, debug_logger, resolver):
         self.config = config
         self.logger = debug_logger
+        self.resolver = resolver
         self.zeit_sync = False
         self.last_sync = 0
-        self.wdt = None  # Will be set by orchestrator
+        self.fehlversuche = 0  # Consecutive failed attempts
+        self.scheduler = None  # Blocking engine: next attempt as a deadline
+        self.on_sync = None    # Called with the clock jump (seconds) after each successful sync
     
-    def sync_zeit(self, versuche=10, intervall=30):
-        """Synchronize time with NTP server"""
-        ntptime.host = self.config.NTP_HOST
-        self.logger.log("NTP-Sync: Host={}".format(self.config.NTP_HOST))
-        
-        for versuch in range(1, versuche + 1):
-            try:
-                self.logger.log("NTP {}/{}: retry in {} Sek.".format(
-                    versuch, versuche, intervall))
-                ntptime.settime()
-                self.zeit_sync = True
-                self.last_sync = time.time()
-                self.logger.log("Sync OK -> {} (next in 43200 Sek.)".format(
-                    TimeUtils.local_time()))
-                return True
-            except Exception as e:
-                self.logger.log("NTP {}/{} fehl: {} - retry in {} Sek.".format(
-                    versuch, versuche, e, intervall))
-                # Feed watchdog during long sleep
-                if self.wdt:
-                    for _ in range(intervall):
-                        time.sleep(1)
-                        self.wdt.feed()
-                else:
-                    time.sleep(intervall)
-        
-        self.zeit_sync = False
-        self.logger.log("NTP fehlgeschl.: Sync=False")
+    def starte(self):
+        """Log the host and arm the first attempt (right away unless synced before a restart)"""
+        self.logger.log("NTP-Sync: Host={} (im Hintergrund)", self.config.NTP_HOST, sub="ntp")
+        self._plane(self.faellig_in())
+    
+    def faellig_in(self):
+        """Seconds until the next attempt: now at boot, after the retry pause, or the resync"""
+        if self.fehlversuche:
+            return self.naechster_versuch()
+        if not self.zeit_sync:
+            return 0
+        return max(0, self.last_sync + self.config.NTP_SYNC_INTERVAL - time.time())
+    
+    def versuch(self):
+        """Blocking engine: one NTP attempt; arms the next one (resync or retry). True on success"""
+        self._beginne()
+        vorher = time.time()
+        try:
+            ntptime.host = self.resolver.resolve(self.config.NTP_HOST, self.NTP_PORT)[0]
+            ntptime.timeout = self.config.NTP_TIMEOUT
+            ntptime.settime()
+        except Exception as e:
+            return self._fehlschlag(e)
+        return self._erfolg(vorher)
+    
+    async def versuch_async(self):
+        """Async engine: one NTP attempt over a non-blocking UDP socket. True on success"""
+        self._beginne()
+        vorher = time.time()
+        try:
+            addr = self.resolver.resolve(self.config.NTP_HOST, self.NTP_PORT)
+            self._stelle_uhr(await self._abfrage_async(addr))
+        except Exception as e:
+            return self._fehlschlag(e)
+        return self._erfolg(vorher)
+    
+    async def _abfrage_async(self, addr):
+        """Send one client request and await the answer: NTP seconds since 1900"""
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            s.setblocking(False)
+            anfrage = bytearray(48)
+            anfrage[0] = 0x1B  # LI 0, version 3, mode 3 (client)
+            s.sendto(anfrage, addr)
+            ende = time.ticks_add(time.ticks_ms(), int(self.config.NTP_TIMEOUT * 1000))
+            while True:
+                try:
+                    antwort = s.recv(48)
+                    break
+                except OSError as e:
+                    if not e.args or e.args[0] != 11:  # EAGAIN: no answer yet
+                        raise
+                if time.ticks_diff(ende, time.ticks_ms()) <= 0:
+                    raise OSError(110, "NTP Timeout")
+                await asyncio.sleep(0.02)
+        finally:
+            s.close()
+        if len(antwort) < 48:
+            raise OSError("NTP Antwort zu kurz")
+        return struct.unpack("!I", antwort[40:44])[0]
+    
+    @staticmethod
+    def _stelle_uhr(ntp_sekunden):
+        """Set the RTC from NTP seconds, as ntptime.settime() does"""
+        delta = 3155673600 if time.gmtime(0)[0] == 2000 else 2208988800  # 1900 -> device epoch
+        tm = time.gmtime(ntp_sekunden - delta)
+        machine.RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+    
+    def _beginne(self):
+        if self.zeit_sync and not self.fehlversuche:
+            self.logger.log("12h vorbei: erneute NTP-Synchronisation.")
+    
+    def _fehlschlag(self, e):
+        """Count the failure and arm the retry"""
+        self.fehlversuche += 1
+        warte = self.naechster_versuch()
+        self.logger.warn("ntp", "NTP {} fehl: {} - retry in {} Sek.", self.fehlversuche, e, warte)
+        if self.fehlversuche == 10 and self.zeit_sync:
+            self.zeit_sync = False
+            self.logger.log("NTP fehlgeschl.: Sync=False")
+        self._plane(warte)
         return False
     
-    def should_resync(self):
-        """Check if resync is needed"""
-        return time.time() - self.last_sync >= self.config.NTP_SYNC_INTERVAL
+    def _erfolg(self, vorher):
+        """Clock is set (it read vorher before): arm the resync, report the jump"""
+        sprung = time.time() - vorher
+        TimeUtils.invalidate_offset()
+        self.zeit_sync = True
+        self.last_sync = time.time()
+        self.fehlversuche = 0
+        self.logger.log("Sync OK -> {} (next in {} Sek.)",
+            TimeUtils.local_time(), self.config.NTP_SYNC_INTERVAL, sub="ntp")
+        self._plane(self.config.NTP_SYNC_INTERVAL)
+        if self.on_sync:
+            self.on_sync(sprung)
+        return True
+    
+    def naechster_versuch(self):
+        """Retry pause after the current number of failures"""
+        return min(self.config.NTP_RETRY << min(self.fehlversuche - 1, 8), self.config.NTP_RETRY_MAX)
+    
+    def _plane(self, sekunden):
+        """Arm the next attempt as a scheduler deadline (blocking engine)"""
+        if self.scheduler:
+            self.scheduler.set("ntp", sekunden * 1000, self.versuch)
 
 # ==============================================================================
 # DEBUG LOGGER
 # ==============================================================================
 class DebugLogger:
-    """Centralized debug logging"""
+    """Centralized debug logging. Messages are filtered by level and subsystem,
+    kept unformatted in a preallocated ring and printed in batches by flush()"""
+    
+    DEBUG, INFO, WARN, ERROR, OFF = 10, 20, 30, 40, 100
+    STUFEN = {"DEBUG": 10, "INFO": 20, "WARN": 30, "ERROR": 40, "OFF": 100}
     
     def __init__(self, config):
         self.config = config
+        self.level = self.STUFEN.get(config.LOG_LEVEL, self.INFO) if config.DEBUG else self.OFF
+        self.filter = {}
+        for sub, stufe in config.LOG_FILTER.items():
+            self.filter[sub] = self.STUFEN.get(stufe, self.INFO)
+        n = config.LOG_BUFFER_SIZE
+        self.groesse = n
+        self.zeit = array("l", [0] * n)
+        self.texte = [None] * n
+        self.argumente = [None] * n
+        self.kopf = 0
+        self.anzahl = 0
+        self.verworfen = 0
+        self.gepuffert = False  # Print directly until the main loop runs
+        self.recorder = None  # Will be set by orchestrator
+    
+    def aktiv(self, level, sub=None):
+        """Would a message of this level and subsystem be emitted"""
+        if sub is not None and sub in self.filter:
+            return level >= self.filter[sub]
+        return level >= self.level
+    
+    def log(self, message, *args, level=20, sub=None):
+        """Log message with timestamp; str.format(*args) runs only when it is printed"""
+        if not self.aktiv(level, sub):
+            return
+        if not self.gepuffert:
+            self._ausgeben(time.time(), message, args)
+            return
+        if self.anzahl == self.groesse:
+            # Full: overwrite the oldest line
+            self.kopf = (self.kopf + 1) % self.groesse
+            self.anzahl -= 1
+            self.verworfen += 1
+        i = (self.kopf + self.anzahl) % self.groesse
+        self.zeit[i] = int(time.time())
+        self.texte[i] = message
+        self.argumente[i] = args
+        self.anzahl += 1
+    
+    def ereignis(self, typ, geraet=0, wert=0):
+        """Record an event in the flight recorder (if one is attached)"""
+        if self.recorder:
+            self.recorder.ereignis(typ, geraet, wert)
+    
+    def debug(self, sub, message, *args):
+        self.log(message, *args, level=self.DEBUG, sub=sub)
+    
+    def warn(self, sub, message, *args):
+        self.log(message, *args, level=self.WARN, sub=sub)
+    
+    def error(self, sub, message, *args):
+        self.log(message, *args, level=self.ERROR, sub=sub)
+    
+    @staticmethod
+    def _zeile(t, message, args):
+        if args:
+            try:
+                message = message.format(*args)
+            except Exception:
+                message = "{} {}".format(message, args)
+        return "{} {}".format(TimeUtils.format_debug_time(TimeUtils.local_time(t)), message)
+    
+    def _ausgeben(self, t, message, args):
+        print(self._zeile(t, message, args))
+    
+    def flush(self, max_zeilen=None):
+        """Format and print up to max_zeilen buffered lines (default LOG_FLUSH_BATCH)"""
+        if max_zeilen is None:
+            max_zeilen = self.config.LOG_FLUSH_BATCH
+        if self.verworfen:
+            print("{} Log: {} Zeilen verworfen".format(
+                TimeUtils.format_debug_time(TimeUtils.local_time()), self.verworfen))
+            self.verworfen = 0
+        zeilen = []
+        while self.anzahl and len(zeilen) < max_zeilen:
+            i = self.kopf
+            zeilen.append(self._zeile(self.zeit[i], self.texte[i], self.argumente[i]))
+            self.texte[i] = None
+            self.argumente[i] = None
+            self.kopf = (i + 1) % self.groesse
+            self.anzahl -= 1
+        if zeilen:
+            print("\n".join(zeilen))
+        return self.anzahl
+    
+    def flush_all(self):
+        """Print everything buffered (before a restart)"""
+        while self.flush():
+            pass
+
+class RaumLogger:
+    """The shared logger as seen by the components of one room: messages get
+    the room as prefix ("[flur] ..."), only when they are actually emitted"""
+    
+    def __init__(self, logger, raum):
+        self.logger = logger
+        self.kennung = "[{}] ".format(raum)
+    
+    def log(self, message, *args, level=20, sub=None):
+        if self.logger.aktiv(level, sub):
+            self.logger.log(self.kennung + message, *args, level=level, sub=sub)
+    
+    def debug(self, sub, message, *args):
+        self.log(message, *args, level=DebugLogger.DEBUG, sub=sub)
+    
+    def warn(self, sub, message, *args):
+        self.log(message, *args, level=DebugLogger.WARN, sub=sub)
+    
+    def error(self, sub, message, *args):
+        self.log(message, *args, level=DebugLogger.ERROR, sub=sub)
+    
+    def __getattr__(self, name):
+        return getattr(self.logger, name)
+
+# ==============================================================================
+# FLIGHT RECORDER
+# ==============================================================================
+class FlightRecorder:
+    """Ring of the last events as 8-byte records, written through to RTC memory
+    so it survives WDT and soft resets. Unsaved records are appended to flash
+    in batches, rotating over FLIGHT_FILES files. Decoded at boot"""
+    
+    MAGIC = 0xF17E
+    KOPF = "<HHHH"    # magic, next slot, count, unsaved
+    SATZ = "<IBBh"    # epoch seconds, type, device, value
+    KOPF_GROESSE = 8
+    SATZ_GROESSE = 8
+    
+    BOOT, LOOP, API_FEHLER, SPEICHER, ZUSTAND, BREAKER, CRASH, BEREIT, TASTE, NTP = range(1, 11)
+    TYPEN = ("?", "Boot", "Loop langsam (Sek.)", "API-Fehler", "Speicher frei (KB)",
+             "Zustand", "Breaker offen", "Absturz", "Bereit (ms seit Reset)",
+             "Erste Taste (ms seit Reset)", "NTP-Sync (Sprung Sek.)")
+    GERAETE = ("-", "shelly", "nanoleaf", "wled", "override")
+    SHELLY, NANOLEAF, WLED, OVERRIDE = 1, 2, 3, 4
+    
+    def __init__(self, config, debug_logger):
+        self.config = config
+        self.logger = debug_logger
+        self.groesse = config.FLIGHT_RECORDER_SIZE
+        self.puffer = bytearray(self.KOPF_GROESSE + self.groesse * self.SATZ_GROESSE)
+        self.kopf = 0
+        self.anzahl = 0
+        self.ungesichert = 0
+        self.datei = 0
+        self.quelle = None
+        self.rtc = None
+        try:
+            self.rtc = machine.RTC()
+        except Exception:
+            pass
+    
+    @classmethod
+    def geraet_nr(cls, name):
+        """Device index for a name like "WLED" or "shelly" (0 if unknown)"""
+        name = name.lower()
+        for i in range(1, len(cls.GERAETE)):
+            if cls.GERAETE[i] == name:
+                return i
+        return 0
+    
+    def _kopf_schreiben(self):
+        struct.pack_into(self.KOPF, self.puffer, 0, self.MAGIC, self.kopf, self.anzahl, self.ungesichert)
+        if self.rtc:
+            try:
+                self.rtc.memory(self.puffer)
+            except Exception:
+                self.rtc = None
+    
+    def ereignis(self, typ, geraet=0, wert=0):
+        """Append one event; the oldest is overwritten when the ring is full"""
+        wert = max(-32768, min(32767, int(wert)))
+        struct.pack_into(self.SATZ, self.puffer, self.KOPF_GROESSE + self.kopf * self.SATZ_GROESSE,
+                         int(time.time()) & 0xFFFFFFFF, typ, geraet, wert)
+        self.kopf = (self.kopf + 1) % self.groesse
+        if self.anzahl < self.groesse:
+            self.anzahl += 1
+        if self.ungesichert < self.groesse:
+            self.ungesichert += 1
+        self._kopf_schreiben()
+    
+    def eintraege(self, letzte=None):
+        """Records oldest first as (t, typ, geraet, wert); only the last n if given"""
+        n = self.anzahl if letzte is None else min(letzte, self.anzahl)
+        start = (self.kopf - n) % self.groesse
+        for k in range(n):
+            yield struct.unpack_from(self.SATZ, self.puffer,
+                                     self.KOPF_GROESSE + ((start + k) % self.groesse) * self.SATZ_GROESSE)
+    
+    def _dateiname(self, i):
+        return "{}{}.bin".format(self.config.FLIGHT_FILE_PREFIX, i)
+    
+    def _lade_datei_index(self):
+        try:
+            with open(self.config.FLIGHT_FILE_PREFIX + ".idx") as f:
+                self.datei = int(f.read()) % self.config.FLIGHT_FILES
+        except Exception:
+            self.datei = 0
+    
+    def laden(self):
+        """Boot: take over the ring from RTC memory, or the newest flash records
+        after a power loss. Returns the number of recovered events"""
+        self._lade_datei_index()
+        daten = None
+        if self.rtc:
+            try:
+                daten = self.rtc.memory()
+            except Exception:
+                daten = None
+        if daten and len(daten) == len(self.puffer):
+            magic, kopf, anzahl, ungesichert = struct.unpack_from(self.KOPF, daten, 0)
+            if magic == self.MAGIC and kopf < self.groesse and anzahl <= self.groesse:
+                self.puffer[:] = daten
+                self.kopf, self.anzahl, self.ungesichert = kopf, anzahl, ungesichert
+                self.quelle = "RTC"
+                return anzahl
+        # No RTC copy (power loss): reload the tail of the current flash file
+        try:
+            with open(self._dateiname(self.datei), "rb") as f:
+                daten = f.read()
+        except OSError:
+            return 0
+        n = min(len(daten) // self.SATZ_GROESSE, self.groesse)
+        start = len(daten) - n * self.SATZ_GROESSE
+        self.puffer[self.KOPF_GROESSE:self.KOPF_GROESSE + n * self.SATZ_GROESSE] = daten[start:]
+        self.kopf = n % self.groesse
+        self.anzahl = n
+        self.ungesichert = 0
+        self.quelle = "Flash"
+        self._kopf_schreiben()
+        return n
+    
+    def spill(self, erzwingen=False):
+        """Append unsaved records to flash once a batch is complete (or forced)"""
+        if self.ungesichert == 0 or (self.ungesichert < self.config.FLIGHT_SPILL_BATCH and not erzwingen):
+            return False
+        name = self._dateiname(self.datei)
+        try:
+            try:
+                groesse = os.stat(name)[6]
+            except OSError:
+                groesse = 0
+            if groesse >= self.config.FLIGHT_FILE_MAX:
+                # Rotate: the next file is truncated and becomes the current one
+                self.datei = (self.datei + 1) % self.config.FLIGHT_FILES
+                name = self._dateiname(self.datei)
+                with open(self.config.FLIGHT_FILE_PREFIX + ".idx", "w") as f:
+                    f.write(str(self.datei))
+                open(name, "wb").close()
+            start = (self.kopf - self.ungesichert) % self.groesse
+            with open(name, "ab") as f:
+                for k in range(self.ungesichert):
+                    offset = self.KOPF_GROESSE + ((start + k) % self.groesse) * self.SATZ_GROESSE
+                    f.write(self.puffer[offset:offset + self.SATZ_GROESSE])
+        except OSError as e:
+            self.logger.warn("recorder", "Flugschreiber: Flash-Schreiben fehlgeschlagen: {}", e)
+            return False
+        self.ungesichert = 0
+        self._kopf_schreiben()
+        return True
+    
+    def beschreibe(self, satz):
+        """One record as a readable log line"""
+        t, typ, geraet, wert = satz
+        typ_name = self.TYPEN[typ] if typ < len(self.TYPEN) else str(typ)
+        geraet_name = self.GERAETE[geraet] if geraet < len(self.GERAETE) else str(geraet)
+        return "{}{} {} {}".format(
+            TimeUtils.format_debug_time(TimeUtils.local_time(t)), typ_name, geraet_name, wert)
+    
+    def log_verlauf(self, letzte=None):
+        """Log the recovered events (boot)"""
+        for satz in self.eintraege(letzte):
+            self.logger.log("Flugschreiber {}", self.beschreibe(satz))
+
+# ==============================================================================
+# TRACE RECORDER
+# ==============================================================================
+class TraceRecorder:
+    """Appends PIR and button edges to TRACE_FILE for replay on the host
+    (trace_replay.py). Format: a "# kitchen-trace v1 start=<epoch>" header,
+    then "<ms since start> <P|B> <1|0>" per edge"""
+    
+    SEGMENT_MS = 1 << 28  # New header before ticks_diff() could wrap (~3 days)
+    
+    def __init__(self, config, debug_logger):
+        self.config = config
+        self.logger = debug_logger
+        self.datei = config.TRACE_FILE
+        self.zeilen = []
+        self.start_ticks = None
+    
+    def _segment(self, t):
+        """Start a new time base at ticks t"""
+        self.start_ticks = t
+        self.zeilen.append("# kitchen-trace v1 start={}\n".format(time.time()))
+    
+    def kante(self, art, wert, t=None):
+        """Record one edge: art "P" (PIR) or "B" (button), wert 1/0, t in ticks_ms"""
+        if not self.datei:
+            return
+        if t is None:
+            t = time.ticks_ms()
+        if self.start_ticks is None:
+            self._segment(t)
+        ms = time.ticks_diff(t, self.start_ticks)
+        if ms >= self.SEGMENT_MS:
+            self._segment(t)
+            ms = 0
+        self.zeilen.append("{} {} {}\n".format(max(ms, 0), art, 1 if wert else 0))
+        if len(self.zeilen) >= self.config.TRACE_BATCH:
+            self.flush()
     
-    def log(self, message):
-        """Log message with timestamp if debug enabled"""
-        if self.config.DEBUG:
-            print("{} {}".format(TimeUtils.format_debug_time(TimeUtils.local_time()), message))
+    def flush(self):
+        """Append the collected lines to the trace file"""
+        if not self.zeilen:
+            return
+        try:
+            with open(self.datei, "a") as f:
+                for zeile in self.zeilen:
+                    f.write(zeile)
+        except OSError as e:
+            self.logger.warn("trace", "Trace: Schreiben fehlgeschlagen ({}) - Aufzeichnung aus.", e)
+            self.datei = None
+        self.zeilen = []
 
 # ==============================================================================
 # WIFI MONITOR
@@ -641,6 +2353,7 @@ class WiFiMonitor:
         self.reconnect_attempts = 0
         self.max_reconnect_attempts = 5
         self.wdt = None  # Will be set by orchestrator
+        self.pool = None  # Will be set by orchestrator
     
     def is_connected(self):
         """Check if WiFi is connected"""
@@ -682,59 +2395,170 @@ class WiFiMonitor:
             if self.is_connected():
                 self.logger.log("WiFi erfolgreich wiederverbunden")
                 self.reconnect_attempts = 0
+                # Pooled keep-alive sockets belong to the old link
+                if self.pool:
+                    self.pool.close_all()
             else:
-                self.logger.log("WiFi Reconnect fehlgeschlagen (Versuch {}/{})".format(
-                    self.reconnect_attempts, self.max_reconnect_attempts))
+                self.logger.warn("wifi", "WiFi Reconnect fehlgeschlagen (Versuch {}/{})",
+                    self.reconnect_attempts, self.max_reconnect_attempts)
         except Exception as e:
-            self.logger.log("WiFi Reconnect Fehler: {}".format(e))
+            self.logger.warn("wifi", "WiFi Reconnect Fehler: {}", e)
 
 # ==============================================================================
 # CIRCUIT BREAKER
 # ==============================================================================
 class CircuitBreaker:
-    """Prevents cascading failures by breaking circuit after too many errors"""
+    """Prevents cascading failures by breaking circuit after too many errors.
+    While OPEN, callers fail fast; a background half-open probe decides when
+    the device is back, each failed probe doubles the open time (with jitter)"""
     
-    def __init__(self, config, debug_logger, failure_threshold=3, recovery_timeout=60):
+    def __init__(self, config, debug_logger, failure_threshold=3, recovery_timeout=60, name=""):
         self.config = config
         self.logger = debug_logger
+        self.name = name
         self.failure_threshold = failure_threshold
         self.recovery_timeout = recovery_timeout
+        self.max_recovery_timeout = getattr(config, "BREAKER_RECOVERY_MAX", recovery_timeout)
         self.failure_count = 0
         self.last_failure_time = 0
+        self.open_streak = 0  # Consecutive failed probes
+        self.open_until = 0
         self.state = "CLOSED"  # CLOSED=normal, OPEN=broken, HALF_OPEN=testing
     
+    def allow(self):
+        """Requests may be sent"""
+        return self.state == "CLOSED"
+    
+    def blockiert(self, led_controller=None):
+        """Fast-fail check for device calls, shows the breaker colour while blocked"""
+        if self.state == "CLOSED":
+            return False
+        if led_controller and not led_controller.display_active:
+            led_controller.display("ORANGE", 1)
+        return True
+    
+    def probe_due(self):
+        """Open long enough for a half-open probe"""
+        return self.state == "OPEN" and time.time() >= self.open_until
+    
+    def start_probe(self):
+        """Enter HALF_OPEN for one probe"""
+        self.state = "HALF_OPEN"
+        self.logger.log("Circuit Breaker {}: HALF_OPEN - teste Verbindung", self.name, sub="breaker")
+    
+    def record_success(self):
+        """Request succeeded"""
+        if self.state != "CLOSED":
+            self.logger.log("Circuit Breaker {}: CLOSED - Service wiederhergestellt",
+                self.name, sub="breaker")
+        self.state = "CLOSED"
+        self.failure_count = 0
+        self.open_streak = 0
+    
+    def record_failure(self):
+        """Request failed"""
+        self.failure_count += 1
+        self.last_failure_time = time.time()
+        self.logger.ereignis(FlightRecorder.API_FEHLER, FlightRecorder.geraet_nr(self.name), self.failure_count)
+        if self.state == "HALF_OPEN":
+            self.open_streak += 1
+            self._oeffne()
+        elif self.state == "CLOSED" and self.failure_count >= self.failure_threshold:
+            self._oeffne()
+    
+    def _oeffne(self):
+        """Open with exponential backoff plus up to 20 % jitter"""
+        basis = min(self.recovery_timeout << self.open_streak, self.max_recovery_timeout)
+        dauer = basis + basis * random.getrandbits(8) / 1280
+        self.open_until = time.time() + dauer
+        self.state = "OPEN"
+        self.logger.ereignis(FlightRecorder.BREAKER, FlightRecorder.geraet_nr(self.name), int(dauer))
+        self.logger.warn("breaker", "Circuit Breaker {}: OPEN - zu viele Fehler ({}), Probe in {} Sek.",
+                         self.name, self.failure_count, int(dauer))
+    
     def call(self, func, *args, **kwargs):
         """Execute function with circuit breaker protection"""
         if self.state == "OPEN":
-            if time.time() - self.last_failure_time > self.recovery_timeout:
-                self.state = "HALF_OPEN"
-                self.logger.log("Circuit Breaker: HALF_OPEN - teste Verbindung")
-            else:
+            if not self.probe_due():
                 raise Exception("Circuit breaker OPEN - Service unavailable")
+            self.start_probe()
         
         try:
             result = func(*args, **kwargs)
-            if self.state == "HALF_OPEN":
-                self.state = "CLOSED"
-                self.failure_count = 0
-                self.logger.log("Circuit Breaker: CLOSED - Service wiederhergestellt")
+            self.record_success()
             return result
         except Exception as e:
-            self.failure_count += 1
-            self.last_failure_time = time.time()
-            
-            if self.failure_count >= self.failure_threshold:
-                self.state = "OPEN"
-                self.logger.log("Circuit Breaker: OPEN - zu viele Fehler ({})".format(
-                    self.failure_count))
-            
+            self.record_failure()
             raise e
     
     def reset(self):
         """Manually reset the circuit breaker"""
         self.state = "CLOSED"
         self.failure_count = 0
-        self.logger.log("Circuit Breaker: Manueller Reset")
+        self.open_streak = 0
+        self.logger.log("Circuit Breaker {}: Manueller Reset", self.name, sub="breaker")
+
+class BreakerProbe:
+    """Half-open probe of the blocking engine: one status request on its own
+    non-blocking socket, one step per loop pass, so an offline device costs
+    the loop nothing. Any HTTP answer before the timeout counts as success"""
+    
+    def __init__(self, resolver, host, port, anfrage, timeout):
+        self.anfrage = anfrage
+        self.frist = time.ticks_add(time.ticks_ms(), int(timeout * 1000))
+        self.sock = None
+        self.poller = None
+        self.antwort = None  # None: request not sent yet
+        try:
+            addr = resolver.resolve(host, port)
+            self.sock = socket.socket()
+            self.sock.setblocking(False)
+            try:
+                self.sock.connect(addr)
+            except OSError as e:
+                if not e.args or e.args[0] not in (115, 119):  # EINPROGRESS
+                    raise
+            self.poller = uselect.poll()
+            self.poller.register(self.sock, uselect.POLLOUT)
+        except Exception:
+            self._schliesse()
+    
+    def schritt(self):
+        """Advance the probe: True (answered), False (failed) or None (pending)"""
+        if self.sock is None:
+            return False
+        try:
+            if time.ticks_diff(time.ticks_ms(), self.frist) >= 0:
+                raise OSError("Timeout")
+            if self.antwort is None:
+                if not self.poller.poll(0):
+                    return None  # TCP connect still in progress
+                HTTPConnectionPool.sendall(self.sock, self.anfrage)
+                self.antwort = b""
+            try:
+                teil = self.sock.recv(16)
+            except OSError as e:
+                if e.args and e.args[0] == 11:  # EAGAIN: no answer yet
+                    return None
+                raise
+            if not teil:
+                raise OSError("Verbindung geschlossen")
+            self.antwort += teil
+            if len(self.antwort) < 5:
+                return None
+            ok = self.antwort.startswith(b"HTTP/")
+        except Exception:
+            ok = False
+        self._schliesse()
+        return ok
+    
+    def _schliesse(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except:
+                pass
+        self.sock = None
 
 # ==============================================================================
 # LED CONTROLLER
@@ -742,10 +2566,11 @@ class CircuitBreaker:
 class LEDController:
     """Controls the status LED with duration and override logic"""
     
-    def __init__(self, config, debug_logger, led_rgb):
+    def __init__(self, config, debug_logger, led_rgb, scheduler=None):
         self.config = config
         self.logger = debug_logger
         self.led_rgb = led_rgb
+        self.scheduler = scheduler  # Expiry and blink steps as deadlines instead of polling
         self.display_active = False
         self.display_expiry = 0
         self.display_color = None
@@ -768,14 +2593,16 @@ class LEDController:
         if color == "AUS":
             self.display_active = False
             self.led_rgb.fill_color(self.config.LED_COLORS["AUS"])
-            self.logger.log("LED aus. (0 Sek.)")
+            if self.scheduler:
+                self.scheduler.cancel("led")
+            self.logger.debug("led", "LED aus. (0 Sek.)")
             return
         
         # Check if display is already active and not expired
         if not force_override and self.display_active and now < self.display_expiry:
             remaining = int(self.display_expiry - now)
-            self.logger.log("LED aktiv bis {} ({} Sek. zb.), ignoriert.".format(
-                int(self.display_expiry), remaining))
+            self.logger.debug("led", "LED aktiv bis {} ({} Sek. zb.), ignoriert.",
+                              int(self.display_expiry), remaining)
             return
         
         # Set new display
@@ -783,6 +2610,8 @@ class LEDController:
         self.display_expiry = now + duration
         self.display_color = color
         self.display_start = now
+        if self.scheduler:
+            self.scheduler.set("led", duration * 1000, self._ablauf)
         
         # Set color
         if color == "WEISS_BLINKEN":
@@ -796,7 +2625,7 @@ class LEDController:
                 col = self.config.LED_COLORS["AUS"]
             self.led_rgb.fill_color(col)
         
-        self.logger.log("LED {} für {} Sek. an.".format(color, duration))
+        self.logger.debug("led", "LED {} für {} Sek. an.", color, duration)
     
     def start_blinking(self, color="WEISS", blink_interval=0.5):
         """Start blinking the LED"""
@@ -809,6 +2638,8 @@ class LEDController:
         self.blink_interval = blink_interval
         self.blink_last_toggle = time.time()
         self.blink_state = True  # Start with LED on
+        if self.scheduler:
+            self.scheduler.every("led_blink", blink_interval * 1000, self._blink_schritt)
         
         # Turn LED on immediately
         if color in self.config.LED_COLORS:
@@ -816,16 +2647,18 @@ class LEDController:
         else:
             self.led_rgb.fill_color(0xFFFFFF)  # Default white
         
-        self.logger.log("LED-Blinken gestartet: {} (Intervall: {}s)".format(color, blink_interval))
+        self.logger.debug("led", "LED-Blinken gestartet: {} (Intervall: {}s)", color, blink_interval)
     
     def stop_blinking(self):
         """Stop blinking the LED"""
         if self.is_blinking:
             self.is_blinking = False
+            if self.scheduler:
+                self.scheduler.cancel("led_blink")
             self.blink_color = None
             self.blink_state = False
             self.led_rgb.fill_color(self.config.LED_COLORS["AUS"])
-            self.logger.log("LED-Blinken gestoppt.")
+            self.logger.debug("led", "LED-Blinken gestoppt.")
     
     def update(self):
         """Update LED display, turn off if expired, handle blinking"""
@@ -833,80 +2666,190 @@ class LEDController:
         
         # Handle blinking
         if self.is_blinking and not self.display_active:
-            if now - self.blink_last_toggle >= self.blink_interval:
-                self.blink_state = not self.blink_state
+            if not self.scheduler and now - self.blink_last_toggle >= self.blink_interval:
                 self.blink_last_toggle = now
-                if self.blink_state:
-                    # Turn on
-                    if self.blink_color in self.config.LED_COLORS:
-                        self.led_rgb.fill_color(self.config.LED_COLORS[self.blink_color])
-                    else:
-                        self.led_rgb.fill_color(0xFFFFFF)  # Default white
-                else:
-                    # Turn off
-                    self.led_rgb.fill_color(self.config.LED_COLORS["AUS"])
+                self._blink_schritt()
         
         # Handle regular display expiry
         elif self.display_active and now >= self.display_expiry:
+            self._ablauf()
+    
+    def _ablauf(self):
+        """Display duration over: LED off (scheduler deadline, ms accurate)"""
+        if not self.display_active:
+            return
+        self.led_rgb.fill_color(self.config.LED_COLORS["AUS"])
+        self.display_active = False
+        self.display_expiry = 0
+        self.display_color = None
+        self.logger.debug("led", "LED-Dauer abgelaufen, LED aus.")
+    
+    def _blink_schritt(self):
+        """Toggle the blinking LED once"""
+        if not self.is_blinking or self.display_active:
+            return
+        self.blink_state = not self.blink_state
+        if self.blink_state:
+            # Turn on
+            if self.blink_color in self.config.LED_COLORS:
+                self.led_rgb.fill_color(self.config.LED_COLORS[self.blink_color])
+            else:
+                self.led_rgb.fill_color(0xFFFFFF)  # Default white
+        else:
+            # Turn off
             self.led_rgb.fill_color(self.config.LED_COLORS["AUS"])
-            self.display_active = False
-            self.display_expiry = 0
-            self.display_color = None
-            self.logger.log("LED-Dauer abgelaufen, LED aus.")
 
 # ==============================================================================
 # DARKNESS CHECKER
 # ==============================================================================
+class SunTable:
+    """Sunset per day of year as UTC minutes in a 366-entry array('H').
+    Built once per year from the NOAA approximation, afterwards a lookup"""
+    
+    TAGE = 366
+    
+    def __init__(self, latitude, longitude, zenith):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.zenith = zenith
+        self.minuten = array("H", [0] * self.TAGE)
+        self.jahr = 0
+    
+    @staticmethod
+    def ist_schaltjahr(jahr):
+        return jahr % 4 == 0 and (jahr % 100 != 0 or jahr % 400 == 0)
+    
+    def sunset_utc(self, yday, tage_im_jahr):
+        """Sunset (or the configured zenith) in UTC minutes for one day"""
+        g = 2 * math.pi / tage_im_jahr * (yday - 1 + 0.5)
+        eqtime = 229.18 * (0.000075 + 0.001868 * math.cos(g) - 0.032077 * math.sin(g)
+                           - 0.014615 * math.cos(2 * g) - 0.040849 * math.sin(2 * g))
+        decl = (0.006918 - 0.399912 * math.cos(g) + 0.070257 * math.sin(g)
+                - 0.006758 * math.cos(2 * g) + 0.000907 * math.sin(2 * g)
+                - 0.002697 * math.cos(3 * g) + 0.00148 * math.sin(3 * g))
+        lat = math.radians(self.latitude)
+        cos_ha = (math.cos(math.radians(self.zenith)) / (math.cos(lat) * math.cos(decl))
+                  - math.tan(lat) * math.tan(decl))
+        # Polar day/night: clamp instead of failing
+        ha = math.degrees(math.acos(max(-1.0, min(1.0, cos_ha))))
+        return int(720 - 4 * (self.longitude - ha) - eqtime + 0.5) % 1440
+    
+    def fuer_jahr(self, jahr):
+        """Fill the table for the given year (no-op if it already is)"""
+        if jahr == self.jahr:
+            return
+        tage = 366 if self.ist_schaltjahr(jahr) else 365
+        for yday in range(1, tage + 1):
+            self.minuten[yday - 1] = self.sunset_utc(yday, tage)
+        if tage == 365:
+            self.minuten[365] = self.minuten[364]
+        self.jahr = jahr
+
+class DarknessSchedule:
+    """Today's darkness window as epoch seconds. Rebuilt at local midnight,
+    at a DST change or after an NTP sync; in between, checking a time is
+    plain integer comparison"""
+    
+    def __init__(self, config):
+        self.config = config
+        # "HH:MM" strings parsed once: minutes after midnight per month
+        self.sunset_minuten = [0] * 13
+        for monat in range(1, 13):
+            time_str = config.sun_times.get(monat, {"sunset_schaltzeit": "16:30"})["sunset_schaltzeit"]
+            hours, minutes = map(int, time_str.split(':'))
+            self.sunset_minuten[monat] = hours * 60 + minutes
+        self.sonne = None
+        if config.LATITUDE is not None and config.LONGITUDE is not None:
+            self.sonne = SunTable(config.LATITUDE, config.LONGITUDE, config.SUN_ZENITH)
+        self.dunkel_ab = 0      # Epoch: sunset switching time today
+        self.cutoff = 0         # Epoch: no auto-on from here (AUTO_ON_NICHT_NACH)
+        self.gueltig_bis = 0    # Epoch: next local midnight or DST change
+        self.sync_stand = -1    # NTPSync.last_sync the schedule was built with
+        self.monat = 0
+    
+    def veraltet(self, now, last_sync):
+        """Schedule needs a rebuild"""
+        return now >= self.gueltig_bis or last_sync != self.sync_stand
+    
+    def rebuild(self, now, last_sync):
+        """Compute today's thresholds from the current local time"""
+        offset = TimeUtils.get_germany_offset(now)
+        lt = time.gmtime(now + offset)
+        mitternacht = now - (lt[3] * 3600 + lt[4] * 60 + lt[5])
+        self.monat = lt[1]
+        if self.sonne:
+            # Table is in UTC minutes; local midnight + offset is UTC midnight of the local date
+            self.sonne.fuer_jahr(lt[0])
+            self.dunkel_ab = (mitternacht + offset
+                              + (self.sonne.minuten[lt[7] - 1] + self.config.SUN_OFFSET_MIN) * 60)
+        else:
+            self.dunkel_ab = mitternacht + self.sunset_minuten[lt[1]] * 60
+        self.cutoff = mitternacht + self.config.AUTO_ON_NICHT_NACH * 60
+        self.gueltig_bis = min(mitternacht + 86400, TimeUtils._offset_bis)
+        self.sync_stand = last_sync
+
 class DarknessChecker:
     """Checks if it's dark enough for automatic light activation"""
     
+    # Reason of the last decision, logged only when it changes
+    TEST, KEIN_SYNC, NACH_CUTOFF, DUNKEL, HELL = range(5)
+    
     def __init__(self, config, ntp_sync, debug_logger):
         self.config = config
         self.ntp_sync = ntp_sync
         self.logger = debug_logger
         self.test_mode_override = False  # Test mode override
+        self.schedule = DarknessSchedule(config)
+        self.letzter_grund = None
     
-    def ermittle_sunset_schaltzeit_minuten(self):
-        """Get sunset switching time in minutes for current month"""
-        current_month = TimeUtils.local_time()[1]
-        time_str = self.config.sun_times.get(current_month, {"sunset_schaltzeit": "16:30"})["sunset_schaltzeit"]
-        hours, minutes = map(int, time_str.split(':'))
-        return hours * 60 + minutes
+    def _melde(self, grund, now):
+        """Log the decision when the reason changed since the last check"""
+        if grund == self.letzter_grund:
+            return
+        self.letzter_grund = grund
+        if grund == self.TEST:
+            self.logger.log("Test-Modus aktiv => immer dunkel")
+        elif grund == self.KEIN_SYNC:
+            self.logger.log("Kein Sync => dunkel (schnell Prüfen)")
+        elif grund == self.NACH_CUTOFF:
+            cutoff_time = "{:02d}:{:02d}".format(
+                self.config.AUTO_ON_NICHT_NACH // 60, self.config.AUTO_ON_NICHT_NACH % 60)
+            self.logger.log("Nach {}: Auto-Off ({} Sek. bis Tagesw.)",
+                cutoff_time, self.schedule.gueltig_bis - now, sub="dunkel")
+        elif grund == self.DUNKEL:
+            self.logger.log("Dunkel: Auto-On bis {} Sek.", self.schedule.cutoff - now, sub="dunkel")
+        else:
+            self.logger.log("Zu hell - dunkel in {} Sek.",
+                self.schedule.dunkel_ab - now, sub="dunkel")
     
     def ist_dunkel_genug(self):
         """Check if it's dark enough for automatic light activation"""
         # Test mode override - always dark
         if self.test_mode_override:
-            self.logger.log("Test-Modus aktiv => immer dunkel")
+            self._melde(self.TEST, 0)
             return True
             
         # No time sync = assume dark (fail-safe)
         if not self.ntp_sync.zeit_sync:
-            self.logger.log("Kein Sync => dunkel (schnell Prüfen)")
+            self._melde(self.KEIN_SYNC, 0)
             return True
         
-        lt = TimeUtils.local_time()
-        aktuelle_min = lt[3] * 60 + lt[4]
+        now = time.time()
+        schedule = self.schedule
+        if schedule.veraltet(now, self.ntp_sync.last_sync):
+            schedule.rebuild(now, self.ntp_sync.last_sync)
         
         # After 22:00 (or configured time) - no auto-on
-        if aktuelle_min >= self.config.AUTO_ON_NICHT_NACH:
-            secs = (24*60 - aktuelle_min) * 60
-            cutoff_hours = self.config.AUTO_ON_NICHT_NACH // 60
-            cutoff_minutes = self.config.AUTO_ON_NICHT_NACH % 60
-            cutoff_time = "{:02d}:{:02d}".format(cutoff_hours, cutoff_minutes)
-            self.logger.log("Nach {}: Auto-Off ({} Sek. bis Tagesw.)".format(
-                cutoff_time, secs))
+        if now >= schedule.cutoff:
+            self._melde(self.NACH_CUTOFF, now)
             return False
         
         # Check against sunset time
-        schaltzeit = self.ermittle_sunset_schaltzeit_minuten()
-        if aktuelle_min >= schaltzeit:
-            self.logger.log("Dunkel: Auto-On (prüf in 60 Sek.)")
+        if now >= schedule.dunkel_ab:
+            self._melde(self.DUNKEL, now)
             return True
-        else:
-            remaining = (schaltzeit - aktuelle_min) * 60
-            self.logger.log("Zu hell - prüf in {} Sek.".format(remaining))
-            return False
+        self._melde(self.HELL, now)
+        return False
 
 # ==============================================================================
 # LIGHT STATE CACHE
@@ -923,12 +2866,32 @@ class LightStateCache:
         self.last_state_update_time = 0
         self.cached_light_state = False
         self.last_state_known = False
+        self.confirmed_time = 0   # Last time the device itself reported the state
+        self.push_live = False    # Shelly push connected: every change is reported
     
     def update_cache(self, new_state):
-        """Update cached state"""
+        """Update cached state (optimistic, not yet confirmed by the device)"""
+        if new_state != self.cached_light_state:
+            self.logger.ereignis(FlightRecorder.ZUSTAND, FlightRecorder.SHELLY, 1 if new_state else 0)
         self.cached_light_state = new_state
         self.last_state_update_time = time.time()
         self.last_state_known = True
+        self.confirmed_time = 0
+    
+    def confirm(self, state):
+        """State reported by the device (read, write response or push)"""
+        self.update_cache(state)
+        self.confirmed_time = self.last_state_update_time
+    
+    def is_fresh(self, now=None):
+        """Cached state is trustworthy enough to toggle without reading first"""
+        if not self.confirmed_time:
+            return False
+        if self.push_live:
+            return True
+        if now is None:
+            now = time.time()
+        return now - self.confirmed_time < self.config.TOGGLE_CACHE_MAX_AGE
     
     def get_light_state(self, force_refresh=False):
         """Get current light state (cached or fresh)"""
@@ -941,69 +2904,238 @@ class LightStateCache:
         # Refresh from APIs
         shelly_state = self.shelly_api.lese_status()
         # nanoleaf_state = self.nanoleaf_api.lese_status() or False  # Nanoleaf integration disabled
-        nanoleaf_state = False
+        return self._apply_refresh(shelly_state, now)
+    
+    async def refresh_async(self):
+        """Non-blocking forced refresh for the async engine"""
+        shelly_state = await self.shelly_api.lese_status_async()
+        return self._apply_refresh(shelly_state, time.time())
+    
+    def _apply_refresh(self, shelly_state, now):
+        """Store a freshly read Shelly state"""
         if shelly_state is None:
             self.last_state_known = False
             self.last_state_update_time = now
             cache_text = "an" if self.cached_light_state else "aus"
-            self.logger.log(
-                "Zust.-akt. FEHLER: Shelly-Status unbekannt (Nanoleaf deaktiviert) - Cache bleibt {}.".format(
-                    cache_text))
+            self.logger.warn("shelly",
+                "Zust.-akt. FEHLER: Shelly-Status unbekannt (Nanoleaf deaktiviert) - Cache bleibt {}.",
+                cache_text)
             return self.cached_light_state
 
         updated_state = bool(shelly_state)
         self.cached_light_state = updated_state
         self.last_state_update_time = now
         self.last_state_known = True
+        self.confirmed_time = now
 
-        self.logger.log("Zust.-akt. OK: Shelly={} (Nanoleaf deaktiviert) - gültig für {} Sek.".format(
-            shelly_state, self.config.CACHE_REFRESH_INTERVAL))
+        self.logger.log("Zust.-akt. OK: Shelly={} (Nanoleaf deaktiviert) - gültig für {} Sek.",
+            shelly_state, self.config.CACHE_REFRESH_INTERVAL, sub="shelly")
 
         return updated_state
 
 # ==============================================================================
 # PIR EVENT MANAGER
 # ==============================================================================
+class TimestampRing:
+    """Fixed-capacity ring of ascending second timestamps: O(1) append,
+    expiry from the head and count, no allocation after construction.
+    When full, the oldest timestamp is overwritten"""
+    
+    def __init__(self, capacity):
+        self.zeiten = array("l", [0] * capacity)
+        self.capacity = capacity
+        self.head = 0   # Index of the oldest entry
+        self.count = 0
+    
+    def append(self, t):
+        """Add the newest timestamp"""
+        if self.count == self.capacity:
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+        self.zeiten[(self.head + self.count) % self.capacity] = t
+        self.count += 1
+    
+    def expire(self, grenze):
+        """Drop timestamps <= grenze from the head"""
+        while self.count and self.zeiten[self.head] <= grenze:
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+    
+    def clear(self):
+        """Drop all timestamps"""
+        self.head = 0
+        self.count = 0
+    
+    def verschiebe(self, sprung):
+        """Move all timestamps by sprung seconds (clock was set)"""
+        for k in range(self.count):
+            i = (self.head + k) % self.capacity
+            self.zeiten[i] += sprung
+    
+    def __len__(self):
+        return self.count
+
 class PIREventManager:
     """Manages PIR events and motion detection logic"""
     
     def __init__(self, config, debug_logger):
         self.config = config
         self.logger = debug_logger
-        self.events = []
+        self.events = TimestampRing(config.PIR_EVENT_CAPACITY)
         self.last_reset = 0
         self.active = False
         self.last_cleanup = 0
     
     def add_event(self, timestamp):
         """Add a PIR event and remove expired ones (sliding window)"""
+        timestamp = int(timestamp)
         # Remove events older than the sliding window (PIR_WINDOW)
-        window_start = timestamp - self.config.PIR_WINDOW
-        self.events = [e for e in self.events if e > window_start]
+        self.events.expire(timestamp - self.config.PIR_WINDOW)
         
         # Add the new event
         self.events.append(timestamp)
         self.last_reset = timestamp
-        return len(self.events)
+        return self.events.count
     
     def cleanup_old_events(self, timestamp):
         """Periodic cleanup of old events"""
         if timestamp - self.last_cleanup > 60:  # Cleanup every minute
-            window_start = timestamp - self.config.PIR_WINDOW
-            self.events = [e for e in self.events if e > window_start]
+            self.events.expire(int(timestamp) - self.config.PIR_WINDOW)
             self.last_cleanup = timestamp
     
     def clear_events(self):
         """Clear all events"""
         self.events.clear()
     
+    def verschiebe(self, sprung):
+        """Clock was set: keep the window of events already counted"""
+        self.events.verschiebe(sprung)
+        if self.last_reset:
+            self.last_reset += sprung
+        if self.last_cleanup:
+            self.last_cleanup += sprung
+    
     def get_event_count(self):
         """Get current event count"""
-        return len(self.events)
+        return self.events.count
     
     def threshold_reached(self):
         """Check if event threshold is reached"""
-        return len(self.events) >= self.config.EVENT_THRESHOLD
+        return self.events.count >= self.config.EVENT_THRESHOLD
+
+# ==============================================================================
+# DEADLINE SCHEDULER
+# ==============================================================================
+class DeadlineScheduler:
+    """Min-heap of named one-shot or periodic deadlines (ms). Components
+    register their next deadline instead of being polled; the engine sleeps
+    until the earliest one. Re-setting a name replaces its old deadline"""
+    
+    def __init__(self):
+        self.heap = []       # (deadline_ms, seq, name, callback, periode_ms)
+        self.aktiv = {}      # name -> valid heap entry (replaced ones are skipped lazily)
+        self.seq = 0
+        self.mono = 0        # Unwrapped ms counter, immune to ticks_ms wrap-around
+        self.last_tick = time.ticks_ms()
+        self.on_change = None  # Wakes the async scheduler task on an earlier deadline
+        self.fired_count = 0
+    
+    def now_ms(self):
+        """Monotonic milliseconds since start"""
+        t = time.ticks_ms()
+        self.mono += time.ticks_diff(t, self.last_tick)
+        self.last_tick = t
+        return self.mono
+    
+    def set(self, name, delay_ms, callback, periode_ms=0):
+        """(Re)arm deadline name in delay_ms; periodic if periode_ms is given"""
+        self.seq += 1
+        eintrag = (self.now_ms() + max(0, int(delay_ms)), self.seq, name, callback, periode_ms)
+        self.aktiv[name] = eintrag
+        if len(self.heap) > 2 * len(self.aktiv) + 8:
+            # Many replaced entries: rebuild instead of letting them pile up
+            self.heap = list(self.aktiv.values())
+            heapq.heapify(self.heap)
+        else:
+            heapq.heappush(self.heap, eintrag)
+        if self.on_change and self.heap[0] is eintrag:
+            self.on_change()
+    
+    def every(self, name, periode_ms, callback):
+        """Periodic deadline, first run one period from now"""
+        self.set(name, periode_ms, callback, periode_ms)
+    
+    def cancel(self, name):
+        """Drop deadline name if armed"""
+        self.aktiv.pop(name, None)
+    
+    def pending(self, name):
+        """Deadline name is armed"""
+        return name in self.aktiv
+    
+    def clear(self):
+        """Drop all deadlines (restart: their callbacks belong to the old components)"""
+        self.heap = []
+        self.aktiv = {}
+    
+    def _bereinige(self):
+        """Pop replaced/cancelled entries off the top"""
+        heap = self.heap
+        while heap and self.aktiv.get(heap[0][2]) is not heap[0]:
+            heapq.heappop(heap)
+    
+    def ms_until_next(self):
+        """Milliseconds until the earliest deadline, None if nothing is armed"""
+        self._bereinige()
+        if not self.heap:
+            return None
+        return max(0, self.heap[0][0] - self.now_ms())
+    
+    def run_due(self):
+        """Fire all deadlines that have passed"""
+        now = self.now_ms()
+        while True:
+            self._bereinige()
+            if not self.heap or self.heap[0][0] > now:
+                return
+            deadline, _, name, callback, periode = heapq.heappop(self.heap)
+            del self.aktiv[name]
+            if periode:
+                # Keep the period drift-free unless we fell behind
+                self.seq += 1
+                naechste = deadline + periode
+                eintrag = (naechste if naechste > now else now + periode, self.seq, name, callback, periode)
+                self.aktiv[name] = eintrag
+                heapq.heappush(self.heap, eintrag)
+            self.fired_count += 1
+            callback()
+
+class RaumScheduler:
+    """One room's view of the shared scheduler: its deadline names are
+    prefixed ("flur.inaktiv"), so rooms never replace each other's deadlines"""
+
+    def __init__(self, scheduler, raum):
+        self.scheduler = scheduler
+        self.praefix = raum + "."
+        self.namen = {}  # name -> prefixed name, built once per name
+
+    def _name(self, name):
+        voll = self.namen.get(name)
+        if voll is None:
+            voll = self.namen[name] = self.praefix + name
+        return voll
+
+    def set(self, name, delay_ms, callback, periode_ms=0):
+        self.scheduler.set(self._name(name), delay_ms, callback, periode_ms)
+
+    def every(self, name, periode_ms, callback):
+        self.scheduler.every(self._name(name), periode_ms, callback)
+
+    def cancel(self, name):
+        self.scheduler.cancel(self._name(name))
+
+    def pending(self, name):
+        return self.scheduler.pending(self._name(name))
 
 # ==============================================================================
 # TIMER MANAGER
@@ -1011,20 +3143,39 @@ class PIREventManager:
 class TimerManager:
     """Manages all timers in the system"""
     
-    def __init__(self, config, debug_logger):
+    def __init__(self, config, debug_logger, scheduler=None):
         self.config = config
         self.logger = debug_logger
+        self.scheduler = scheduler
         self.last_event = None
         self.manual_override_until = 0
         self.wled_auto_off_timer = None
+        self.on_inactive = None      # Called when the inactivity deadline passes
+        self.on_wled_auto_off = None  # Called when the WLED auto-off deadline passes
     
     def set_last_event(self, timestamp=None):
         """Set last event timestamp"""
         self.last_event = timestamp if timestamp else time.time()
+        self._plane_inaktiv()
     
     def clear_last_event(self):
         """Clear last event timestamp"""
         self.last_event = None
+        if self.scheduler:
+            self.scheduler.cancel("inaktiv")
+    
+    def _plane_inaktiv(self):
+        """Arm the inactivity deadline"""
+        if self.scheduler and self.on_inactive:
+            remaining = self.get_remaining_inactive_time()
+            self.scheduler.set("inaktiv", remaining * 1000, self._inaktiv_faellig)
+    
+    def _inaktiv_faellig(self):
+        """Inactivity deadline passed (re-arm if the second clock lags behind)"""
+        if self.is_inactive_timeout_reached():
+            self.on_inactive()
+        elif self.last_event is not None:
+            self.scheduler.set("inaktiv", 1000, self._inaktiv_faellig)
     
     def is_inactive_timeout_reached(self):
         """Check if inactivity timeout is reached"""
@@ -1044,6 +3195,7 @@ class TimerManager:
         if duration is None:
             duration = self.config.MANUAL_OVERRIDE_TIME
         self.manual_override_until = time.time() + duration
+        self.logger.ereignis(FlightRecorder.ZUSTAND, FlightRecorder.OVERRIDE, duration)
     
     def is_manual_override_active(self):
         """Check if manual override is active"""
@@ -1060,16 +3212,232 @@ class TimerManager:
         if duration is None:
             duration = self.config.WLED_AUTO_OFF_SECONDS
         self.wled_auto_off_timer = time.time() + duration
+        if self.scheduler and self.on_wled_auto_off:
+            self.scheduler.set("wled_aus", duration * 1000, self._wled_faellig)
     
     def clear_wled_auto_off(self):
         """Clear WLED auto-off timer"""
         self.wled_auto_off_timer = None
+        if self.scheduler:
+            self.scheduler.cancel("wled_aus")
+    
+    def _wled_faellig(self):
+        """WLED auto-off deadline passed (re-arm if the second clock lags behind)"""
+        if self.is_wled_auto_off_due():
+            self.on_wled_auto_off()
+        elif self.wled_auto_off_timer is not None:
+            self.scheduler.set("wled_aus", 1000, self._wled_faellig)
+    
+    def plane_neu(self):
+        """Restart: re-arm the deadlines of timers still running from before"""
+        if self.last_event is not None:
+            self._plane_inaktiv()
+        if self.wled_auto_off_timer is not None and self.scheduler and self.on_wled_auto_off:
+            rest = max(0, self.wled_auto_off_timer - time.time())
+            self.scheduler.set("wled_aus", rest * 1000, self._wled_faellig)
     
     def is_wled_auto_off_due(self):
         """Check if WLED should auto-off"""
         if self.wled_auto_off_timer is None:
             return False
         return time.time() >= self.wled_auto_off_timer
+    
+    def verschiebe(self, sprung):
+        """Clock was set: running timers keep their remaining time"""
+        if self.last_event is not None:
+            self.last_event += sprung
+        if self.manual_override_until:
+            self.manual_override_until += sprung
+        if self.wled_auto_off_timer is not None:
+            self.wled_auto_off_timer += sprung
+
+# ==============================================================================
+# COMMAND QUEUE (WRITE-BEHIND)
+# ==============================================================================
+class CommandSlot:
+    """Desired state of one device that has not been sent yet"""
+    
+    def __init__(self, name, write, write_async, read, read_async):
+        self.name = name
+        self.write = write              # write(state) -> True on success
+        self.write_async = write_async
+        self.read = read                # read() -> current state or None
+        self.read_async = read_async
+        self.target = None              # True/False, TOGGLE or LESEN
+        self.callbacks = []             # on_done(state) waiting for a toggle/read
+        self.quittungen = []            # quittung(name) waiting for an acknowledged write
+        self.versuche = 0
+        self.next_try = 0
+        self.in_flight = False
+
+class CommandQueue:
+    """Write-behind queue with one desired-state slot per device. A newer
+    command replaces an unsent one, so bursts collapse into a single write
+    of the latest target; callers are acknowledged immediately"""
+    
+    TOGGLE = "toggle"  # Resolved against the device state at send time
+    LESEN = "lesen"    # Two toggles cancelled out: only report the current state
+    
+    def __init__(self, config, debug_logger):
+        self.config = config
+        self.logger = debug_logger
+        self.slots = {}
+        self.event = asyncio.Event() if asyncio else None
+        self.sent_count = 0
+        self.collapsed_count = 0
+        self.quittung = None  # Handed to the next submitted command, called when its write is acknowledged
+    
+    def register(self, name, write, write_async, read=None, read_async=None):
+        """Add a device with its blocking and async write/read functions"""
+        self.slots[name] = CommandSlot(name, write, write_async, read, read_async)
+    
+    def pending(self, name):
+        """Unsent target state of a device, None if nothing concrete is queued"""
+        target = self.slots[name].target
+        return target if target is True or target is False else None
+    
+    def queued(self, name):
+        """Command waiting to be sent"""
+        return self.slots[name].target is not None
+    
+    def busy(self, name):
+        """Command queued or being sent"""
+        slot = self.slots[name]
+        return slot.target is not None or slot.in_flight
+    
+    def submit(self, name, target, on_done=None):
+        """Queue desired state (True/False/TOGGLE). Returns the acknowledged
+        state, or None while a toggle still waits for the device state;
+        on_done receives the state as soon as it is known"""
+        slot = self.slots[name]
+        alt = slot.target
+        if target == self.TOGGLE:
+            if alt is True or alt is False:
+                target = not alt
+            elif alt == self.TOGGLE:
+                target = self.LESEN
+        if alt is not None:
+            self.collapsed_count += 1
+        slot.target = target
+        slot.versuche = 0
+        slot.next_try = 0
+        if on_done:
+            slot.callbacks.append(on_done)
+        if self.quittung:
+            slot.quittungen.append(self.quittung)
+            self.quittung = None
+        if self.event:
+            self.event.set()
+        if target is True or target is False:
+            self._melde(slot.callbacks, target)
+            slot.callbacks = []
+            return target
+        return None
+    
+    @staticmethod
+    def _melde(callbacks, state):
+        """Report resolved state to waiting callers"""
+        for on_done in callbacks:
+            on_done(state)
+    
+    def _naechster(self, slot, now):
+        """Take the command due for sending, None if nothing to do"""
+        if slot.target is None or slot.in_flight or now < slot.next_try:
+            return None
+        auftrag = (slot.target, slot.callbacks)
+        slot.target = None
+        slot.callbacks = []
+        slot.in_flight = True
+        return auftrag
+    
+    def _aufloesen(self, slot, target, callbacks, state):
+        """Resolve TOGGLE/LESEN with the device state, returns the state to write or None"""
+        neuer = slot.target
+        if neuer is True or neuer is False:
+            # Superseded while reading: the newer command decides
+            self._melde(callbacks, neuer)
+            return None
+        state = bool(state)  # Unknown counts as off, like the original toggle
+        if target == self.LESEN:
+            self._melde(callbacks, state)
+            return None
+        self._melde(callbacks, not state)
+        return not state
+    
+    def _fertig(self, slot, target, ok):
+        """Account for a finished write, schedule a retry on failure"""
+        slot.in_flight = False
+        if self.event:
+            self.event.set()
+        if ok:
+            self.sent_count += 1
+            quittungen = slot.quittungen
+            slot.quittungen = []
+            for quittung in quittungen:
+                quittung(slot.name)
+            return
+        if slot.target is not None:
+            return  # Superseded: the newer command goes out next
+        slot.versuche += 1
+        if slot.versuche > self.config.COMMAND_RETRIES:
+            self.logger.warn("befehle", "Befehl {} => {} verworfen nach {} Versuchen.",
+                slot.name, target, slot.versuche)
+            slot.versuche = 0
+            slot.quittungen = []
+            return
+        delay = min(self.config.COMMAND_RETRY_DELAY << (slot.versuche - 1), 30)
+        slot.target = target
+        slot.next_try = time.time() + delay
+        self.logger.warn("befehle", "Befehl {} => {} fehlgeschlagen - retry in {} Sek.",
+                         slot.name, target, delay)
+    
+    def flush(self):
+        """Blocking engine: send all due commands"""
+        now = time.time()
+        for slot in self.slots.values():
+            auftrag = self._naechster(slot, now)
+            if auftrag is None:
+                continue
+            target, callbacks = auftrag
+            if target == self.TOGGLE or target == self.LESEN:
+                target = self._aufloesen(slot, target, callbacks, slot.read())
+                if target is None:
+                    slot.in_flight = False
+                    continue
+            self._fertig(slot, target, slot.write(target))
+    
+    async def _abearbeite(self, slot, auftrag):
+        """Async engine: send one command"""
+        target, callbacks = auftrag
+        if target == self.TOGGLE or target == self.LESEN:
+            target = self._aufloesen(slot, target, callbacks, await slot.read_async())
+            if target is None:
+                slot.in_flight = False
+                self.event.set()
+                return
+        self._fertig(slot, target, await slot.write_async(target))
+    
+    async def run_task(self):
+        """Async engine: start a send task per device whenever a command is due"""
+        while True:
+            now = time.time()
+            warte = 60
+            for slot in self.slots.values():
+                auftrag = self._naechster(slot, now)
+                if auftrag:
+                    asyncio.create_task(self._abearbeite(slot, auftrag))
+                elif slot.target is not None and not slot.in_flight:
+                    warte = min(warte, slot.next_try - now)
+            self.event.clear()
+            try:
+                await asyncio.wait_for(self.event.wait(), max(warte, 0.05))
+            except asyncio.TimeoutError:
+                pass
+    
+    def log_stats(self):
+        """Log write counters"""
+        self.logger.log("Befehle: {} gesendet, {} zusammengefasst",
+            self.sent_count, self.collapsed_count, sub="stats")
 
 # ==============================================================================
 # MAIN LIGHT CONTROLLER
@@ -1077,19 +3445,60 @@ class TimerManager:
 class MainLightController:
     """Controls Shelly and Nanoleaf lights"""
     
-    def __init__(self, shelly_api, nanoleaf_api, light_cache, debug_logger):
+    def __init__(self, shelly_api, nanoleaf_api, light_cache, debug_logger, command_queue=None):
         self.shelly_api = shelly_api
         # self.nanoleaf_api = nanoleaf_api  # Nanoleaf integration disabled
         self.nanoleaf_api = None
         self.light_cache = light_cache
         self.logger = debug_logger
+        self.command_queue = command_queue or CommandQueue(light_cache.config, debug_logger)
+        self.command_queue.register(
+            "shelly", self._schreibe, self._aschreibe,
+            shelly_api.lese_status, shelly_api.lese_status_async)
+        self.toggle_ziel = None      # Target of a toggle resolved from the cache, checked against was_on
+        self.toggle_on_done = None
+        self.toggle_cache_count = 0  # Toggles without prior read
+        self.toggle_read_count = 0   # Toggles that had to read first (cache stale)
+    
+    def _schreibe(self, ein):
+        """Queue writer: send Shelly state"""
+        # if self.nanoleaf_api:
+        #     self.nanoleaf_api.setze(ein)
+        ok = self.shelly_api.setze("ein" if ein else "aus")
+        self._nach_schreiben(ein, ok)
+        return ok
+    
+    async def _aschreibe(self, ein):
+        """Queue writer for the async engine"""
+        ok = await self.shelly_api.setze_async("ein" if ein else "aus")
+        self._nach_schreiben(ein, ok)
+        return ok
+    
+    def _nach_schreiben(self, ein, ok):
+        """Confirm the cache from the Switch.Set response. If a toggle was resolved
+        from the cache and was_on shows the light already had the target state,
+        the cache was stale: toggle again from the real state"""
+        if not ok:
+            # The queue retries the same target: keep the toggle for the was_on
+            # check of the retry (a newer command resets it when it supersedes)
+            return
+        ziel, on_done = self.toggle_ziel, self.toggle_on_done
+        self.toggle_ziel = self.toggle_on_done = None
+        was_on = self.shelly_api.was_on
+        if self.command_queue.queued("shelly"):
+            return  # A newer command is queued, it decides the state
+        self.light_cache.confirm(ein)
+        if ziel is ein and was_on is not None and bool(was_on) == ein:
+            self.logger.log("Toggle-Abgleich: Shelly war bereits {} - Cache veraltet, schalte {}.",
+                "an" if ein else "aus", "aus" if ein else "an", sub="shelly")
+            self.command_queue.submit(
+                "shelly", not ein, lambda new_state: self._nach_toggle(new_state, on_done))
     
     def turn_on(self):
         """Turn on main lights"""
         self.logger.log("Raum belegt (auto): Shelly wird eingeschaltet. Nanoleaf deaktiviert.")
-        self.shelly_api.setze("ein")
-        # if self.nanoleaf_api:
-        #     self.nanoleaf_api.setze(True)
+        self.toggle_ziel = None
+        self.command_queue.submit("shelly", True)
         self.light_cache.update_cache(True)
     
     def turn_off(self):
@@ -1100,30 +3509,44 @@ class MainLightController:
             return
         
         self.logger.log("Raum unbelegt: Shelly wird ausgeschaltet. Nanoleaf deaktiviert.")
-        self.shelly_api.setze("aus")
-        # if self.nanoleaf_api:
-        #     self.nanoleaf_api.setze(False)
+        self.toggle_ziel = None
+        self.command_queue.submit("shelly", False)
         self.light_cache.update_cache(False)
     
-    def toggle(self):
-        """Toggle lights, returns new state"""
-        shelly_status = self.shelly_api.lese_status() or False
-        # nano_status = self.nanoleaf_api.lese_status() or False  # Nanoleaf integration disabled
-        
-        if shelly_status:
-            self.shelly_api.setze("aus")
-            # if self.nanoleaf_api:
-            #     self.nanoleaf_api.setze(False)
+    def toggle(self, on_done=None):
+        """Toggle lights. With a fresh cache the new state is known at once and
+        the write's was_on confirms it; otherwise the queue reads the device
+        first. Returns the new state, or None while the read is pending;
+        on_done receives it once known"""
+        callback = lambda new_state: self._nach_toggle(new_state, on_done)
+        if not self.command_queue.busy("shelly") and self.light_cache.is_fresh():
+            self.toggle_cache_count += 1
+            ziel = not self.light_cache.cached_light_state
+            self.toggle_ziel = ziel
+            self.toggle_on_done = on_done
+            return self.command_queue.submit("shelly", ziel, callback)
+        self.toggle_read_count += 1
+        self.toggle_ziel = None
+        return self.command_queue.submit("shelly", CommandQueue.TOGGLE, callback)
+    
+    def _nach_toggle(self, new_state, on_done):
+        """Log and cache toggle result"""
+        if new_state:
+            self.logger.log("Toggle: Shelly AUS -> EIN (Nanoleaf deaktiviert).")
+        else:
             self.logger.log("Toggle: Shelly AN -> AUS (Nanoleaf deaktiviert).")
-            self.light_cache.update_cache(False)
-            return False
-        
-        self.shelly_api.setze("ein")
-        # if self.nanoleaf_api:
-        #     self.nanoleaf_api.setze(True)
-        self.logger.log("Toggle: Shelly AUS -> EIN (Nanoleaf deaktiviert).")
-        self.light_cache.update_cache(True)
-        return True
+        self.light_cache.update_cache(new_state)
+        if on_done:
+            on_done(new_state)
+    
+    def bestaetigt(self, ein):
+        """State written outside the queue (scene) was acknowledged by the Shelly"""
+        self.light_cache.confirm(ein)
+    
+    def log_stats(self):
+        """Log how many toggles could skip the read"""
+        self.logger.log("Toggle: {} aus Cache, {} mit Statusabfrage",
+            self.toggle_cache_count, self.toggle_read_count, sub="stats")
 
 # ==============================================================================
 # WLED CONTROLLER
@@ -1131,49 +3554,330 @@ class MainLightController:
 class WLEDController:
     """Controls WLED strip"""
     
-    def __init__(self, config, wled_api, led_controller, timer_manager, debug_logger):
+    def __init__(self, config, wled_api, led_controller, timer_manager, debug_logger, command_queue=None):
         self.config = config
         self.wled_api = wled_api
         self.led_controller = led_controller
         self.timer_manager = timer_manager
         self.logger = debug_logger
         self.status = None
+        self.command_queue = command_queue or CommandQueue(config, debug_logger)
+        self.command_queue.register("wled", self._schreibe, self._aschreibe)
     
     def update_status(self):
         """Update WLED status from API"""
         self.status = self.wled_api.aktualisiere_status()
     
+    def _schreibe(self, ein):
+        """Queue writer: one attempt, the queue retries with backoff"""
+        daten = self.config.WLED_JSON_EIN if ein else self.config.WLED_JSON_AUS
+        if self.wled_api.setze(daten, versuche=1) is None:
+            return False
+        if ein:
+            self._nach_ein()
+        else:
+            self._nach_aus()
+        return True
+    
+    async def _aschreibe(self, ein):
+        """Queue writer for the async engine"""
+        daten = self.config.WLED_JSON_EIN if ein else self.config.WLED_JSON_AUS
+        if await self.wled_api.setze_async(daten, versuche=1) is None:
+            return False
+        if ein:
+            self._nach_ein()
+        else:
+            self._nach_aus()
+        return True
+    
     def turn_on(self):
         """Turn on WLED with dinner notification"""
-        new_status = self.wled_api.setze(self.config.WLED_JSON_EIN)
-        if new_status is not None:
-            self.status = True
-            self.timer_manager.set_wled_auto_off()
-            self.led_controller.display(
-                "GRUEN", self.config.WLED_LED_ON_SECONDS, force_override=True)
+        self.command_queue.submit("wled", True)
     
     def turn_off(self):
         """Turn off WLED"""
-        new_status = self.wled_api.setze(self.config.WLED_JSON_AUS)
-        if new_status is not None:
-            self.status = False
-            self.timer_manager.clear_wled_auto_off()
-            self.led_controller.display(
-                "ROT", self.config.WLED_LED_OFF_SECONDS, force_override=True)
+        self.command_queue.submit("wled", False)
+    
+    def _nach_ein(self):
+        """WLED confirmed on"""
+        if self.status is not True:
+            self.logger.ereignis(FlightRecorder.ZUSTAND, FlightRecorder.WLED, 1)
+        self.status = True
+        self.timer_manager.set_wled_auto_off()
+        self.led_controller.display(
+            "GRUEN", self.config.WLED_LED_ON_SECONDS, force_override=True)
+    
+    def _nach_aus(self):
+        """WLED confirmed off"""
+        if self.status is not False:
+            self.logger.ereignis(FlightRecorder.ZUSTAND, FlightRecorder.WLED, 0)
+        self.status = False
+        self.timer_manager.clear_wled_auto_off()
+        self.led_controller.display(
+            "ROT", self.config.WLED_LED_OFF_SECONDS, force_override=True)
+    
+    def bestaetigt(self, ein):
+        """State written outside the queue (scene) was acknowledged by WLED"""
+        if ein:
+            self._nach_ein()
+        else:
+            self._nach_aus()
     
     def toggle(self):
-        """Toggle WLED state, returns new state"""
-        if self.status is None or not self.status:
+        """Toggle WLED state (a still unsent target counts as current), returns new state"""
+        aktuell = self.command_queue.pending("wled")
+        if aktuell is None:
+            aktuell = self.status
+        if not aktuell:
             self.turn_on()
             return True
         else:
             self.turn_off()
             return False
     
-    def check_auto_off(self):
-        """Check and execute auto-off if due"""
-        if self.status and self.timer_manager.is_wled_auto_off_due():
-            self.turn_off()
+    def check_auto_off(self):
+        """Check and execute auto-off if due"""
+        if self.status and self.timer_manager.is_wled_auto_off_due():
+            if self.command_queue.busy("wled"):
+                self.timer_manager.set_wled_auto_off(1)  # Write in progress: check again shortly
+            else:
+                self.turn_off()
+
+# ==============================================================================
+# SCENES
+# ==============================================================================
+class SceneController:
+    """Named multi-device scenes. Request bytes are built once at startup and
+    sent to all devices concurrently, so a scene takes as long as the slowest
+    device. Devices that fail (or are busy in the command queue) get their
+    target through the queue, which retries with backoff"""
+    
+    def __init__(self, config, main_light_ctrl, wled_ctrl, pool, debug_logger, nanoleaf_api=None):
+        self.config = config
+        self.main_light_ctrl = main_light_ctrl
+        self.wled_ctrl = wled_ctrl
+        self.pool = pool
+        self.logger = debug_logger
+        self.command_queue = main_light_ctrl.command_queue
+        self.apis = {"shelly": main_light_ctrl.shelly_api, "wled": wled_ctrl.wled_api}
+        if nanoleaf_api:
+            self.apis["nanoleaf"] = nanoleaf_api
+        self.szenen = {}
+        for name, ziele in config.SCENES.items():
+            self.szenen[name] = [self._vorbereiten(geraet, ein)
+                                 for geraet, ein in ziele.items() if geraet in self.apis]
+        self.last_report = None  # {geraet: (ok, ms)} of the last scene
+    
+    def _vorbereiten(self, geraet, ein):
+        """Pre-serialise one device command: (geraet, ein, host, port, anfrage)"""
+        api = self.apis[geraet]
+        if geraet == "shelly":
+            anfrage = api.vorlage_setze["ein" if ein else "aus"]
+            return (geraet, ein, self.config.SHELLY_IP, self.config.SHELLY_PORT, anfrage)
+        if geraet == "nanoleaf":
+            return (geraet, ein, self.config.NANOLEAF_IP, self.config.NANOLEAF_PORT, api.vorlage_setze[bool(ein)])
+        anfrage = api.vorlage_ein if ein else api.vorlage_aus
+        return (geraet, ein, self.config.WLED_IP, self.config.WLED_PORT, anfrage)
+    
+    def _schon_erreicht(self, geraet, ein):
+        """Device is known to be in the target state already"""
+        if geraet == "shelly":
+            cache = self.main_light_ctrl.light_cache
+            return cache.last_state_known and cache.cached_light_state == ein and \
+                not self.command_queue.busy("shelly")
+        if geraet == "wled":
+            return self.wled_ctrl.status is not None and bool(self.wled_ctrl.status) == ein and \
+                not self.command_queue.busy("wled")
+        return False
+    
+    def _auswahl(self, name):
+        """Split a scene into direct sends and devices left to the command queue"""
+        direkt = []
+        for eintrag in self.szenen[name]:
+            geraet, ein = eintrag[0], eintrag[1]
+            if self._schon_erreicht(geraet, ein):
+                continue
+            if geraet in self.command_queue.slots and (
+                    self.command_queue.busy(geraet) or not self.apis[geraet].breaker.allow()):
+                # Keep write order per device / offline device: let the queue handle it
+                self.command_queue.submit(geraet, ein)
+                continue
+            direkt.append(eintrag)
+        return direkt
+    
+    def _auswerten(self, eintrag, ok, ms, report):
+        """Account for one device result of a scene"""
+        geraet, ein = eintrag[0], eintrag[1]
+        report[geraet] = (ok, ms)
+        breaker = self.apis[geraet].breaker
+        if not ok:
+            breaker.record_failure()
+            if geraet in self.command_queue.slots:
+                self.command_queue.submit(geraet, ein)
+            return
+        breaker.record_success()
+        if geraet == "shelly":
+            self.main_light_ctrl.bestaetigt(ein)
+        elif geraet == "wled":
+            self.wled_ctrl.bestaetigt(ein)
+    
+    def _melde(self, name, report, gesamt):
+        """Log per-device outcome and timing"""
+        self.last_report = report
+        if not report:
+            self.logger.log("Szene {}: alle Geräte bereits im Zielzustand.", name, sub="szene")
+            return
+        if not self.logger.aktiv(DebugLogger.INFO, "szene"):
+            return  # Skip building the per-device summary
+        teile = ["{} {} {} ms".format(g, "OK" if ok else "FEHLER", ms) for g, (ok, ms) in report.items()]
+        self.logger.log("Szene {}: {} - gesamt {} ms", name, ", ".join(teile), gesamt, sub="szene")
+    
+    def aktiviere(self, name):
+        """Blocking engine: send a scene to all devices at once, returns {geraet: (ok, ms)}"""
+        direkt = self._auswahl(name)
+        start = time.ticks_ms()
+        ergebnisse = self.pool.request_many(
+            [(e[2], e[3], e[4], self.config.SCENE_TIMEOUT, e[0] + ".szene") for e in direkt])
+        report = {}
+        for eintrag, (ergebnis, ms) in zip(direkt, ergebnisse):
+            ok = not isinstance(ergebnis, Exception) and 200 <= ergebnis[0] < 300
+            if not ok:
+                self.logger.warn("szene", "Szene {}: {} Fehler: {}", name, eintrag[0], ergebnis)
+            self._auswerten(eintrag, ok, ms, report)
+        self._melde(name, report, time.ticks_diff(time.ticks_ms(), start))
+        return report
+    
+    async def _asende(self, name, eintrag, start):
+        """Async engine: one device of a scene, returns (ok, ms)"""
+        try:
+            status, _ = await self.pool.arequest(
+                eintrag[2], eintrag[3], eintrag[4], self.config.SCENE_TIMEOUT, eintrag[0] + ".szene")
+            ok = 200 <= status < 300
+        except Exception as e:
+            self.logger.warn("szene", "Szene {}: {} Fehler: {}", name, eintrag[0], e)
+            ok = False
+        return ok, time.ticks_diff(time.ticks_ms(), start)
+    
+    async def aktiviere_async(self, name):
+        """Async engine: send a scene to all devices concurrently, returns {geraet: (ok, ms)}"""
+        direkt = self._auswahl(name)
+        start = time.ticks_ms()
+        ergebnisse = await asyncio.gather(*[self._asende(name, e, start) for e in direkt])
+        report = {}
+        for eintrag, (ok, ms) in zip(direkt, ergebnisse):
+            self._auswerten(eintrag, ok, ms, report)
+        self._melde(name, report, time.ticks_diff(time.ticks_ms(), start))
+        return report
+
+# ==============================================================================
+# EDGE QUEUE / BUTTON INPUT (IRQ)
+# ==============================================================================
+class EdgeQueue:
+    """Single-producer/single-consumer ring of (ticks_ms, level) edges.
+    The IRQ handler only writes head, the consumer only writes tail, so no
+    locking is needed; storage is preallocated, push() allocates nothing"""
+    
+    def __init__(self, size):
+        self.maske = size - 1  # size must be a power of two
+        self.zeiten = array("l", [0] * size)
+        self.werte = array("b", [0] * size)
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+        self.wecker = None  # Will be set by the room: wakes the idle loop/input task
+    
+    def push(self, t, wert):
+        """Producer (IRQ): add one edge, dropped when full"""
+        head = self.head
+        if ((head + 1) & self.maske) == self.tail:
+            self.dropped += 1
+            return
+        self.zeiten[head] = t
+        self.werte[head] = wert
+        self.head = (head + 1) & self.maske
+        if self.wecker:
+            self.wecker.set()
+    
+    def pop(self):
+        """Consumer: oldest edge as (t, wert), None if empty"""
+        tail = self.tail
+        if tail == self.head:
+            return None
+        edge = (self.zeiten[tail], self.werte[tail])
+        self.tail = (tail + 1) & self.maske
+        return edge
+    
+    def __len__(self):
+        return (self.head - self.tail) & self.maske
+
+class Wecker:
+    """Input IRQs end an idle wait early. time.sleep_ms cannot be interrupted
+    by a pin IRQ, so the blocking loop sleeps in LOOP_WAKE_MS slices and
+    checks the flag; the async input task waits on a ThreadSafeFlag"""
+    
+    def __init__(self):
+        self.gesetzt = False
+        self.flag = None  # Async engine: asyncio.ThreadSafeFlag, if the port has it
+    
+    def set(self):
+        """IRQ: an edge was queued"""
+        self.gesetzt = True
+        if self.flag:
+            self.flag.set()
+    
+    def schlafe(self, ms, scheibe):
+        """Blocking engine: sleep up to ms, return once an edge is queued"""
+        ende = time.ticks_add(time.ticks_ms(), ms)
+        while not self.gesetzt:
+            rest = time.ticks_diff(ende, time.ticks_ms())
+            if rest <= 0:
+                break
+            time.sleep_ms(min(rest, scheibe))
+        self.gesetzt = False
+
+class ButtonInput:
+    """BtnA via pin IRQ: edges are timestamped and debounced in the handler and
+    queued, so presses are measured exactly and survive blocking network calls"""
+    
+    def __init__(self, config, debug_logger):
+        self.config = config
+        self.logger = debug_logger
+        self.queue = EdgeQueue(config.EDGE_QUEUE_SIZE)
+        self.pin = machine.Pin(config.BUTTON_PIN, machine.Pin.IN, machine.Pin.PULL_UP)
+        self.level = 0           # Last accepted level: 1 = pressed
+        self.level_time = time.ticks_ms()
+        self.pin.irq(handler=self._irq, trigger=machine.Pin.IRQ_FALLING | machine.Pin.IRQ_RISING)
+    
+    def _irq(self, pin):
+        """Pin IRQ: accept a level change once the debounce time has passed"""
+        t = time.ticks_ms()
+        gedrueckt = 1 - pin.value()
+        if gedrueckt == self.level or time.ticks_diff(t, self.level_time) < self.config.BUTTON_DEBOUNCE_MS:
+            return
+        self.level = gedrueckt
+        self.level_time = t
+        self.queue.push(t, gedrueckt)
+    
+    def pruefe_pegel(self):
+        """Catch an edge lost in the bounce window: pin level differs from the last
+        accepted one after the debounce time"""
+        t = time.ticks_ms()
+        gedrueckt = 1 - self.pin.value()
+        if gedrueckt != self.level and time.ticks_diff(t, self.level_time) >= self.config.BUTTON_DEBOUNCE_MS:
+            irq_state = machine.disable_irq()
+            self.level = gedrueckt
+            self.level_time = t
+            self.queue.push(t, gedrueckt)
+            machine.enable_irq(irq_state)
+    
+    def edges(self):
+        """Consume queued edges in order: yields (ticks_ms, pressed)"""
+        self.pruefe_pegel()
+        while True:
+            edge = self.queue.pop()
+            if edge is None:
+                return
+            yield edge[0], bool(edge[1])
 
 # ==============================================================================
 # BUTTON HANDLER
@@ -1181,8 +3885,9 @@ class WLEDController:
 class ButtonHandler:
     """Handles button press logic"""
     
-    def __init__(self, config, main_light_ctrl, wled_ctrl, timer_mgr, pir_mgr, debug_logger, darkness_checker=None, led_ctrl=None):
+    def __init__(self, config, main_light_ctrl, wled_ctrl, timer_mgr, pir_mgr, debug_logger, scheduler, darkness_checker=None, led_ctrl=None):
         self.config = config
+        self.scheduler = scheduler  # Required: the double-click window is a deadline
         self.main_light_ctrl = main_light_ctrl
         self.wled_ctrl = wled_ctrl
         self.timer_mgr = timer_mgr
@@ -1194,19 +3899,23 @@ class ButtonHandler:
         self.last_release_time = 0
         self.click_pending = False
         self.button_was_pressed = False
+        self.erste_flanke = None
+        self.on_erste_reaktion = None  # on_erste_reaktion(edge ticks, device): first press acknowledged
     
-    def on_press(self):
-        """Called when button is pressed"""
+    def on_press(self, t=None):
+        """Called when button is pressed (t: edge time in ticks_ms)"""
         if self.press_start is None:
-            self.press_start = time.time()
+            self.press_start = time.ticks_ms() if t is None else t
+            if self.erste_flanke is None:
+                self.erste_flanke = self.press_start
     
-    def on_release(self):
-        """Called when button is released"""
+    def on_release(self, t=None):
+        """Called when button is released (t: edge time in ticks_ms)"""
         if self.press_start is None:
             return
         
-        now = time.time()
-        press_duration = now - self.press_start
+        now = time.ticks_ms() if t is None else t
+        press_duration = time.ticks_diff(now, self.press_start) / 1000
         self.press_start = None
         
         # Safety check for negative duration
@@ -1217,28 +3926,58 @@ class ButtonHandler:
         if press_duration >= self.config.LONG_PRESS_THRESHOLD:
             # Long press - no double click possible
             self.click_pending = False
-            self.handle_long_press()
+            self._reagiere(self.handle_long_press)
         else:
-            # Short press - check for double click
-            if self.click_pending and (now - self.last_release_time) < self.config.DOUBLE_CLICK_TIME:
+            # Short press - check for double click (edge times, so a late-processed
+            # second click still counts if it came within the window)
+            if self.click_pending and time.ticks_diff(now, self.last_release_time) < self.config.DOUBLE_CLICK_TIME * 1000:
                 # Double click detected!
                 self.click_pending = False
-                self.handle_double_click()
+                self.scheduler.cancel("klick")
+                self._reagiere(self.handle_double_click)
             else:
+                if self.click_pending:
+                    # Window of the previous click ran out before this one
+                    self.scheduler.cancel("klick")
+                    self.click_timeout()
                 # First click - wait for possible second
                 self.click_pending = True
                 self.last_release_time = now
+                self.scheduler.set("klick", self.config.DOUBLE_CLICK_TIME * 1000, self.click_timeout)
+    
+    def click_timeout(self):
+        """Double-click window passed without a second click: short press"""
+        if self.click_pending:
+            self.click_pending = False
+            self._reagiere(self.handle_short_press)
+    
+    def _reagiere(self, aktion):
+        """Run a press action. The first press is timed until the device
+        acknowledges the write it caused, or right away if it sent none"""
+        melde = self.on_erste_reaktion
+        if not melde:
+            aktion()
+            return
+        self.on_erste_reaktion = None  # Later presses must not take over the measurement
+        flanke = self.erste_flanke
+        queue = self.main_light_ctrl.command_queue
+        queue.quittung = lambda geraet: melde(flanke, geraet)
+        aktion()
+        if queue.quittung:
+            queue.quittung = None  # No device write (test mode, cancelled toggle)
+            melde(flanke, None)
     
     def handle_long_press(self):
         """Handle long press - toggle main lights"""
-        self.logger.log("Button (Langdruck): Toggle Shelly/NL – manueller Override für {} Sek.".format(
-            self.config.MANUAL_OVERRIDE_TIME))
+        self.logger.log("Button (Langdruck): Toggle Shelly/NL – manueller Override für {} Sek.",
+            self.config.MANUAL_OVERRIDE_TIME, sub="button")
         
-        new_state = self.main_light_ctrl.toggle()
         self.timer_mgr.set_manual_override()
         self.pir_mgr.clear_events()
-        
-        # Set or clear inactivity timer based on new state
+        self.main_light_ctrl.toggle(on_done=self._nach_toggle)
+    
+    def _nach_toggle(self, new_state):
+        """Set or clear inactivity timer based on new state"""
         if new_state:
             self.timer_mgr.set_last_event()
         else:
@@ -1275,6 +4014,53 @@ class ButtonHandler:
                 if self.led_ctrl:
                     self.led_ctrl.display("AUS", 0, force_override=True)
 
+# ==============================================================================
+# PIR DISPATCH (DEFERRED FROM IRQ)
+# ==============================================================================
+class PIRDispatcher:
+    """PIR IRQ callbacks only queue (time, edge) in a preallocated EdgeQueue;
+    the main loop/input task runs the PIRHandler logic (darkness check,
+    logging, light switching) outside interrupt context"""
+    
+    AKTIV = 1
+    NEGATIV = 0
+    
+    def __init__(self, config, debug_logger, handler):
+        self.config = config
+        self.logger = debug_logger
+        self.handler = handler
+        self.queue = EdgeQueue(config.PIR_QUEUE_SIZE)
+        self.pir = None  # Sensor object passed to the handler
+        self.dropped_reported = 0
+        self.trace = None  # Will be set by orchestrator
+    
+    def irq_aktiv(self, pir):
+        """IRQ: motion started"""
+        self.pir = pir
+        self.queue.push(int(time.time()), self.AKTIV)
+    
+    def irq_negativ(self, pir):
+        """IRQ: motion stopped"""
+        self.pir = pir
+        self.queue.push(int(time.time()), self.NEGATIV)
+    
+    def dispatch(self):
+        """Run the handler for all queued edges, in order"""
+        while True:
+            edge = self.queue.pop()
+            if edge is None:
+                break
+            if self.trace:
+                self.trace.kante("P", edge[1])
+            if edge[1] == self.AKTIV:
+                self.handler.on_motion_detected(self.pir, edge[0])
+            else:
+                self.handler.on_motion_stopped(self.pir)
+        if self.queue.dropped != self.dropped_reported:
+            self.logger.warn("pir", "PIR-Queue voll: {} Ereignisse verworfen.",
+                self.queue.dropped - self.dropped_reported)
+            self.dropped_reported = self.queue.dropped
+
 # ==============================================================================
 # PIR HANDLER
 # ==============================================================================
@@ -1295,9 +4081,10 @@ class PIRHandler:
         self.debounce_time = 0.1  # 100ms debounce
         self.last_active_event_time = 0
     
-    def on_motion_detected(self, pir):
-        """Called when motion is detected"""
-        now = time.time()
+    def on_motion_detected(self, pir, now=None):
+        """Called when motion is detected (now: time of the IRQ edge)"""
+        if now is None:
+            now = time.time()
         
         # Debounce check
         if now - self.last_motion_time < self.debounce_time:
@@ -1306,13 +4093,13 @@ class PIRHandler:
         
         # Check if dark enough
         if not self.darkness_checker.ist_dunkel_genug():
-            self.logger.log("PIR ignoriert: Es ist zu hell.")
+            self.logger.debug("pir", "PIR ignoriert: Es ist zu hell.")
             return
         
         # Check manual override
         if self.timer_mgr.is_manual_override_active():
             remaining = self.timer_mgr.get_manual_override_remaining()
-            self.logger.log("Manueller Override aktiv ({} Sek. verbleibend), PIR-Ereignis wird ignoriert.".format(remaining))
+            self.logger.debug("pir", "Manueller Override aktiv ({} Sek. verbleibend), PIR-Ereignis wird ignoriert.", remaining)
             return
         
         # If lights already on, just reset timer
@@ -1320,16 +4107,16 @@ class PIRHandler:
             remaining = 0
             if now - self.light_cache.last_state_update_time < self.config.CACHE_REFRESH_INTERVAL:
                 remaining = int(self.config.CACHE_REFRESH_INTERVAL - (now - self.light_cache.last_state_update_time))
-            self.logger.log(
-                "Licht bereits an – aktualisiere Inaktivitäts-Timer (nächste Prüfung in {} Sek.).".format(
-                    remaining))
+            self.logger.debug(
+                "pir", "Licht bereits an – aktualisiere Inaktivitäts-Timer (nächste Prüfung in {} Sek.).",
+                remaining)
             self.timer_mgr.set_last_event(now)
             self.pir_mgr.active = True
             self.last_active_event_time = now
             return
         
         # Add event and check threshold
-        self.logger.log("Bewegung erkannt (PIR) um {}.".format(int(now)))
+        self.logger.debug("pir", "Bewegung erkannt (PIR) um {}.", int(now))
         count = self.pir_mgr.add_event(now)
         self.timer_mgr.set_last_event(now)
         self.last_active_event_time = now
@@ -1337,8 +4124,8 @@ class PIRHandler:
         if count < self.config.EVENT_THRESHOLD:
             # Show progress LED
             color = ColorUtils.step_to_rgb(count, self.config.EVENT_THRESHOLD)
-            self.logger.log("PIR {} von {}: LED-Farbe #{:06X}".format(
-                count, self.config.EVENT_THRESHOLD, color))
+            self.logger.debug("pir", "PIR {} von {}: LED-Farbe #{:06X}",
+                              count, self.config.EVENT_THRESHOLD, color)
             self.led_ctrl.display(color, 2)
         else:
             # Threshold reached - turn on lights
@@ -1352,12 +4139,12 @@ class PIRHandler:
     def on_motion_stopped(self, pir):
         """Called when motion stops"""
         if self.timer_mgr.last_event is None:
-            self.logger.log("PIR meldet keine Aktivität. Kein Bewegungstimer aktiv.")
+            self.logger.debug("pir", "PIR meldet keine Aktivität. Kein Bewegungstimer aktiv.")
         else:
             remaining = self.timer_mgr.get_remaining_inactive_time()
-            self.logger.log("PIR meldet keine Aktivität.")
+            self.logger.debug("pir", "PIR meldet keine Aktivität.")
             if remaining is not None:
-                self.logger.log("Schalte Licht ab in {:.0f} Sekunden, sofern an.".format(remaining))
+                self.logger.debug("pir", "Schalte Licht ab in {:.0f} Sekunden, sofern an.", remaining)
         
         self.pir_mgr.active = False
         self.last_active_event_time = 0
@@ -1384,15 +4171,15 @@ class PIRHandler:
         self.timer_mgr.set_last_event(now)
 
         if self.light_cache.get_light_state():
-            self.logger.log("PIR aktiv (dauerhaft): Event {} von {} (Licht an).".format(
-                count, self.config.EVENT_THRESHOLD))
+            self.logger.debug("pir", "PIR aktiv (dauerhaft): Event {} von {} (Licht an).",
+                              count, self.config.EVENT_THRESHOLD)
             self.pir_mgr.active = True
             return
 
         if count < self.config.EVENT_THRESHOLD:
             color = ColorUtils.step_to_rgb(count, self.config.EVENT_THRESHOLD)
-            self.logger.log("PIR aktiv (dauerhaft) {} von {}: LED-Farbe #{:06X}".format(
-                count, self.config.EVENT_THRESHOLD, color))
+            self.logger.debug("pir", "PIR aktiv (dauerhaft) {} von {}: LED-Farbe #{:06X}",
+                              count, self.config.EVENT_THRESHOLD, color)
             self.led_ctrl.display(color, 2)
         else:
             self.logger.log("PIR-Schwellenwert erreicht (dauerhaft): Starte automatisches Licht-Einschalten.")
@@ -1403,75 +4190,421 @@ class PIRHandler:
         self.pir_mgr.active = True
 
 # ==============================================================================
-# MAIN ORCHESTRATOR
+# ROOM
 # ==============================================================================
-class KitchenLightOrchestrator:
-    """Main orchestrator that coordinates all components"""
+class Raum:
+    """One room: PIR, button, timers, light cache, devices and command queue.
+    The scheduler, connection pool, LED, NTP and darkness checker belong to the
+    orchestrator and are shared by all rooms"""
     
-    def __init__(self):
-        # Configuration
-        self.config = Config(test_mode=False, debug=True)
-        
-        # Debug logger
-        self.logger = DebugLogger(self.config)
-        
-        # Stability components
-        self.wifi_monitor = WiFiMonitor(self.config, self.logger)
-        self.dns_cache = DNSCache(self.config, self.logger)
+    def __init__(self, config, debug_logger, scheduler, pool, dns_cache, darkness_checker,
+                 async_mode, erster=True, mehrere=False):
+        self.config = config
+        self.name = config.RAUM_NAME
+        self.logger = RaumLogger(debug_logger, self.name) if mehrere else debug_logger
+        self.erster = erster  # First room: owns BtnA polling and the input trace
+        self.scheduler = RaumScheduler(scheduler, self.name)
+        self.pool = pool
+        self.dns_cache = dns_cache
+        self.darkness_checker = darkness_checker
+        self.async_mode = async_mode
         
-        # Hardware components
-        self.led_rgb = None
+        # Hardware components (created in setup)
         self.pir_sensor = None
+        self.pir_dispatcher = None
+        self.button_input = None
         
-        # API wrappers
-        # self.nanoleaf_api = NanoleafAPI(self.config, self.logger)  # Nanoleaf integration disabled
+        # API wrappers on the shared keep-alive pool
+        # self.nanoleaf_api = NanoleafAPI(config, self.logger, pool=pool)  # Nanoleaf integration disabled
         self.nanoleaf_api = None
-        self.shelly_api = ShellyAPI(self.config, self.logger)
-        self.wled_api = WLEDAPI(self.config, self.logger)
+        self.shelly_api = ShellyAPI(config, self.logger, pool=pool)
+        self.wled_api = WLEDAPI(config, self.logger, pool=pool)
         
         # Core components
-        self.ntp_sync = NTPSync(self.config, self.logger)
-        self.led_controller = None
-        self.darkness_checker = DarknessChecker(self.config, self.ntp_sync, self.logger)
-        self.light_cache = LightStateCache(self.config, self.shelly_api, self.nanoleaf_api, self.logger)
-        self.pir_manager = PIREventManager(self.config, self.logger)
-        self.timer_manager = TimerManager(self.config, self.logger)
+        self.light_cache = LightStateCache(config, self.shelly_api, self.nanoleaf_api, self.logger)
+        self.pir_manager = PIREventManager(config, self.logger)
+        self.timer_manager = TimerManager(config, self.logger, self.scheduler)
+        self.timer_manager.on_inactive = self.check_inactivity
+        self.shelly_push = None
+        if config.SHELLY_PUSH_ENABLED:
+            self.shelly_push = ShellyPushSubscriber(
+                config, self.logger, dns_cache, self.on_push_state, self.on_push_drop)
         
-        # Controllers (initialized without LED controller first)
+        # Controllers, writes go through the room's queue
+        self.command_queue = CommandQueue(config, self.logger)
         self.main_light_controller = MainLightController(
-            self.shelly_api, self.nanoleaf_api, self.light_cache, self.logger)
+            self.shelly_api, self.nanoleaf_api, self.light_cache, self.logger, self.command_queue)
         self.wled_controller = None
+        self.scene_controller = None
         self.button_handler = None
         self.pir_handler = None
         
         # State
         self.raum_belegt = False
-        self.last_loop_time = 0
-        self.watchdog_counter = 0
-        self.last_gc_time = 0
         self.last_state_refresh = 0
+        self.refresh_running = False  # Async engine: a refresh task is running
+        self.erste_taste = None       # ticks_ms (= ms since reset) the first press's write was acknowledged
         
-        # Hardware watchdog
-        self.wdt = None
-
+        # Cost of this room: bytes allocated, share of a loop pass in us (mean, peak)
+        self.speicher = 0
+        self.schritt_us = 0
+        self.schritt_max_us = 0
+    
+    def device_apis(self):
+        """All active device wrappers of this room"""
+        apis = [self.shelly_api, self.wled_api]
+        if self.nanoleaf_api:
+            apis.append(self.nanoleaf_api)
+        return apis
+    
+    def device_addresses(self):
+        """(host, port) of every device of this room"""
+        ziele = [(self.config.SHELLY_IP, self.config.SHELLY_PORT),
+                 (self.config.WLED_IP, self.config.WLED_PORT)]
+        if self.nanoleaf_api:
+            ziele.append((self.config.NANOLEAF_IP, self.config.NANOLEAF_PORT))
+        return ziele
+    
+    def setup(self, led_controller, trace=None, wecker=None):
+        """Hardware, controllers and the boot state refresh of this room"""
+        self.shelly_api.led_controller = led_controller
+        self.wled_api.led_controller = led_controller
+        
+        self.pir_sensor = PIRUnit(self.config.PIR_PINS)
+        
+        if self.config.BUTTON_IRQ and self.config.BUTTON_PIN is not None:
+            try:
+                self.button_input = ButtonInput(self.config, self.logger)
+                self.button_input.queue.wecker = wecker
+            except Exception as e:
+                self.logger.warn("button", "Button-IRQ nicht verfügbar: {} - {}.",
+                    e, "Polling aktiv" if self.erster else "Raum ohne Taster")
+        
+        # Initialize controllers that need hardware
+        self.wled_controller = WLEDController(
+            self.config, self.wled_api, led_controller, self.timer_manager, self.logger,
+            self.command_queue)
+        self.timer_manager.on_wled_auto_off = self.wled_controller.check_auto_off
+        self.timer_manager.plane_neu()
+        self.scene_controller = SceneController(
+            self.config, self.main_light_controller, self.wled_controller,
+            self.pool, self.logger, self.nanoleaf_api)
+        
+        # Rooms without a button pin have no button (BtnA polling is the first room's)
+        if self.button_input or self.erster:
+            self.button_handler = ButtonHandler(
+                self.config, self.main_light_controller, self.wled_controller,
+                self.timer_manager, self.pir_manager, self.logger, self.scheduler,
+                self.darkness_checker, led_controller)
+            if self.erste_taste is None:
+                self.button_handler.on_erste_reaktion = self._erste_taste
+        
+        self.pir_handler = PIRHandler(
+            self.config, self.darkness_checker, self.timer_manager, self.pir_manager,
+            self.main_light_controller, self.light_cache, led_controller, self.logger)
+        
+        # Setup PIR callbacks (IRQ only queues, the loop dispatches)
+        self.pir_dispatcher = PIRDispatcher(self.config, self.logger, self.pir_handler)
+        self.pir_dispatcher.trace = trace if self.erster else None
+        self.pir_dispatcher.queue.wecker = wecker
+        self.pir_sensor.set_callback(self.pir_dispatcher.irq_aktiv, self.pir_sensor.IRQ_ACTIVE)
+        self.pir_sensor.set_callback(self.pir_dispatcher.irq_negativ, self.pir_sensor.IRQ_NEGATIVE)
+        self.pir_sensor.enable_irq()
+        
+        # Boot state refresh as the first deadline (async: first timer pass), so
+        # inputs work before the devices have answered
+        if not self.async_mode:
+            self.scheduler.set("refresh", 0, self.boot_refresh)
+    
+    def boot_refresh(self):
+        """Blocking engine: first state refresh after boot, then the periodic one"""
+        self.refresh_light_state(force_refresh=True, reason="boot")
+        self.scheduler.set("refresh", self.config.STATE_REFRESH_INTERVAL * 1000, self.refresh_faellig)
+    
+    def refresh_due(self, now):
+        """Periodic poll is only needed while no push subscription is live"""
+        if self.shelly_push and self.shelly_push.connected:
+            return False
+        return now - self.last_state_refresh >= self.config.STATE_REFRESH_INTERVAL
+    
+    def on_push_state(self, state):
+        """Shelly reported its output (wall switch, app or our own write)"""
+        if state != self.light_cache.cached_light_state or not self.light_cache.last_state_known:
+            self.logger.log("Shelly-Push: Licht {}.", "an" if state else "aus", sub="shelly")
+        self.light_cache.confirm(state)
+        self.light_cache.push_live = True
+        if state and self.timer_manager.last_event is None:
+            self.timer_manager.set_last_event()
+            self.logger.log("Shelly ist AN (Push) -> Inaktivitaets-Timer gestartet.")
+    
+    def on_push_drop(self):
+        """Push lost: events may have been missed, poll on the next pass"""
+        self.last_state_refresh = 0
+        if not self.async_mode:
+            self.scheduler.set("refresh", 0, self.refresh_faellig)
+        self.light_cache.push_live = False
+        self.light_cache.confirmed_time = 0
+    
     def refresh_light_state(self, now=None, force_refresh=False, reason="periodisch"):
         """Refresh Shelly state and seed inactivity timer if needed"""
         if now is None:
             now = time.time()
         state = self.light_cache.get_light_state(force_refresh=force_refresh)
+        return self._nach_refresh(state, now, reason)
+    
+    async def refresh_light_state_async(self, reason="periodisch"):
+        """Non-blocking forced refresh for the async engine"""
+        now = time.time()
+        self.last_state_refresh = now  # Don't start a second refresh while this one runs
+        state = await self.light_cache.refresh_async()
+        return self._nach_refresh(state, now, reason)
+    
+    def _nach_refresh(self, state, now, reason):
+        """Log refreshed state and seed inactivity timer if needed"""
         status_text = "unbekannt"
         if self.light_cache.last_state_known:
             status_text = "an" if state else "aus"
-        self.logger.log("Status-Refresh ({}) durchgeführt status is {}.".format(reason, status_text))
+        self.logger.log("Status-Refresh ({}) durchgeführt status is {}.",
+            reason, status_text, sub="shelly")
         if state and self.timer_manager.last_event is None:
             self.timer_manager.set_last_event(now)
-            self.logger.log(
-                "Shelly ist AN ({}-Check) -> Inaktivitaets-Timer gestartet.".format(reason))
+            self.logger.log("Shelly ist AN ({}-Check) -> Inaktivitaets-Timer gestartet.",
+                reason, sub="shelly")
         self.last_state_refresh = now
+        if self.erster:
+            # Shared pool and resolver: logged once, with the first room
+            self.pool.log_stats()
+            self.dns_cache.log_stats()
+        self.command_queue.log_stats()
+        self.main_light_controller.log_stats()
+        self.log_stats()
         return state
     
+    def log_stats(self):
+        """Memory and loop cost of this room (peak since the last report)"""
+        if self.schritt_max_us == 0:
+            return
+        self.logger.log("Raum: {} Bytes, Loop-Anteil {} us (max {} us).",
+            self.speicher, self.schritt_us, self.schritt_max_us, sub="stats")
+        self.schritt_max_us = 0
+    
+    def refresh_faellig(self):
+        """Blocking engine: state refresh deadline (re-armed for the next interval)"""
+        now = time.time()
+        if self.refresh_due(now):
+            self.refresh_light_state(now=now, force_refresh=True, reason="periodisch")
+            rest = self.config.STATE_REFRESH_INTERVAL
+        else:
+            # Push live (or refreshed meanwhile): look again when the interval would end
+            rest = max(1, self.config.STATE_REFRESH_INTERVAL - (now - self.last_state_refresh))
+        self.scheduler.set("refresh", rest * 1000, self.refresh_faellig)
+    
+    def szene(self, name):
+        """Activate a scene with the running engine (async: as its own task)"""
+        if self.async_mode:
+            asyncio.create_task(self.scene_controller.aktiviere_async(name))
+        else:
+            self.scene_controller.aktiviere(name)
+    
+    def check_inactivity(self):
+        """Check for inactivity timeout (auto-off)"""
+        if self.timer_manager.is_inactive_timeout_reached():
+            self.logger.log("Inaktivität erkannt ({} Sek.) – schalte Licht aus.",
+                int(time.time() - self.timer_manager.last_event), sub="timer")
+            self.main_light_controller.turn_off()
+            self.timer_manager.clear_last_event()
+            self.pir_manager.clear_events()
+            self.raum_belegt = False
+    
+    def poll_button(self):
+        """Button edge handling (the double-click window is a scheduler deadline)"""
+        if self.button_input:
+            # IRQ edges with their own timestamps, in order
+            trace = self.pir_dispatcher.trace
+            for t, gedrueckt in self.button_input.edges():
+                if trace:
+                    trace.kante("B", gedrueckt, t)
+                if gedrueckt:
+                    self.button_handler.on_press(t)
+                else:
+                    self.button_handler.on_release(t)
+            return
+        if not self.button_handler:
+            return
+        
+        # Fallback: poll BtnA
+        button_pressed = BtnA.isPressed()
+        trace = self.pir_dispatcher.trace
+        if trace and button_pressed != self.button_handler.button_was_pressed:
+            trace.kante("B", button_pressed)
+        if button_pressed and not self.button_handler.button_was_pressed:
+            self.button_handler.on_press()
+            self.button_handler.button_was_pressed = True
+        elif not button_pressed and self.button_handler.button_was_pressed:
+            self.button_handler.on_release()
+            self.button_handler.button_was_pressed = False
+    
+    def _erste_taste(self, t, geraet):
+        """Time to first button response: ms since reset when the write of the
+        first press (edge at ticks t) was acknowledged by geraet (None: the
+        press sent nothing); logged and kept in the flight recorder"""
+        self.erste_taste = time.ticks_ms()
+        self.logger.log("Erste Tastenreaktion {} ms nach Reset (Flanke bei {} ms, bestätigt: {}).",
+            self.erste_taste, t, geraet or "-", sub="button")
+        self.logger.ereignis(FlightRecorder.TASTE, 0, self.erste_taste)
+    
+    def zeit_sprung(self, sprung):
+        """Clock was set by sprung seconds: move this room's wall-clock timestamps"""
+        self.timer_manager.verschiebe(sprung)
+        self.pir_manager.verschiebe(sprung)
+        if self.pir_handler.last_active_event_time:
+            self.pir_handler.last_active_event_time += sprung
+        if self.light_cache.confirmed_time:
+            self.light_cache.confirmed_time += sprung
+        if self.light_cache.last_state_update_time:
+            self.light_cache.last_state_update_time += sprung
+        if self.last_state_refresh:
+            self.last_state_refresh += sprung
+    
+    def tick(self, now):
+        """Per-second work: PIR window cleanup and sustained-motion events"""
+        self.pir_manager.cleanup_old_events(now)
+        self.pir_handler.on_active_motion_tick(now)
+    
+    def eingaben(self):
+        """Queued PIR and button edges"""
+        self.pir_dispatcher.dispatch()
+        self.poll_button()
+    
+    def pollt(self):
+        """Inputs of this room that are polled, not IRQ-driven: BtnA fallback, push
+        socket (also while it connects)"""
+        if self.button_handler and not self.button_input:
+            return True
+        return bool(self.shelly_push and self.shelly_push.sock)
+    
+    def schritt(self, now):
+        """Blocking engine: this room's share of a loop pass, cost is measured"""
+        start = time.ticks_us()
+        if self.shelly_push:
+            self.shelly_push.poll()
+        self.tick(now)
+        self.eingaben()
+        self.messe(start)
+    
+    def messe(self, start):
+        """Add one pass (started at ticks_us start) to the loop cost"""
+        dauer = time.ticks_diff(time.ticks_us(), start)
+        self.schritt_us += (dauer - self.schritt_us) >> 3  # Moving mean over ~8 passes
+        if dauer > self.schritt_max_us:
+            self.schritt_max_us = dauer
+
+# ==============================================================================
+# MAIN ORCHESTRATOR
+# ==============================================================================
+class KitchenLightOrchestrator:
+    """Main orchestrator: shared infrastructure and the rooms it drives"""
+    
+    def __init__(self):
+        # Configuration
+        self.config = Config(test_mode=False, debug=True)
+        
+        # Debug logger
+        self.logger = DebugLogger(self.config)
+        self.recorder = FlightRecorder(self.config, self.logger)
+        self.logger.recorder = self.recorder
+        self.trace = TraceRecorder(self.config, self.logger) if self.config.TRACE_FILE else None
+        self.recorded_free_mem = 0
+        
+        # Deadlines of all timers (inactivity, LED, click window, GC, NTP, refresh)
+        self.scheduler = DeadlineScheduler()
+        
+        # Input IRQs (button, PIR) wake the idle loop/input task
+        self.wecker = Wecker()
+        
+        # Blocking engine: running half-open probes (device API -> BreakerProbe)
+        self.proben = {}
+        
+        # Stability components
+        self.wifi_monitor = WiFiMonitor(self.config, self.logger)
+        self.dns_cache = DNSCache(self.config, self.logger)
+        
+        # Hardware components
+        self.led_rgb = None
+        
+        # One keep-alive connection pool for the devices of all rooms
+        self.connection_pool = HTTPConnectionPool(self.config, self.logger, self.dns_cache)
+        
+        # Core components
+        self.ntp_sync = NTPSync(self.config, self.logger, self.dns_cache)
+        self.led_controller = None
+        self.darkness_checker = DarknessChecker(self.config, self.ntp_sync, self.logger)
+        
+        # State
+        self.async_mode = bool(self.config.ASYNC_ENGINE and asyncio)
+        self.last_loop_time = 0
+        self.watchdog_counter = 0
+        self.bereit_ms = None  # ms from reset until the inputs were live
+        
+        # Rooms, each with its own devices, inputs and timers
+        self.raeume = []
+        self.baue_raeume()
+        
+        # Hardware watchdog
+        self.wdt = None
+    
+    def baue_raeume(self):
+        """Create one Raum per Config.RAEUME entry (None: one room from Config)"""
+        eintraege = self.config.RAEUME or ({},)
+        for i, werte in enumerate(eintraege):
+            gc.collect()
+            vorher = gc.mem_alloc()
+            raum_config = RaumConfig(self.config, werte) if werte else self.config
+            raum = Raum(raum_config, self.logger, self.scheduler, self.connection_pool,
+                        self.dns_cache, self.darkness_checker, self.async_mode,
+                        erster=(i == 0), mehrere=len(eintraege) > 1)
+            gc.collect()
+            raum.speicher = gc.mem_alloc() - vorher
+            self.raeume.append(raum)
+    
+    def device_apis(self):
+        """All active device wrappers of all rooms"""
+        apis = []
+        for raum in self.raeume:
+            apis.extend(raum.device_apis())
+        return apis
+    
+    def check_breakers(self):
+        """Blocking engine: start due half-open probes and advance running ones"""
+        for raum in self.raeume:
+            for api in raum.device_apis():
+                probe = self.proben.get(api)
+                if probe:
+                    ergebnis = probe.schritt()
+                    if ergebnis is None:
+                        continue
+                    del self.proben[api]
+                    if ergebnis:
+                        api.breaker.record_success()
+                    else:
+                        api.breaker.record_failure()
+                elif api.breaker.probe_due():
+                    api.breaker.start_probe()
+                    self.proben[api] = api.probe()
+    
+    def device_addresses(self):
+        """(host, port) of every configured device"""
+        ziele = []
+        for raum in self.raeume:
+            ziele.extend(raum.device_addresses())
+        return ziele
+    
     def setup(self):
         """Initialize all components"""
+        # After a crash setup() runs again: deadlines of the previous run would
+        # fire against its LED controller and button handlers
+        self.scheduler.clear()
+        
         # Initialize M5Stack
         M5.begin()
         reset_reason = machine.reset_cause()
@@ -1488,7 +4621,7 @@ class KitchenLightOrchestrator:
             if value is not None:
                 reset_map[value] = label
         reset_label = reset_map.get(reset_reason, str(reset_reason))
-        self.logger.log("Reset cause: {} ({})".format(reset_label, reset_reason))
+        self.logger.log("Reset cause: {} ({})", reset_label, reset_reason)
         
         # Boot diagnostics
         version = getattr(sys, "version", "unknown")
@@ -1497,128 +4630,110 @@ class KitchenLightOrchestrator:
         if isinstance(freq, tuple) and freq:
             freq = freq[0]
         freq_mhz = freq // 1_000_000 if isinstance(freq, int) and freq > 0 else freq
-        self.logger.log("Firmware: {} on {} @ {} MHz".format(
-            version.split(" ")[0] if isinstance(version, str) else version,
-            platform,
-            freq_mhz))
+        self.logger.log("Firmware: {} on {} @ {} MHz",
+            version.split(" ")[0] if isinstance(version, str) else version, platform, freq_mhz)
         
         try:
             german_offset = TimeUtils.get_germany_offset()
-            self.logger.log("Time offset (Germany): {}s".format(german_offset))
+            self.logger.log("Time offset (Germany): {}s", german_offset)
         except Exception as offset_error:
-            self.logger.log("Time offset check fehlgeschlagen: {}".format(offset_error))
+            self.logger.log("Time offset check fehlgeschlagen: {}", offset_error)
         
         watchdog_status = "ON ({}s)".format(self.config.WATCHDOG_TIMEOUT // 1000) \
             if self.config.WATCHDOG_ENABLED else "OFF"
+        self.logger.log("Config: test_mode={}, debug={}, watchdog={}",
+            self.config.TESTMODE, self.config.DEBUG, watchdog_status)
         self.logger.log(
-            "Config: test_mode={}, debug={}, watchdog={}".format(
-                self.config.TESTMODE, self.config.DEBUG, watchdog_status))
-        self.logger.log(
-            "Timers: inactivity={}s, manual_override={}s, PIR threshold={} events/{}s window, PIR active interval={}s".format(
-                self.config.INAKT_TIMEOUT,
-                self.config.MANUAL_OVERRIDE_TIME,
-                self.config.EVENT_THRESHOLD,
-                self.config.PIR_WINDOW,
-                self.config.PIR_ACTIVE_INTERVAL))
-        if esp32:
-            try:
-                rtc_memory = esp32.RTC().memory()
-                if rtc_memory:
-                    self.logger.log("RTC memory: {}".format(rtc_memory))
-                else:
-                    self.logger.log("RTC memory leer.")
-            except Exception as rtc_error:
-                self.logger.log("RTC memory nicht verfügbar: {}".format(rtc_error))
+            "Timers: inactivity={}s, manual_override={}s, PIR threshold={} events/{}s window, PIR active interval={}s",
+            self.config.INAKT_TIMEOUT, self.config.MANUAL_OVERRIDE_TIME, self.config.EVENT_THRESHOLD,
+            self.config.PIR_WINDOW, self.config.PIR_ACTIVE_INTERVAL)
+        if len(self.raeume) > 1:
+            self.logger.log("Räume: {}", ", ".join(raum.name for raum in self.raeume))
+        wiederhergestellt = self.recorder.laden()
+        if wiederhergestellt:
+            self.logger.log("Flugschreiber: {} Ereignisse vor dem Neustart ({}):",
+                wiederhergestellt, self.recorder.quelle)
+            self.recorder.log_verlauf()
         else:
-            self.logger.log("RTC memory: esp32-Modul nicht verfügbar.")
-        self.logger.log("Memory pre-GC: {} KB frei, {} KB belegt".format(
-            gc.mem_free() // 1024, gc.mem_alloc() // 1024))
+            self.logger.log("Flugschreiber leer.")
+        self.recorder.ereignis(FlightRecorder.BOOT, 0, reset_reason if isinstance(reset_reason, int) else -1)
+        self.logger.log("Memory pre-GC: {} KB frei, {} KB belegt",
+            gc.mem_free() // 1024, gc.mem_alloc() // 1024)
         
         # Initialize hardware watchdog if enabled
         if self.config.WATCHDOG_ENABLED:
             try:
                 self.wdt = WDT(timeout=self.config.WATCHDOG_TIMEOUT)
-                self.logger.log("Hardware Watchdog aktiviert: {} Sekunden Timeout".format(
-                    self.config.WATCHDOG_TIMEOUT // 1000))
+                self.logger.log("Hardware Watchdog aktiviert: {} Sekunden Timeout",
+                    self.config.WATCHDOG_TIMEOUT // 1000)
             except Exception as e:
-                self.logger.log("WARNUNG: Hardware Watchdog konnte nicht aktiviert werden: {}".format(e))
+                self.logger.warn("watchdog",
+                    "WARNUNG: Hardware Watchdog konnte nicht aktiviert werden: {}",
+                    e)
                 self.wdt = None
         
         # Pass watchdog to components that need it
-        self.ntp_sync.wdt = self.wdt
         self.wifi_monitor.wdt = self.wdt
+        self.wifi_monitor.pool = self.connection_pool
         
-        # Sync time
-        self.ntp_sync.sync_zeit(versuche=10, intervall=30)
-        
-        # Initialize hardware
+        # Initialize hardware first: LED and inputs work without network and time
         self.led_rgb = RGB(io=35, n=1, type="SK6812")
-        self.led_controller = LEDController(self.config, self.logger, self.led_rgb)
-        
-        # Set LED controller reference in API wrappers
-        # if self.nanoleaf_api:
-        #     self.nanoleaf_api.led_controller = self.led_controller
-        self.shelly_api.led_controller = self.led_controller
-        self.wled_api.led_controller = self.led_controller
+        self.led_controller = LEDController(self.config, self.logger, self.led_rgb, self.scheduler)
         
-        self.pir_sensor = PIRUnit((1, 2))
+        # Boot confirmation: 3x green blink, as deadlines of the running loop
+        self.led_controller.start_blinking("GRUEN", 0.2)
+        self.scheduler.set("boot_blink", 1200, self.led_controller.stop_blinking)
         
-        # Initialize controllers that need hardware
-        self.wled_controller = WLEDController(
-            self.config, self.wled_api, self.led_controller, self.timer_manager, self.logger)
+        # Rooms: hardware, controllers, boot refresh deadline; memory measured per room
+        for raum in self.raeume:
+            gc.collect()
+            vorher = gc.mem_alloc()
+            raum.setup(self.led_controller, self.trace, self.wecker)
+            gc.collect()
+            hardware = gc.mem_alloc() - vorher
+            self.logger.log("Raum {}: {} Bytes ({} Geräte/Timer + {} Hardware/Controller).",
+                raum.name, raum.speicher + hardware, raum.speicher, hardware)
         
-        self.button_handler = ButtonHandler(
-            self.config, self.main_light_controller, self.wled_controller,
-            self.timer_manager, self.pir_manager, self.logger,
-            self.darkness_checker, self.led_controller)
+        # Inputs are live (ticks_ms counts from the reset). Until NTP answers,
+        # DarknessChecker assumes it is dark
+        if self.bereit_ms is None:
+            self.bereit_ms = time.ticks_ms()
+            self.logger.log("Eingaben bereit {} ms nach Reset{}.",
+                self.bereit_ms,
+                "" if self.ntp_sync.zeit_sync else " (ohne Zeit-Sync: dunkel angenommen)")
+            self.logger.ereignis(FlightRecorder.BEREIT, 0, self.bereit_ms)
         
-        self.pir_handler = PIRHandler(
-            self.config, self.darkness_checker, self.timer_manager, self.pir_manager,
-            self.main_light_controller, self.light_cache, self.led_controller, self.logger)
+        # Resolve all configured devices once, so switching never waits on lwIP
+        self.dns_cache.preresolve(self.device_addresses())
         
-        # Setup PIR callbacks
-        self.pir_sensor.set_callback(self.pir_handler.on_motion_detected, self.pir_sensor.IRQ_ACTIVE)
-        self.pir_sensor.set_callback(self.pir_handler.on_motion_stopped, self.pir_sensor.IRQ_NEGATIVE)
-        self.pir_sensor.enable_irq()
-
-        # Boot state refresh: track current Shelly state for inactivity handling
-        self.refresh_light_state(force_refresh=True, reason="boot")
+        # Sync time in the background (blocking engine: deadlines, async engine: its own task)
+        self.ntp_sync.on_sync = self.nach_ntp_sync
+        if not self.async_mode:
+            self.ntp_sync.scheduler = self.scheduler
+        self.ntp_sync.starte()
         
-        # Boot confirmation: 3x green blink
-        for i in range(3):
-            self.led_rgb.fill_color(self.config.LED_COLORS["GRUEN"])
-            time.sleep(0.2)
-            self.led_rgb.fill_color(self.config.LED_COLORS["AUS"])
-            time.sleep(0.2)
-            # Feed watchdog during boot sequence
-            if self.wdt:
-                self.wdt.feed()
+        # Periodic deadlines
+        self.scheduler.every("gc", 30000, self.collect_garbage)
+        self.scheduler.every("flugschreiber", self.config.FLIGHT_SPILL_INTERVAL * 1000, self.recorder.spill)
+        if self.trace:
+            self.scheduler.every("trace", 60000, self.trace.flush)
         
         # Initial memory status
         gc.collect()
-        self.logger.log("Startup Memory: {} KB frei, {} KB belegt".format(
-            gc.mem_free() // 1024, gc.mem_alloc() // 1024))
+        self.logger.log("Startup Memory: {} KB frei, {} KB belegt",
+            gc.mem_free() // 1024, gc.mem_alloc() // 1024)
         
-        # Turn off LED
-        self.led_controller.display("AUS")
+        # From here on log lines are buffered and printed by the loop/log task
+        self.logger.gepuffert = True
     
-    def loop(self):
-        """Main loop - called repeatedly"""
-        M5.update()
-        
-        # Feed hardware watchdog if enabled
-        if self.wdt:
-            self.wdt.feed()
-        
-        # WiFi connection check
-        self.wifi_monitor.check_connection()
-        
-        # Watchdog check
-        now = time.time()
+    def check_loop_duration(self, now):
+        """Detect hangs between two loop passes"""
         if self.last_loop_time > 0:
             loop_duration = now - self.last_loop_time
             if loop_duration > 5.0:  # If loop took more than 5 seconds
-                self.logger.log("WARNUNG: Loop dauerte {} Sek. - möglicher Hang!".format(int(loop_duration)))
+                self.logger.warn("loop", "WARNUNG: Loop dauerte {} Sek. - möglicher Hang!",
+                    int(loop_duration))
+                self.logger.ereignis(FlightRecorder.LOOP, 0, loop_duration)
                 self.watchdog_counter += 1
                 if self.watchdog_counter > 3:
                     self.logger.log("KRITISCH: Mehrere langsame Loops - Neustart empfohlen!")
@@ -1626,71 +4741,219 @@ class KitchenLightOrchestrator:
             else:
                 self.watchdog_counter = 0  # Reset counter on normal operation
         self.last_loop_time = now
-
-        # Periodic light state refresh for manual changes
-        if now - self.last_state_refresh >= self.config.STATE_REFRESH_INTERVAL:
-            self.refresh_light_state(now=now, force_refresh=True, reason="periodisch")
+    
+    def collect_garbage(self):
+        """Periodic garbage collection (deadline every 30 seconds)"""
+        # Force collection to reduce fragmentation
+        gc.collect()
+        gc.threshold(gc.mem_free() // 4 + gc.mem_alloc())
         
-        # Periodic PIR event cleanup
-        self.pir_manager.cleanup_old_events(now)
-
-        # Sustained PIR activity: add periodic events
-        self.pir_handler.on_active_motion_tick(now)
+        free_mem = gc.mem_free()
+        alloc_mem = gc.mem_alloc()
         
-        # Periodic garbage collection (every 30 seconds)
-        if now - self.last_gc_time > 30:
-            # Force collection to reduce fragmentation
-            gc.collect()
-            gc.threshold(gc.mem_free() // 4 + gc.mem_alloc())
-            
-            free_mem = gc.mem_free()
-            alloc_mem = gc.mem_alloc()
-            
-            if free_mem < 10000:  # Less than 10KB free
-                self.logger.log("WARNUNG: Wenig Speicher frei: {} bytes (alloc: {})".format(
-                    free_mem, alloc_mem))
-            elif free_mem < 20000:  # Less than 20KB - early warning
-                self.logger.log("Memory: {} KB frei, {} KB belegt".format(
-                    free_mem // 1024, alloc_mem // 1024))
-            
-            self.last_gc_time = now
+        # Flight recorder: only noticeable changes, not every 30 s
+        if abs(free_mem - self.recorded_free_mem) >= 4096:
+            self.recorded_free_mem = free_mem
+            self.logger.ereignis(FlightRecorder.SPEICHER, 0, free_mem // 1024)
         
-        # Check for inactivity timeout (auto-off)
-        if self.timer_manager.is_inactive_timeout_reached():
-            self.logger.log("Inaktivität erkannt ({} Sek.) – schalte Licht aus.".format(
-                int(time.time() - self.timer_manager.last_event)))
-            self.main_light_controller.turn_off()
-            self.timer_manager.clear_last_event()
-            self.pir_manager.clear_events()
-            self.raum_belegt = False
+        if free_mem < 10000:  # Less than 10KB free
+            self.logger.warn("speicher", "WARNUNG: Wenig Speicher frei: {} bytes (alloc: {})",
+                free_mem, alloc_mem)
+        elif free_mem < 20000:  # Less than 20KB - early warning
+            self.logger.log("Memory: {} KB frei, {} KB belegt",
+                free_mem // 1024, alloc_mem // 1024, sub="speicher")
+    
+    def nach_ntp_sync(self, sprung):
+        """NTP set the clock: running timers keep their remaining time, and the
+        darkness decision is made again with the real time"""
+        if abs(sprung) >= 2:
+            self.logger.log("Uhr um {} Sek. gestellt - Timer verschoben.", sprung, sub="ntp")
+            self.logger.ereignis(FlightRecorder.NTP, 0, sprung)
+            if self.last_loop_time:
+                self.last_loop_time += sprung
+            for raum in self.raeume:
+                raum.zeit_sprung(sprung)
+            if self.trace:
+                self.trace.start_ticks = None  # Next edge starts a segment with the new epoch
+        self.darkness_checker.ist_dunkel_genug()
+    
+    def loop(self):
+        """Main loop - called repeatedly. Timers are deadlines in the scheduler;
+        the loop handles queued inputs and sleeps until the next deadline or input edge"""
+        M5.update()
         
-        # Update LED display
-        self.led_controller.update()
+        # Feed hardware watchdog if enabled
+        if self.wdt:
+            self.wdt.feed()
         
-        # Check NTP resync
-        if self.ntp_sync.should_resync():
-            self.logger.log("12h vorbei: erneute NTP-Synchronisation.")
-            self.ntp_sync.sync_zeit(versuche=10, intervall=30)
+        # WiFi connection check
+        self.wifi_monitor.check_connection()
         
-        # Check WLED auto-off
-        self.wled_controller.check_auto_off()
+        # Watchdog check
+        now = time.time()
+        self.check_loop_duration(now)
         
-        # Check for pending click timeout (for double click detection)
-        if self.button_handler.click_pending and (time.time() - self.button_handler.last_release_time) > self.config.DOUBLE_CLICK_TIME:
-            # Single click timeout - execute short press
-            self.button_handler.click_pending = False
-            self.button_handler.handle_short_press()
+        # Per room: push events, PIR window and sustained motion, queued PIR and button edges
+        for raum in self.raeume:
+            raum.schritt(now)
         
-        # Handle button
-        button_pressed = BtnA.isPressed()
-        if button_pressed and not self.button_handler.button_was_pressed:
-            self.button_handler.on_press()
-            self.button_handler.button_was_pressed = True
-        elif not button_pressed and self.button_handler.button_was_pressed:
-            self.button_handler.on_release()
-            self.button_handler.button_was_pressed = False
+        # Background DNS refresh (literals never expire)
+        self.dns_cache.refresh_stale()
+        
+        # Half-open probes of offline devices
+        self.check_breakers()
+        
+        # Due deadlines: inactivity, WLED auto-off, LED expiry/blink, click window, GC, NTP, refresh
+        self.scheduler.run_due()
         
-        time.sleep(0.1)
+        # Send queued light commands (handlers only record the target state)
+        for raum in self.raeume:
+            raum.command_queue.flush()
+        
+        # Print buffered log lines
+        self.logger.flush()
+        
+        # Sleep until the next deadline or a queued input edge; polled inputs
+        # (BtnA fallback, push socket) and running probes keep the short cap
+        warte = self.scheduler.ms_until_next()
+        grenze = self.config.LOOP_IDLE_MS if self.proben else self.config.LOOP_IDLE_IRQ_MS
+        for raum in self.raeume:
+            if raum.pollt():
+                grenze = self.config.LOOP_IDLE_MS
+                break
+        if warte is None or warte > grenze:
+            warte = grenze
+        self.wecker.schlafe(warte, self.config.LOOP_WAKE_MS)
+    
+    def run_async(self):
+        """Run the uasyncio engine until a task fails"""
+        try:
+            asyncio.run(AsyncEngine(self).run())
+        finally:
+            # Drop leftover tasks so a restart begins with an empty queue
+            asyncio.new_event_loop()
+
+# ==============================================================================
+# ASYNC ENGINE
+# ==============================================================================
+class AsyncEngine:
+    """Runs inputs, LED, timers, NTP and watchdog as independent uasyncio tasks.
+    Device writes are sent by the command queue task, so a slow or dead
+    device never delays button handling or watchdog feeding."""
+    
+    def __init__(self, orchestrator):
+        self.orch = orchestrator
+        self.config = orchestrator.config
+        self.logger = orchestrator.logger
+    
+    async def watchdog_task(self):
+        """Feed the hardware watchdog independent of all other work"""
+        while True:
+            if self.orch.wdt:
+                self.orch.wdt.feed()
+            await asyncio.sleep(1)
+    
+    async def input_task(self):
+        """Queued PIR and button edges of all rooms. Woken by the input IRQs
+        (ThreadSafeFlag); only the BtnA fallback is polled every INPUT_POLL_MS"""
+        orch = self.orch
+        intervall = self.config.INPUT_POLL_MS / 1000
+        flag = getattr(asyncio, "ThreadSafeFlag", None)
+        orch.wecker.flag = flag() if flag else None
+        while True:
+            M5.update()
+            orch.check_loop_duration(time.time())
+            pollt = orch.wecker.flag is None
+            for raum in orch.raeume:
+                start = time.ticks_us()
+                raum.eingaben()
+                raum.messe(start)
+                if raum.button_handler and not raum.button_input:
+                    pollt = True
+            if pollt:
+                await asyncio.sleep(intervall)
+                continue
+            try:
+                await asyncio.wait_for(orch.wecker.flag.wait(), self.config.LOOP_IDLE_IRQ_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def scheduler_task(self):
+        """Fire scheduler deadlines (LED, click window, inactivity, WLED auto-off, GC);
+        sleeps until the earliest one, woken early when an earlier one is armed"""
+        scheduler = self.orch.scheduler
+        wecker = asyncio.Event()
+        scheduler.on_change = wecker.set
+        while True:
+            scheduler.run_due()
+            warte = scheduler.ms_until_next()
+            wecker.clear()
+            try:
+                await asyncio.wait_for(wecker.wait(), 60 if warte is None else warte / 1000)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def timer_task(self):
+        """Once-per-second checks: WiFi, PIR ticks, refresh, DNS, breaker probes"""
+        orch = self.orch
+        while True:
+            now = time.time()
+            orch.wifi_monitor.check_connection()
+            for raum in orch.raeume:
+                if not raum.refresh_running and raum.refresh_due(now):
+                    self._starte_refresh(raum)
+                raum.tick(now)
+            orch.dns_cache.refresh_stale()
+            for api in orch.device_apis():
+                if api.breaker.probe_due():
+                    api.breaker.start_probe()
+                    asyncio.create_task(api.probe_async())
+            await asyncio.sleep(1)
+    
+    def _starte_refresh(self, raum, reason="periodisch"):
+        """Shelly state refresh of one room as its own task"""
+        raum.refresh_running = True
+        asyncio.create_task(self._refresh(raum, reason))
+    
+    async def _refresh(self, raum, reason):
+        try:
+            await raum.refresh_light_state_async(reason=reason)
+        finally:
+            raum.refresh_running = False
+    
+    async def log_task(self):
+        """Print buffered log lines in batches, yielding between batches"""
+        pause = self.config.LOG_FLUSH_MS / 1000
+        while True:
+            while self.logger.flush():
+                await asyncio.sleep(0)
+            await asyncio.sleep(pause)
+    
+    async def ntp_task(self):
+        """NTP in the background: single attempts, the pause doubles after failures"""
+        ntp_sync = self.orch.ntp_sync
+        while True:
+            await asyncio.sleep(ntp_sync.faellig_in())
+            await ntp_sync.versuch_async()
+    
+    async def run(self):
+        """Start all tasks; returns (raises) when one of them fails"""
+        self.logger.log("Async-Engine gestartet.")
+        for raum in self.orch.raeume:
+            self._starte_refresh(raum, "boot")
+        tasks = [
+            self.watchdog_task(),
+            self.input_task(),
+            self.scheduler_task(),
+            self.timer_task(),
+            self.ntp_task(),
+            self.log_task(),
+        ]
+        for raum in self.orch.raeume:
+            tasks.append(raum.command_queue.run_task())
+            if raum.shelly_push:
+                tasks.append(raum.shelly_push.run_task())
+        await asyncio.gather(*tasks)
 
 # ==============================================================================
 # MAIN ENTRY POINT
@@ -1701,13 +4964,20 @@ if __name__ == "__main__":
     while True:
         try:
             orchestrator.setup()
-            while True:
-                orchestrator.loop()
+            if orchestrator.async_mode:
+                orchestrator.run_async()
+            else:
+                while True:
+                    orchestrator.loop()
         except KeyboardInterrupt:
+            orchestrator.logger.flush_all()
             print("{} Benutzer-Interrupt.".format(
                 TimeUtils.format_debug_time(TimeUtils.local_time())))
             break
         except Exception as e:
+            orchestrator.recorder.ereignis(FlightRecorder.CRASH)
+            orchestrator.recorder.spill(erzwingen=True)
+            orchestrator.logger.flush_all()
             print("{} Fehler: {} – Neustart in 2 Sek.".format(
                 TimeUtils.format_debug_time(TimeUtils.local_time()), e))
             time.sleep(2)
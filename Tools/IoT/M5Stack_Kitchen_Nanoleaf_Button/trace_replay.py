@@ -0,0 +1,261 @@
+"""Replay recorded PIR/button traces through kitchenmove52 on the host.
+
+A trace is what the device writes with Config.TRACE_FILE set:
+
+    # kitchen-trace v1 start=1763132400
+    0 P 1
+    2013 P 0
+    61870 B 1
+    ...
+
+Each edge is fed through the real IRQ callbacks of the host simulation
+(host_sim.py), so PIRHandler, ButtonHandler, TimerManager and the loop()
+deadlines run unchanged on the virtual clock. The report shows
+throughput, API calls per hour, the wall-clock cost per handler call,
+decision latency (input edge -> Shelly write) and likely false switches
+(off with motion right after, on for under a minute).
+
+Usage:
+    python trace_replay.py trace.txt
+    python trace_replay.py --synthetic 24 --seed 3 --save synthetic.txt
+    python trace_replay.py trace.txt --set EVENT_THRESHOLD=8 --json
+"""
+import argparse
+import ast
+import json
+import random
+import sys
+import time as _time
+
+import host_sim
+
+FALSE_OFF_WINDOW = 120  # Motion this soon after an off switch: the room was not empty
+SHORT_ON = 60           # On for less than this: probably switched on by mistake
+TAIL = 900              # Seconds simulated after the last edge (timers run out)
+
+
+def load_trace(path):
+    """Parse a trace file into [(epoch seconds, "P"|"B", 1|0)] in time order"""
+    edges = []
+    start = None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("#"):
+                if "start=" in line:
+                    start = int(line.split("start=", 1)[1].split()[0])
+                continue
+            if start is None:
+                raise ValueError("{}: edge before the first header".format(path))
+            ms, kind, value = line.split()
+            edges.append((start + int(ms) / 1000, kind, int(value)))
+    edges.sort(key=lambda e: e[0])
+    return edges
+
+
+def synthetic_trace(hours, seed=0, start=host_sim.DEFAULT_START):
+    """Random evening: visits of 1-15 min, motion every 10-40 s, a few button presses"""
+    rng = random.Random(seed)
+    edges = []
+    t = start + rng.uniform(60, 600)
+    end = start + hours * 3600
+    while t < end:
+        stay = rng.uniform(60, 900)
+        visit_end = t + stay
+        while t < visit_end:
+            edges.append((t, "P", 1))
+            edges.append((t + 2, "P", 0))
+            t += rng.uniform(10, 40)
+        if rng.random() < 0.2:
+            press = t - rng.uniform(5, 30)
+            edges.append((press, "B", 1))
+            edges.append((press + rng.choice((0.2, 2.0)), "B", 0))
+        t += rng.expovariate(1 / 1500)
+    edges.sort(key=lambda e: e[0])
+    return edges
+
+
+def save_trace(edges, path):
+    start = int(edges[0][0]) if edges else 0
+    with open(path, "w") as f:
+        f.write("# kitchen-trace v1 start={}\n".format(start))
+        for t, kind, value in edges:
+            f.write("{} {} {}\n".format(int(round((t - start) * 1000)), kind, value))
+
+
+class HandlerTimer:
+    """Wraps handler methods on an instance and records their wall-clock cost"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def wrap(self, obj, name, label):
+        original = getattr(obj, name)
+        samples = self.samples.setdefault(label, [])
+
+        def timed(*args, **kwargs):
+            t0 = _time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                samples.append(_time.perf_counter() - t0)
+        setattr(obj, name, timed)
+
+    def report(self):
+        result = {}
+        for label, samples in sorted(self.samples.items()):
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            result[label] = {
+                "calls": len(samples),
+                "mean_us": round(sum(samples) / len(samples) * 1e6, 1),
+                "p95_us": round(ordered[int(0.95 * (len(ordered) - 1))] * 1e6, 1),
+            }
+        return result
+
+
+def replay(edges, overrides=None):
+    """Run the edges through a fresh simulation, returns the report dict"""
+    first = edges[0][0] if edges else host_sim.DEFAULT_START
+    sim = host_sim.Simulation(start=first - 60, quiet=True)
+    for key, value in (overrides or {}).items():
+        setattr(sim.config, key, value)
+    sim.setup()
+
+    timer = HandlerTimer()
+    room = sim.orch.raeume[0]  # Traces are recorded by the first room
+    timer.wrap(room.pir_handler, "on_motion_detected", "pir.motion")
+    timer.wrap(room.pir_handler, "on_motion_stopped", "pir.stopped")
+    timer.wrap(room.button_handler, "on_press", "button.press")
+    timer.wrap(room.button_handler, "on_release", "button.release")
+    timer.wrap(room.timer_manager, "_inaktiv_faellig", "timer.inactivity")
+
+    for t, kind, value in edges:
+        offset = t - sim.clock.now
+        if kind == "P":
+            trigger = host_sim.SimPIR.IRQ_ACTIVE if value else host_sim.SimPIR.IRQ_NEGATIVE
+            sim.at(offset, lambda trigger=trigger: sim.pir.fire(trigger))
+        elif kind == "B":
+            sim.at(offset, lambda value=value: sim.button.set(bool(value)))
+
+    duration = (edges[-1][0] - sim.clock.now if edges else 0) + TAIL
+    calls_before = len(sim.devices.calls)
+    switches_before = len(sim.devices.switches)
+    wall = _time.perf_counter()
+    sim.run(duration)
+    wall = _time.perf_counter() - wall
+
+    calls = sim.devices.calls[calls_before:]
+    hours = duration / 3600
+    report = {
+        "edges": len(edges),
+        "virtual_hours": round(hours, 2),
+        "wall_s": round(wall, 3),
+        "speedup": round(duration / wall) if wall else None,
+        "edges_per_s": round(len(edges) / wall) if wall else None,
+        "loops": sim.loops,
+        "api_calls": len(calls),
+        "api_calls_per_hour": round(len(calls) / hours, 1) if hours else 0,
+        "api_calls_by_device": _count(call[1] for call in calls),
+        "handler_cost": timer.report(),
+    }
+    report.update(_decisions(edges, sim.devices.switches[switches_before:]))
+    return report
+
+
+def _count(items):
+    counts = {}
+    for item in items:
+        counts[item] = counts.get(item, 0) + 1
+    return counts
+
+
+def _decisions(edges, switches):
+    """Decision latency and likely false switches, from the Shelly writes"""
+    inputs = [t for t, kind, value in edges if value]
+    motion = [t for t, kind, value in edges if kind == "P" and value]
+    shelly = [(t, on) for t, device, on in switches if device == "shelly"]
+    latencies = []
+    false_off = 0
+    short_on = 0
+    i = 0
+    for n, (t, on) in enumerate(shelly):
+        while i < len(inputs) and inputs[i] <= t:
+            i += 1
+        # Input-driven decision: the write follows an edge within a few seconds
+        if i and t - inputs[i - 1] <= 5:
+            latencies.append((t - inputs[i - 1]) * 1000)
+        if not on and any(t < m <= t + FALSE_OFF_WINDOW for m in motion):
+            false_off += 1
+        if on and n + 1 < len(shelly) and shelly[n + 1][0] - t < SHORT_ON:
+            short_on += 1
+    latencies.sort()
+    return {
+        "shelly_switches": len(shelly),
+        "decision_latency_ms": {
+            "count": len(latencies),
+            "mean": round(sum(latencies) / len(latencies), 1) if latencies else None,
+            "max": round(latencies[-1], 1) if latencies else None,
+        },
+        "false_off": false_off,
+        "short_on": short_on,
+    }
+
+
+def parse_overrides(pairs):
+    overrides = {}
+    for pair in pairs or ():
+        key, value = pair.split("=", 1)
+        try:
+            overrides[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[key] = value
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay PIR/button traces on the host simulation")
+    parser.add_argument("trace", nargs="?", help="Trace file written by the device")
+    parser.add_argument("--synthetic", type=float, metavar="HOURS",
+                        help="Generate a random trace of this length instead")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Write the (synthetic) trace to this file")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE",
+                        help="Override a Config attribute, e.g. EVENT_THRESHOLD=8")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        edges = synthetic_trace(args.synthetic, args.seed)
+    elif args.trace:
+        edges = load_trace(args.trace)
+    else:
+        parser.error("a trace file or --synthetic HOURS is required")
+    if args.save:
+        save_trace(edges, args.save)
+
+    report = replay(edges, parse_overrides(args.set))
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+        return 0
+    print("Replayed {} edges: {} h virtual in {} s wall ({}x, {} edges/s)".format(
+        report["edges"], report["virtual_hours"], report["wall_s"],
+        report["speedup"], report["edges_per_s"]))
+    print("API calls: {} ({} per hour) {}".format(
+        report["api_calls"], report["api_calls_per_hour"], report["api_calls_by_device"]))
+    latency = report["decision_latency_ms"]
+    print("Shelly switches: {}, decision latency mean {} ms / max {} ms (n={}), "
+          "false off: {}, short on: {}".format(
+              report["shelly_switches"], latency["mean"], latency["max"], latency["count"],
+              report["false_off"], report["short_on"]))
+    for label, cost in report["handler_cost"].items():
+        print("  {:<18} {:>6} calls  mean {:>7} us  p95 {:>7} us".format(
+            label, cost["calls"], cost["mean_us"], cost["p95_us"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())